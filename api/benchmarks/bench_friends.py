@@ -0,0 +1,97 @@
+"""Benchmark friend lookups for users with very large friend lists
+
+Run from the api directory:
+
+    python -m benchmarks.bench_friends --friends 10000
+
+By default a throwaway SQLite database is used; pass --database-url to run
+against MySQL. Compares the legacy OR query over user_id/friend_id with the
+directional user_id lookup, and times GET /api/friends cold and warm.
+"""
+import argparse
+import json
+import sys
+
+from benchmarks.common import summarize, timed, configure_environment
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark friend lookups")
+    parser.add_argument("--friends", type=int, default=10000, help="Friends of the benchmarked user")
+    parser.add_argument("--background-users", type=int, default=20000, help="Extra users with small friend lists")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    configure_environment(args.database_url, "bench_friends")
+
+    from sqlalchemy import insert, or_
+    from database import Base, engine, SessionLocal
+    from models.user import User
+    from models.friendship import Friendship, FriendshipStatus
+    from utils.auth import create_session
+    from utils.friend_cache import friend_cache
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+
+    # Seed: user 1 has --friends friends; background users form small rings
+    total_users = 1 + args.friends + args.background_users
+    first_id = (db.query(User.id).order_by(User.id.desc()).first() or (0,))[0] + 1
+    db.execute(insert(User), [
+        {"name": f"bench{first_id + i}", "email": f"bench{first_id + i}@bench.local", "password_hash": "x", "avatar": None}
+        for i in range(total_users)
+    ])
+    hub = first_id
+    rows = []
+    for friend_id in range(hub + 1, hub + 1 + args.friends):
+        rows.append({"user_id": hub, "friend_id": friend_id, "status": FriendshipStatus.accepted})
+        rows.append({"user_id": friend_id, "friend_id": hub, "status": FriendshipStatus.accepted})
+    background_start = hub + 1 + args.friends
+    for offset in range(args.background_users - 1):
+        a, b = background_start + offset, background_start + offset + 1
+        rows.append({"user_id": a, "friend_id": b, "status": FriendshipStatus.accepted})
+        rows.append({"user_id": b, "friend_id": a, "status": FriendshipStatus.accepted})
+    for start in range(0, len(rows), 10000):
+        db.execute(insert(Friendship), rows[start:start + 10000])
+    db.commit()
+
+    def legacy_query():
+        db.query(Friendship).filter(
+            or_(Friendship.user_id == hub, Friendship.friend_id == hub),
+            Friendship.status == FriendshipStatus.accepted
+        ).all()
+
+    def directional_query():
+        db.query(Friendship.friend_id).filter(
+            Friendship.user_id == hub,
+            Friendship.status == FriendshipStatus.accepted
+        ).all()
+
+    from fastapi.testclient import TestClient
+    import main as app_module
+    client = TestClient(app_module.app)
+    client.cookies.set("session_id", create_session(hub))
+
+    def endpoint_cold():
+        friend_cache.invalidate(hub)
+        response = client.get("/api/friends")
+        assert response.status_code == 200 and len(response.json()) == args.friends
+
+    def endpoint_warm():
+        response = client.get("/api/friends")
+        assert response.status_code == 200
+
+    results = {
+        "friends": args.friends,
+        "database": engine.url.get_backend_name(),
+        "legacy_or_query": summarize(timed(legacy_query, args.runs)),
+        "directional_query": summarize(timed(directional_query, args.runs)),
+        "get_friends_cold_cache": summarize(timed(endpoint_cold, args.runs)),
+        "get_friends_warm_cache": summarize(timed(endpoint_warm, args.runs)),
+    }
+    db.close()
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark the image upload transcode: full decode vs scaled decode
+
+Run from the api directory:
+
+    python -m benchmarks.bench_image_decode --runs 5 --sizes 4k,12mp
+
+For each input size a JPEG is generated and transcoded the way uploads are
+(stored image plus the chat variants), once with the old path (full decode,
+stored at original size) and once with transcode_image (draft/reduce decode,
+capped at IMAGE_MAX_EDGE). Each case runs in a fresh process so its peak RSS
+is reported alongside decode and encode times.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.common import summarize, make_photo
+
+SIZES = {
+    "4k": (3840, 2160),
+    "12mp": (4000, 3000),
+    "24mp": (6000, 4000),
+}
+
+def full_decode_transcode(src_path, dest_path, variants):
+    """The transcode used before scaled decoding, kept for comparison"""
+    from PIL import Image
+    from utils.image import _save_variants, flatten_to_rgb
+    started = time.perf_counter()
+    image = Image.open(src_path)
+    image.load()
+    image = flatten_to_rgb(image)
+    decoded = time.perf_counter()
+    image.save(dest_path, "WEBP", quality=85)
+    _save_variants(image, variants)
+    return {
+        "size": os.path.getsize(dest_path),
+        "width": image.width,
+        "height": image.height,
+        "decode_seconds": decoded - started,
+        "encode_seconds": time.perf_counter() - decoded,
+    }
+
+def run_case(mode, src_path, runs):
+    """Transcode src_path runs times in this (fresh) process"""
+    from utils.image import transcode_image, VARIANT_PROFILES
+    fn = transcode_image if mode == "scaled" else full_decode_transcode
+    workdir = tempfile.mkdtemp()
+    dest_path = os.path.join(workdir, "out.webp")
+    variants = [(os.path.join(workdir, f"{name}.webp"), edge) for name, edge in VARIANT_PROFILES["chat"].items()]
+
+    decode, encode, total = [], [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn(src_path, dest_path, variants)
+        total.append(time.perf_counter() - started)
+        decode.append(result["decode_seconds"])
+        encode.append(result["encode_seconds"])
+    return {
+        "output": f"{result['width']}x{result['height']}",
+        "output_bytes": result["size"],
+        "decode": summarize(decode),
+        "encode": summarize(encode),
+        "total": summarize(total),
+        # Linux reports ru_maxrss in KiB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark full vs scaled image decoding on upload")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--sizes", default="4k,12mp", help=f"Comma-separated: {', '.join(SIZES)}")
+    parser.add_argument("--modes", default="full,scaled", help="Comma-separated: full, scaled")
+    args = parser.parse_args()
+
+    os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp())
+    workdir = tempfile.mkdtemp()
+    context = multiprocessing.get_context("spawn")
+
+    results = {"runs": args.runs}
+    for size in [s.strip() for s in args.sizes.split(",") if s.strip()]:
+        width, height = SIZES[size]
+        src_path = os.path.join(workdir, f"{size}.jpg")
+        with open(src_path, "wb") as out:
+            out.write(make_photo(width, height))
+        results[size] = {"input": f"{width}x{height}", "input_bytes": os.path.getsize(src_path)}
+        for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            # One process per case so peak RSS is not inherited from earlier cases
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results[size][mode] = pool.submit(run_case, mode, src_path, args.runs).result()
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
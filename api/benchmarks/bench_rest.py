@@ -0,0 +1,240 @@
+"""Benchmark the hot REST endpoints against a large seeded dataset
+
+Run from the api directory:
+
+    python -m benchmarks.bench_rest --scale 0.01 --baseline benchmarks/baselines/bench_rest.json
+
+The dataset comes from scripts.generate_dataset: --scale 1 is the full
+capacity dataset (100k users, 1M friendships, 10k groups, 10M messages);
+the default 0.01 keeps a run to seconds. A database passed with
+--database-url that already has users is reused as is, so a large dataset
+only has to be seeded once:
+
+    python -m benchmarks.bench_rest --scale 1 --database-url sqlite:////tmp/capacity.db
+
+The benchmarked user is the one with the most friends, reading its busiest
+direct conversation; group history is read from the busiest group. Each
+endpoint is called --runs times in process; the report has latency
+percentiles, sequential throughput and SQL statements per request.
+
+--baseline compares against a stored run and exits with status 1 when an
+endpoint needs more queries than recorded, or its p50/p95 grew past the
+baseline's thresholds. Query counts are exact on any machine; latency
+thresholds only mean something against a baseline from the same machine.
+--write-baseline stores the current run (and thresholds) as a new baseline.
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.common import summarize, percentile, configure_environment
+
+DEFAULT_THRESHOLDS = {
+    # Allowed growth over the baseline p50 and p95, as ratios (p99 of a short run is too noisy) ...
+    "p50_ratio": 1.5,
+    "p95_ratio": 2.0,
+    # ... ignored below this many milliseconds of absolute growth (scheduler noise)
+    "latency_slack_ms": 2.0,
+    # Extra SQL statements per request allowed over the baseline
+    "extra_queries": 0,
+}
+
+class QueryCounter:
+    """Counts SQL statements sent by an engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+def pick_probes(db) -> dict:
+    """The most connected user and its busiest direct partner; the busiest group and one of its members"""
+    from sqlalchemy import func
+    from models import Friendship, GroupMember, Message
+
+    user_id = db.query(Friendship.user_id).group_by(Friendship.user_id).order_by(
+        func.count().desc(), Friendship.user_id
+    ).limit(1).scalar()
+    partner_id = db.query(Message.recipient_id).filter(
+        Message.sender_id == user_id, Message.recipient_id.isnot(None)
+    ).group_by(Message.recipient_id).order_by(func.count().desc(), Message.recipient_id).limit(1).scalar()
+    group_id = db.query(Message.group_id).filter(Message.group_id.isnot(None)).group_by(
+        Message.group_id
+    ).order_by(func.count().desc(), Message.group_id).limit(1).scalar()
+    group_user_id = db.query(GroupMember.user_id).filter(
+        GroupMember.group_id == group_id
+    ).order_by(GroupMember.user_id).limit(1).scalar() if group_id else None
+    return {"user_id": user_id, "partner_id": partner_id, "group_id": group_id, "group_user_id": group_user_id}
+
+def measure(fn, runs: int, warmup: int, counter: QueryCounter) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    queries = []
+    for _ in range(runs):
+        before = counter.count
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+        queries.append(counter.count - before)
+    return {
+        **summarize(samples),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "throughput_rps": round(len(samples) / sum(samples), 1),
+        "queries": max(queries),
+    }
+
+def compare(results: dict, baseline: dict) -> list:
+    """Regressions of results against a baseline, as human-readable strings"""
+    thresholds = {**DEFAULT_THRESHOLDS, **baseline.get("thresholds", {})}
+    regressions = []
+    for name, base in baseline["endpoints"].items():
+        current = results["endpoints"].get(name)
+        if current is None:
+            continue
+        if current["queries"] > base["queries"] + thresholds["extra_queries"]:
+            regressions.append(f"{name}: {current['queries']} queries per request, baseline {base['queries']}")
+        for key, ratio in (("p50_ms", thresholds["p50_ratio"]), ("p95_ms", thresholds["p95_ratio"])):
+            limit = max(base[key] * ratio, base[key] + thresholds["latency_slack_ms"])
+            if current[key] > limit:
+                regressions.append(f"{name}: {key} {current[key]} exceeds {round(limit, 3)} (baseline {base[key]})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark REST endpoints on a large seeded dataset")
+    parser.add_argument("--scale", type=float, default=0.01, help="Fraction of the full capacity dataset")
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--auth-runs", type=int, default=10, help="Runs for login/register, which hash with bcrypt")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--baseline", default=None, help="Fail on regressions against this baseline file")
+    parser.add_argument("--write-baseline", default=None, help="Store this run as a baseline file")
+    args = parser.parse_args()
+
+    configure_environment(args.database_url, "bench_rest")
+
+    from database import Base, engine, SessionLocal
+    from sqlalchemy import exists
+    from models import User, Message, MessageRead
+    from scripts.generate_dataset import generate, scaled_sizes, DEFAULT_PASSWORD
+    from utils.auth import create_session
+    from utils.friend_cache import friend_cache
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    sizes = scaled_sizes(args.scale)
+    seed_seconds = None
+    if db.query(User.id).first() is None:
+        # Fixed end time: identical rows, and so identical query plans, on every run
+        seed_seconds = generate(sizes, seed=args.seed, end_time=datetime(2026, 1, 1))["seconds"]["total"]
+    probes = pick_probes(db)
+    user_id, partner_id, group_id = probes["user_id"], probes["partner_id"], probes["group_id"]
+    unread_ids = [row.id for row in db.query(Message.id).filter(
+        Message.recipient_id == user_id,
+        ~exists().where(MessageRead.message_id == Message.id, MessageRead.user_id == user_id)
+    ).order_by(Message.id.desc()).limit(args.runs + args.warmup)]
+
+    from fastapi.testclient import TestClient
+    import main as app_module
+    client = TestClient(app_module.app)
+    client.cookies.set("session_id", create_session(user_id))
+    group_client = TestClient(app_module.app)
+    group_client.cookies.set("session_id", create_session(probes["group_user_id"] or user_id))
+    probe_email = db.query(User.email).filter(User.id == user_id).scalar()
+    db.close()
+    counter = QueryCounter(engine)
+
+    def get(path, via=client, **params):
+        def call():
+            response = via.get(path, params=params)
+            assert response.status_code == 200, (path, response.status_code)
+        return call
+
+    def get_friends_cold():
+        friend_cache.invalidate(user_id)
+        get("/api/friends")()
+
+    unread = iter(unread_ids)
+
+    def mark_message_read():
+        response = client.post(f"/api/messages/{next(unread)}/read")
+        assert response.status_code == 200
+
+    def auth_login():
+        response = client.post("/api/auth/login", json={"email": probe_email, "password": DEFAULT_PASSWORD})
+        assert response.status_code == 200
+
+    register_seq = iter(range(10 ** 9))
+
+    def auth_register():
+        n = next(register_seq)
+        response = client.post("/api/auth/register", json={
+            "name": f"bench-register-{n}", "email": f"register-{time.time_ns()}-{n}@bench.example.com", "password": DEFAULT_PASSWORD
+        })
+        assert response.status_code == 200
+
+    def auth_logout():
+        # Each logout ends a session of its own, so the client's session stays valid
+        session_id = create_session(user_id)
+        response = client.post("/api/auth/logout", cookies={"session_id": session_id})
+        assert response.status_code == 200
+
+    cases = {
+        "get_messages_personal": (get("/api/messages", chat_type="personal", target_id=partner_id), args.runs),
+        "get_messages_group": (get("/api/messages", via=group_client, chat_type="group", target_id=group_id), args.runs),
+        "get_groups": (get("/api/groups"), args.runs),
+        "get_friends_cold_cache": (get_friends_cold, args.runs),
+        "get_friends_warm_cache": (get("/api/friends"), args.runs),
+        "get_users": (get("/api/users"), args.runs),
+        "mark_message_read": (mark_message_read, len(unread_ids) - args.warmup),
+        "auth_me": (get("/api/auth/me"), args.runs),
+        "auth_login": (auth_login, args.auth_runs),
+        "auth_register": (auth_register, args.auth_runs),
+        "auth_logout": (auth_logout, args.runs),
+    }
+    if group_id is None:
+        del cases["get_messages_group"]
+
+    endpoints = {}
+    for name, (fn, runs) in cases.items():
+        if runs > 0:
+            endpoints[name] = measure(fn, runs, args.warmup, counter)
+
+    results = {
+        "benchmark": "rest",
+        "database": engine.url.get_backend_name(),
+        "scale": args.scale,
+        "dataset": sizes,
+        "seed": args.seed,
+        "seed_seconds": seed_seconds,
+        "probes": probes,
+        "endpoints": endpoints,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as source:
+            baseline = json.load(source)
+        if baseline.get("scale") != args.scale or baseline.get("database") != results["database"]:
+            print("Warning: baseline was recorded with a different scale or database", file=sys.stderr)
+        regressions = compare(results, baseline)
+        results["regressions"] = regressions
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as out:
+            json.dump({**results, "thresholds": DEFAULT_THRESHOLDS}, out, indent=2)
+            out.write("\n")
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+    if regressions:
+        print("Regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Benchmark image upload throughput and event-loop lag under parallel uploads
+
+Run from the api directory:
+
+    python -m benchmarks.bench_uploads --uploads 24 --concurrency 8 --megapixels 12
+
+Uploads a generated JPEG to POST /api/users/me/avatar through the ASGI app,
+once with transcoding inline on the event loop (IMAGE_WORKERS=0, the old
+behaviour) and once on the process pool. While uploads run, a probe task
+sleeps in short ticks and records how late it wakes up: that delay is what
+every WebSocket connection on the same worker would see.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.common import summarize, configure_environment, make_photo
+
+def make_jpeg(megapixels: float) -> bytes:
+    """A noisy photo-like 4:3 JPEG of roughly the given size"""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    return make_photo(width, int(width * 3 / 4))
+
+async def probe_loop_lag(stop: asyncio.Event, tick: float, samples: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(tick)
+        samples.append(max(0.0, time.perf_counter() - started - tick))
+
+async def run_mode(app, session_ids, payload, uploads, concurrency, tick):
+    import httpx
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def upload(index):
+        async with semaphore:
+            cookies = {"session_id": session_ids[index % len(session_ids)]}
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", cookies=cookies, timeout=None) as client:
+                started = time.perf_counter()
+                response = await client.post(
+                    "/api/users/me/avatar",
+                    files={"file": ("photo.jpg", payload, "image/jpeg")}
+                )
+                latencies.append(time.perf_counter() - started)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    lag_samples = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_loop_lag(stop, tick, lag_samples))
+    started = time.perf_counter()
+    await asyncio.gather(*(upload(i) for i in range(uploads)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+
+    return {
+        "seconds": round(elapsed, 3),
+        "uploads_per_second": round(uploads / elapsed, 2),
+        "status_codes": statuses,
+        "upload_latency": summarize(latencies),
+        "loop_lag": {
+            **summarize(lag_samples),
+            "max_ms": round(max(lag_samples) * 1000, 3) if lag_samples else 0.0,
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image uploads and event-loop lag")
+    parser.add_argument("--uploads", type=int, default=24)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--megapixels", type=float, default=12)
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size (default: IMAGE_WORKERS)")
+    parser.add_argument("--tick-ms", type=float, default=5, help="Loop lag probe interval")
+    parser.add_argument("--modes", default="inline,pool", help="Comma-separated: inline, pool")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    configure_environment(args.database_url, "bench_uploads")
+
+    from sqlalchemy import insert
+    from database import Base, engine, SessionLocal
+    from models.user import User
+    from utils.auth import create_session
+    import utils.image as image_utils
+    import main as app_module
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    first_id = (db.query(User.id).order_by(User.id.desc()).first() or (0,))[0] + 1
+    db.execute(insert(User), [
+        {"name": f"upload{first_id + i}", "email": f"upload{first_id + i}@bench.local", "password_hash": "x"}
+        for i in range(args.concurrency)
+    ])
+    db.commit()
+    db.close()
+    session_ids = [create_session(first_id + i) for i in range(args.concurrency)]
+
+    payload = make_jpeg(args.megapixels)
+    if args.workers is not None:
+        image_utils.IMAGE_WORKERS = args.workers
+    pool_workers = image_utils.IMAGE_WORKERS
+    image_utils.IMAGE_MAX_PENDING = max(image_utils.IMAGE_MAX_PENDING, args.concurrency)
+
+    results = {
+        "uploads": args.uploads,
+        "concurrency": args.concurrency,
+        "image_bytes": len(payload),
+        "pool_workers": pool_workers,
+    }
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        image_utils.IMAGE_WORKERS = 0 if mode == "inline" else pool_workers
+        if mode == "pool":
+            # Start the workers up front so spawn cost is not counted as upload time
+            pool = image_utils.get_image_pool()
+            for future in [pool.submit(time.sleep, 0.5) for _ in range(pool_workers)]:
+                future.result()
+        results[mode] = asyncio.run(run_mode(
+            app_module.app, session_ids, payload, args.uploads, args.concurrency, args.tick_ms / 1000
+        ))
+    image_utils.shutdown_image_pool()
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,495 @@
+"""Load-generation benchmark for the realtime path (/ws/chat)
+
+Run from the api directory:
+
+    python -m benchmarks.bench_websocket --clients 2000 --rate 500 --duration 30 \\
+        --mix direct=70,group=15,ping=10,churn=5 --output ws.json
+
+Seeds users, friendships and groups into a throwaway SQLite database (or
+--database-url), starts the app under uvicorn in a separate process, logs
+every user in and holds one /ws/chat connection per user. An open-loop
+driver then issues operations at --rate per second, picked by the --mix
+weights:
+
+    direct  text message to a connected friend
+    group   text message to a group with the sender as a member
+    ping    heartbeat, answered by the server with pong
+    churn   close a connection and reconnect it
+
+Message texts carry the send time, so every delivery to another client
+yields an end-to-end latency. Reports latency percentiles (p50/p99/p999),
+frames per second, delivery ratio and the server process' CPU and RSS as
+JSON; --output also writes it to a file so runs can be compared.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmarks.common import summarize, percentile, configure_environment
+
+PASSWORD = "bench-password"
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, _, weight = item.partition("=")
+            mix[name.strip()] = float(weight)
+    unknown = set(mix) - {"direct", "group", "ping", "churn"}
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+def latency_summary(samples):
+    if not samples:
+        return {"runs": 0}
+    return {**summarize(samples), "p999_ms": round(percentile(samples, 99.9) * 1000, 3), "max_ms": round(max(samples) * 1000, 3)}
+
+def raise_fd_limit():
+    """Thousands of sockets need more than the usual 1024 descriptors (inherited by the server)"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and (hard == resource.RLIM_INFINITY or soft < hard):
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def seed(users: int, friends_per_user: int, groups: int, group_size: int, rng: random.Random):
+    """Insert users (all with PASSWORD), symmetric friendships and groups; returns (user ids, friends, groups)"""
+    import bcrypt
+    from sqlalchemy import insert
+    from database import Base, engine, SessionLocal
+    from models import User, Friendship, FriendshipStatus, Group, GroupMember, MemberRole
+
+    Base.metadata.create_all(bind=engine)
+    # Cheap work factor: thousands of logins must not be the benchmark
+    password_hash = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(rounds=4)).decode()
+    db = SessionLocal()
+    try:
+        first_id = (db.query(User.id).order_by(User.id.desc()).first() or (0,))[0] + 1
+        user_ids = list(range(first_id, first_id + users))
+        db.execute(insert(User), [
+            {"name": f"ws{uid}", "email": f"ws{uid}@bench.example.com", "password_hash": password_hash}
+            for uid in user_ids
+        ])
+
+        # Ring lattice: each user is friends with its friends_per_user nearest neighbours
+        friends = {uid: set() for uid in user_ids}
+        for index, uid in enumerate(user_ids):
+            for step in range(1, friends_per_user // 2 + 1):
+                other = user_ids[(index + step) % users]
+                if other != uid:
+                    friends[uid].add(other)
+                    friends[other].add(uid)
+        rows = [
+            {"user_id": uid, "friend_id": other, "status": FriendshipStatus.accepted}
+            for uid, others in friends.items() for other in others
+        ]
+        for start in range(0, len(rows), 10000):
+            db.execute(insert(Friendship), rows[start:start + 10000])
+
+        group_members = {}
+        first_group = (db.query(Group.id).order_by(Group.id.desc()).first() or (0,))[0] + 1
+        db.execute(insert(Group), [
+            {"name": f"ws-group-{first_group + i}", "creator_id": user_ids[i % users]}
+            for i in range(groups)
+        ])
+        member_rows = []
+        for i in range(groups):
+            group_id = first_group + i
+            members = set(rng.sample(user_ids, min(group_size, users)))
+            members.add(user_ids[i % users])
+            group_members[group_id] = sorted(members)
+            member_rows.extend(
+                {"group_id": group_id, "user_id": uid,
+                 "role": MemberRole.admin if uid == user_ids[i % users] else MemberRole.member}
+                for uid in members
+            )
+        for start in range(0, len(member_rows), 10000):
+            db.execute(insert(GroupMember), member_rows[start:start + 10000])
+        db.commit()
+    finally:
+        db.close()
+    return user_ids, {uid: sorted(others) for uid, others in friends.items()}, group_members
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=API_DIR,
+        env=dict(os.environ)
+    )
+
+async def wait_for_server(base_url: str, process: subprocess.Popen, timeout: float = 60):
+    import httpx
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise SystemExit("Server exited during startup")
+            try:
+                if (await client.get("/api/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise SystemExit("Server did not become healthy in time")
+
+class ProcessSampler:
+    """CPU time and RSS of another process, from /proc (Linux only; reports null elsewhere)"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.rss_samples = []
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def cpu_seconds(self):
+        try:
+            with open(f"/proc/{self.pid}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.ticks
+        except OSError:
+            return None
+
+    def memory_kb(self, field: str):
+        try:
+            with open(f"/proc/{self.pid}/status") as status:
+                for line in status:
+                    if line.startswith(field + ":"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+
+    async def run(self, stop: asyncio.Event, interval: float = 0.5):
+        while not stop.is_set():
+            rss = self.memory_kb("VmRSS")
+            if rss is not None:
+                self.rss_samples.append(rss)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+class Stats:
+    def __init__(self):
+        self.delivery = []
+        self.echo = []
+        self.pong = []
+        self.connect = []
+        self.reconnect = []
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.expected_deliveries = 0
+        self.delivered = 0
+        self.ops = {}
+        self.errors = {}
+        self.driver_behind = 0
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+class SimulatedClient:
+    def __init__(self, user_id: int, session_id: str, url: str, stats: Stats):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.url = url
+        self.stats = stats
+        self.ws = None
+        self.reader = None
+        self.connected = asyncio.Event()
+        self.pings = []
+        self.busy = False
+
+    async def connect(self):
+        import websockets
+        self.connected.clear()
+        started = time.perf_counter()
+        self.ws = await websockets.connect(
+            self.url,
+            additional_headers={"Cookie": f"session_id={self.session_id}"},
+            open_timeout=60,
+            ping_interval=None,
+            max_queue=None
+        )
+        self.reader = asyncio.create_task(self.read())
+        await asyncio.wait_for(self.connected.wait(), timeout=60)
+        return time.perf_counter() - started
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.reader is not None:
+            await asyncio.gather(self.reader, return_exceptions=True)
+        self.ws = None
+
+    def is_open(self) -> bool:
+        return self.ws is not None and self.connected.is_set() and not self.busy
+
+    async def send(self, frame: dict):
+        await self.ws.send(json.dumps(frame))
+        self.stats.frames_sent += 1
+
+    def handle(self, frame: dict, now: float):
+        kind = frame.get("type")
+        if kind == "message":
+            text = frame.get("text") or ""
+            if text.startswith("bench:"):
+                latency = now - float(text.split(":", 2)[1])
+                if frame.get("sender_id") == self.user_id:
+                    self.stats.echo.append(latency)
+                else:
+                    self.stats.delivery.append(latency)
+                    self.stats.delivered += 1
+        elif kind == "bundle":
+            for inner in frame.get("frames", []):
+                self.handle(inner, now)
+        elif kind == "batch":
+            for inner in frame.get("messages", []):
+                self.handle(inner, now)
+        elif kind == "pong":
+            if self.pings:
+                self.stats.pong.append(now - self.pings.pop(0))
+        elif kind == "connected":
+            self.connected.set()
+
+    async def read(self):
+        import websockets
+        try:
+            async for raw in self.ws:
+                now = time.perf_counter()
+                self.stats.frames_received += 1
+                # Only decode frames the benchmark looks at; keeps the client side cheap
+                if "bench:" in raw or '"pong"' in raw or '"connected"' in raw:
+                    self.handle(json.loads(raw), now)
+        except websockets.ConnectionClosed:
+            pass
+
+async def login_all(base_url: str, user_ids, concurrency: int) -> dict:
+    import httpx
+    semaphore = asyncio.Semaphore(concurrency)
+    sessions = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        async def login(uid):
+            async with semaphore:
+                response = await client.post("/api/auth/login", json={"email": f"ws{uid}@bench.example.com", "password": PASSWORD})
+                response.raise_for_status()
+                sessions[uid] = response.cookies["session_id"]
+        await asyncio.gather(*(login(uid) for uid in user_ids))
+    return sessions
+
+async def run_operation(op: str, clients: dict, friends: dict, groups: dict, rng: random.Random, stats: Stats, background: set):
+    open_clients = [c for c in clients.values() if c.is_open()]
+    if not open_clients:
+        stats.error("no_open_clients")
+        return
+    stats.ops[op] = stats.ops.get(op, 0) + 1
+
+    if op == "direct":
+        sender = rng.choice(open_clients)
+        recipient_id = rng.choice(friends[sender.user_id]) if friends[sender.user_id] else sender.user_id
+        if clients[recipient_id].is_open() and recipient_id != sender.user_id:
+            stats.expected_deliveries += 1
+        await sender.send({"type": "message", "recipient_id": recipient_id, "text": f"bench:{time.perf_counter():.6f}:d"})
+    elif op == "group":
+        group_id = rng.choice(list(groups))
+        candidates = [clients[uid] for uid in groups[group_id] if clients[uid].is_open()]
+        if not candidates:
+            stats.error("group_without_open_members")
+            return
+        sender = rng.choice(candidates)
+        stats.expected_deliveries += len(candidates) - 1
+        await sender.send({"type": "message", "group_id": group_id, "text": f"bench:{time.perf_counter():.6f}:g"})
+    elif op == "ping":
+        client = rng.choice(open_clients)
+        client.pings.append(time.perf_counter())
+        await client.send({"type": "ping"})
+    elif op == "churn":
+        client = rng.choice(open_clients)
+        client.busy = True
+
+        async def reconnect():
+            try:
+                await client.close()
+                stats.reconnect.append(await client.connect())
+            except Exception:
+                stats.error("reconnect_failed")
+            finally:
+                client.busy = False
+
+        task = asyncio.create_task(reconnect())
+        background.add(task)
+        task.add_done_callback(background.discard)
+
+async def run_benchmark(args, user_ids, friends, groups) -> dict:
+    import httpx
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    ws_url = f"ws://127.0.0.1:{port}/ws/chat"
+    server = start_server(port)
+    stats = Stats()
+    results = {}
+    try:
+        await wait_for_server(base_url, server)
+        sampler = ProcessSampler(server.pid)
+
+        started = time.perf_counter()
+        sessions = await login_all(base_url, user_ids, args.login_concurrency)
+        results["login_seconds"] = round(time.perf_counter() - started, 3)
+
+        clients = {uid: SimulatedClient(uid, sessions[uid], ws_url, stats) for uid in user_ids}
+        semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+        async def open_client(client):
+            async with semaphore:
+                try:
+                    stats.connect.append(await client.connect())
+                except Exception:
+                    stats.error("connect_failed")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(open_client(c) for c in clients.values()))
+        results["connect_seconds"] = round(time.perf_counter() - started, 3)
+        results["connected_clients"] = sum(1 for c in clients.values() if c.is_open())
+        # Let the connect-time presence fan-out settle before measuring
+        await asyncio.sleep(args.settle)
+
+        rng = random.Random(args.seed + 1)
+        mix = parse_mix(args.mix)
+        names, weights = list(mix), list(mix.values())
+        background = set()
+        frames_before = (stats.frames_sent, stats.frames_received)
+        cpu_before = sampler.cpu_seconds()
+        client_cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+        stop_sampling = asyncio.Event()
+        sampling = asyncio.create_task(sampler.run(stop_sampling))
+
+        loop = asyncio.get_running_loop()
+        load_started = loop.time()
+        next_at = load_started
+        end_at = load_started + args.duration
+        interval = 1 / args.rate
+        while next_at < end_at:
+            try:
+                await run_operation(rng.choices(names, weights)[0], clients, friends, groups, rng, stats, background)
+            except Exception:
+                stats.error("send_failed")
+            next_at += interval
+            delay = next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -interval:
+                # Open loop: count the backlog instead of silently lowering the rate
+                stats.driver_behind += 1
+        load_seconds = loop.time() - load_started
+
+        # Give in-flight deliveries a chance to arrive
+        await asyncio.sleep(args.drain)
+        measured_seconds = loop.time() - load_started
+        cpu_after = sampler.cpu_seconds()
+        client_cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+        stop_sampling.set()
+        await sampling
+        # Reconnects still running now did not finish within the drain window
+        if background:
+            stats.errors["reconnect_unfinished"] = len(background)
+        for task in list(background):
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+
+        frames_sent = stats.frames_sent - frames_before[0]
+        frames_received = stats.frames_received - frames_before[1]
+        server_cpu = (cpu_after - cpu_before) if cpu_before is not None and cpu_after is not None else None
+        client_cpu = (client_cpu_after.ru_utime + client_cpu_after.ru_stime) - (client_cpu_before.ru_utime + client_cpu_before.ru_stime)
+        results.update({
+            "load_seconds": round(load_seconds, 3),
+            "operations": stats.ops,
+            "operations_per_second": round(sum(stats.ops.values()) / load_seconds, 1),
+            "driver_behind": stats.driver_behind,
+            "frames_sent_per_second": round(frames_sent / measured_seconds, 1),
+            "frames_received_per_second": round(frames_received / measured_seconds, 1),
+            "deliveries": {
+                "expected": stats.expected_deliveries,
+                "received": stats.delivered,
+                "ratio": round(stats.delivered / stats.expected_deliveries, 4) if stats.expected_deliveries else None,
+            },
+            "delivery_latency": latency_summary(stats.delivery),
+            "sender_echo_latency": latency_summary(stats.echo),
+            "ping_rtt": latency_summary(stats.pong),
+            "connect_latency": latency_summary(stats.connect),
+            "reconnect_latency": latency_summary(stats.reconnect),
+            "errors": stats.errors,
+            "server": {
+                "cpu_seconds": round(server_cpu, 3) if server_cpu is not None else None,
+                "cpu_percent": round(server_cpu / measured_seconds * 100, 1) if server_cpu is not None else None,
+                "rss_mb_max": round(max(sampler.rss_samples) / 1024, 1) if sampler.rss_samples else None,
+                "peak_rss_mb": round(sampler.memory_kb("VmHWM") / 1024, 1) if sampler.memory_kb("VmHWM") else None,
+            },
+            # A saturated load generator distorts latencies: check this before trusting a run
+            "client_cpu_percent": round(client_cpu / measured_seconds * 100, 1),
+        })
+
+        await asyncio.gather(*(c.close() for c in clients.values()), return_exceptions=True)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the /ws/chat realtime path")
+    parser.add_argument("--clients", type=int, default=1000, help="Simulated users, one connection each")
+    parser.add_argument("--friends-per-user", type=int, default=10)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--group-size", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=200, help="Operations per second across all clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load")
+    parser.add_argument("--mix", default="direct=70,group=15,ping=10,churn=5", help="Operation weights")
+    # Logins and connects hold a pooled DB connection across awaits; far more in flight than
+    # the pool size (15 by default) stalls the server's event loop on checkout
+    parser.add_argument("--login-concurrency", type=int, default=8)
+    parser.add_argument("--connect-concurrency", type=int, default=8)
+    parser.add_argument("--settle", type=float, default=2, help="Pause after connecting before the load starts")
+    parser.add_argument("--drain", type=float, default=3, help="Wait after the load for in-flight deliveries")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--output", default=None, help="Also write the JSON result to this file")
+    args = parser.parse_args()
+
+    configure_environment(args.database_url, "bench_websocket")
+    raise_fd_limit()
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    user_ids, friends, groups = seed(args.clients, args.friends_per_user, args.groups, args.group_size, rng)
+    seed_seconds = round(time.perf_counter() - started, 3)
+
+    results = {
+        "benchmark": "websocket",
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "config": vars(args),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "seed_seconds": seed_seconds,
+    }
+    results.update(asyncio.run(run_benchmark(args, user_ids, friends, groups)))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as out:
+            out.write(output + "\n")
+    print(output)
+
+if __name__ == "__main__":
+    main()
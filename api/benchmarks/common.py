@@ -0,0 +1,46 @@
+"""Helpers shared by the benchmark scripts"""
+import io
+import os
+import statistics
+import tempfile
+import time
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def summarize(samples):
+    return {
+        "runs": len(samples),
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+    }
+
+def timed(fn, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def configure_environment(database_url, name):
+    """Point the app at --database-url, or a throwaway SQLite file, before it is imported"""
+    if database_url:
+        os.environ["DATABASE_URL"] = database_url
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(), f"{name}.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp())
+
+def make_photo(width, height, quality=90):
+    """A noisy photo-like JPEG of the given size"""
+    from PIL import Image
+    noise = Image.effect_noise((width, height), 48)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    image = Image.merge("RGB", (noise, gradient, noise.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
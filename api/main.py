@@ -1,19 +1,32 @@
-from fastapi import FastAPI
+import os
+from fastapi import FastAPI, HTTPException, Request, status
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.staticfiles import StaticFiles
-import os
 from dotenv import load_dotenv
 
 from database import engine, Base
-from routers import auth, users, friends, groups, messages
+from routers import auth, users, friends, groups, messages, sync, uploads
 from websocket.chat import router as websocket_router
+from utils.group_purge import start_purge_supervisor, stop_purge_supervisor
+from utils.presence import start_presence_flusher, stop_presence_flusher
+from utils.sync import start_change_log_pruner, stop_change_log_pruner
+from utils.image import shutdown_image_pool, cleanup_upload_temp
+from utils.resumable_uploads import expire_uploads
+from utils.metrics import render_prometheus
+from utils.instrumentation import MetricsMiddleware, instrument_engine
 
 load_dotenv()
 
+# When set, GET /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# Pool checkout timing and occupancy for /metrics
+instrument_engine(engine)
+
 app = FastAPI(
     title="Chat Room API",
     description="Backend API for Chat Room application",
@@ -29,10 +42,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files for uploads
-UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/api/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+# Outermost, so route latency includes every other middleware
+app.add_middleware(MetricsMiddleware)
 
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
@@ -40,10 +51,34 @@ app.include_router(users.router, prefix="/api/users", tags=["users"])
 app.include_router(friends.router, prefix="/api/friends", tags=["friends"])
 app.include_router(groups.router, prefix="/api/groups", tags=["groups"])
 app.include_router(messages.router, prefix="/api/messages", tags=["messages"])
+app.include_router(sync.router, prefix="/api/sync", tags=["sync"])
+# Uploaded files, with on-demand resizing
+app.include_router(uploads.router, prefix="/api/uploads", tags=["uploads"])
 
 # Include WebSocket router
 app.include_router(websocket_router)
 
+@app.on_event("startup")
+async def startup():
+    # Continue group purges interrupted by a restart, and take over jobs
+    # whose worker stopped renewing its lease
+    start_purge_supervisor()
+    # Snapshot in-memory presence to the database periodically
+    start_presence_flusher()
+    # Drop change log rows past their retention
+    start_change_log_pruner()
+    # Drop partial uploads from a previous run
+    cleanup_upload_temp()
+    # And resumable uploads abandoned for longer than their TTL
+    expire_uploads()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await stop_presence_flusher()
+    stop_change_log_pruner()
+    stop_purge_supervisor()
+    shutdown_image_pool()
+
 @app.get("/")
 async def root():
     return {"message": "Chat Room API", "version": "1.0.0"}
@@ -52,6 +87,13 @@ async def root():
 async def health():
     return {"status": "ok"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus text exposition of the in-process metrics"""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
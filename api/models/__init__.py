@@ -3,10 +3,18 @@ from .friendship import Friendship, FriendshipStatus
 from .group import Group, GroupMember, GroupDeniedMember, MemberRole
 from .message import Message
 from .message_read import MessageRead
+from .change_log import ChangeLog, ChangeEntity
+from .group_purge_job import GroupPurgeJob, PurgeStatus
+from .user_presence import UserPresence
+from .attachment_blob import AttachmentBlob
 
 __all__ = [
     "User", "UserStatus",
     "Friendship", "FriendshipStatus",
     "Group", "GroupMember", "GroupDeniedMember", "MemberRole",
-    "Message", "MessageRead"
+    "Message", "MessageRead",
+    "ChangeLog", "ChangeEntity",
+    "GroupPurgeJob", "PurgeStatus",
+    "UserPresence",
+    "AttachmentBlob"
 ]
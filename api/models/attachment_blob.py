@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from database import Base
+
+class AttachmentBlob(Base):
+    """One stored upload file, shared by every message/avatar with the same source bytes"""
+    __tablename__ = "attachment_blobs"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    source_sha256 = Column(String(64), nullable=False)  # Hash of the uploaded bytes, before transcoding
+    is_image = Column(Boolean, nullable=False)  # Images are stored transcoded, other files as-is
+    filename = Column(String(255), unique=True, nullable=False)  # Name under UPLOAD_DIR
+    mime_type = Column(String(255), nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_referenced_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint('source_sha256', 'is_image', name='uq_attachment_blobs_source'),
+    )
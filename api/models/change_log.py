@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Integer, String, Enum, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from database import Base
+import enum
+
+class ChangeEntity(enum.Enum):
+    user = "user"
+    friendship = "friendship"
+    group = "group"
+
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+
+    # The autoincrement id doubles as the monotonically increasing sync version
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    entity_type = Column(Enum(ChangeEntity), nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String(50), nullable=False)
+    audience_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)  # None (and no group) = visible to every user
+    audience_group_id = Column(Integer, nullable=True)  # Visible to the group's current members; no FK, groups are purged
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_change_log_audience_id', 'audience_user_id', 'id'),
+        Index('ix_change_log_group_id', 'audience_group_id', 'id'),
+        # Per-branch max(id) lookups in get_current_version: user and global rows, then group rows
+        Index('ix_change_log_user_type', 'audience_user_id', 'audience_group_id', 'entity_type', 'id'),
+        Index('ix_change_log_group_type', 'audience_group_id', 'entity_type', 'id'),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Enum, DateTime, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Enum, DateTime, ForeignKey, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -9,6 +9,11 @@ class FriendshipStatus(enum.Enum):
     accepted = "accepted"
 
 class Friendship(Base):
+    """Directional friendship row
+
+    Every friendship is stored as two rows (a -> b and b -> a), so a user's
+    friends are always read by user_id alone through ix_friendships_user_status.
+    """
     __tablename__ = "friendships"
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
@@ -19,4 +24,6 @@ class Friendship(Base):
 
     __table_args__ = (
         UniqueConstraint('user_id', 'friend_id', name='unique_friendship'),
+        # Covering index for friend lookups: WHERE user_id = ? AND status = ?
+        Index('ix_friendships_user_status', 'user_id', 'status', 'friend_id'),
     )
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, Enum, DateTime, ForeignKey, Text
+from sqlalchemy.sql import func
+from database import Base
+import enum
+
+class PurgeStatus(enum.Enum):
+    pending = "pending"
+    running = "running"
+    completed = "completed"
+    failed = "failed"
+
+class GroupPurgeJob(Base):
+    __tablename__ = "group_purge_jobs"
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    group_id = Column(Integer, nullable=False, index=True)  # No FK: the group row is deleted last by the job
+    requested_by = Column(Integer, ForeignKey("users.id"), nullable=False)
+    status = Column(Enum(PurgeStatus), default=PurgeStatus.pending, nullable=False)
+    messages_deleted = Column(Integer, default=0, nullable=False)
+    reads_deleted = Column(Integer, default=0, nullable=False)
+    attachments_deleted = Column(Integer, default=0, nullable=False)
+    error = Column(Text, nullable=True)
+    owner = Column(String(64), nullable=True)  # Worker running the job, while its lease holds
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, CheckConstraint
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, CheckConstraint, Index
 from sqlalchemy.sql import func
 from database import Base
 
@@ -17,4 +17,8 @@ class Message(Base):
 
     __table_args__ = (
         CheckConstraint('(recipient_id IS NOT NULL) OR (group_id IS NOT NULL)', name='check_recipient_or_group'),
+        # Cursor indexes for reconnect replay (messages after a given id per conversation side)
+        Index('ix_messages_recipient_id_id', 'recipient_id', 'id'),
+        Index('ix_messages_sender_id_id', 'sender_id', 'id'),
+        Index('ix_messages_group_id_id', 'group_id', 'id'),
     )
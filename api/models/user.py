@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Enum, DateTime
+from sqlalchemy import Column, Integer, String, Enum, DateTime, Index
 from sqlalchemy.sql import func
 from database import Base
 import enum
@@ -18,3 +18,8 @@ class User(Base):
     status = Column(Enum(UserStatus), default=UserStatus.offline, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # Directory search: name prefix match with keyset pagination on (name, id)
+        Index('ix_users_name_id', 'name', 'id'),
+    )
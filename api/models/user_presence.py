@@ -0,0 +1,10 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from database import Base
+
+class UserPresence(Base):
+    """Online users per API worker, written by the periodic presence snapshot"""
+    __tablename__ = "user_presence"
+
+    worker_id = Column(String(64), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True, index=True)
+    last_seen = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -7,6 +7,9 @@ from datetime import datetime
 
 from database import get_db
 from models.user import User
+from models.change_log import ChangeEntity
+from utils.sync import record_change
+from utils.presence import presence
 from utils.auth import (
     hash_password, verify_password, create_session,
     get_current_user_dependency, delete_session
@@ -60,20 +63,22 @@ async def register(
     db.commit()
     db.refresh(new_user)
     
-    # Update user status to online
-    new_user.status = "online"
+    record_change(db, ChangeEntity.user, new_user.id, "created")
     db.commit()
     
+    # Mark user online (written to users.status by the next presence snapshot)
+    presence.set_online(new_user.id)
+    
     # Create session
     session_id = create_session(new_user.id)
     response.set_cookie(key="session_id", value=session_id, httponly=True, samesite="lax")
     
     # Broadcast user online status via WebSocket (if connected)
     try:
-        from websocket.chat import broadcast_user_status, broadcast_to_all
-        await broadcast_user_status(new_user.id, "online", broadcast_to_all_users=True)
+        from websocket.chat import broadcast_user_status, broadcast_presence_notice
+        await broadcast_user_status(new_user.id, "online", user_name=new_user.name)
         
-        # Send login notification to all users
+        # Send login notification to global presence subscribers
         login_notification = {
             "type": "user_login",
             "user_id": new_user.id,
@@ -81,12 +86,12 @@ async def register(
             "message": f"{new_user.name} 已登入",
             "timestamp": datetime.utcnow().isoformat()
         }
-        await broadcast_to_all(login_notification, exclude_user_id=new_user.id)
+        await broadcast_presence_notice(login_notification, exclude_user_id=new_user.id)
     except:
         pass  # WebSocket might not be available
     
     return {
-        "user": UserResponse.model_validate(new_user),
+        "user": presence.apply(UserResponse.model_validate(new_user)),
         "session_id": session_id
     }
 
@@ -105,9 +110,8 @@ async def login(
             detail="Invalid email or password"
         )
     
-    # Update user status to online
-    user.status = "online"
-    db.commit()
+    # Mark user online (written to users.status by the next presence snapshot)
+    presence.set_online(user.id)
     
     # Create session
     session_id = create_session(user.id)
@@ -115,10 +119,10 @@ async def login(
     
     # Broadcast user online status via WebSocket (if connected)
     try:
-        from websocket.chat import broadcast_user_status, broadcast_to_all
-        await broadcast_user_status(user.id, "online", broadcast_to_all_users=True)
+        from websocket.chat import broadcast_user_status, broadcast_presence_notice
+        await broadcast_user_status(user.id, "online", user_name=user.name)
         
-        # Send login notification to all users
+        # Send login notification to global presence subscribers
         login_notification = {
             "type": "user_login",
             "user_id": user.id,
@@ -126,12 +130,12 @@ async def login(
             "message": f"{user.name} 已登入",
             "timestamp": datetime.utcnow().isoformat()
         }
-        await broadcast_to_all(login_notification, exclude_user_id=user.id)
+        await broadcast_presence_notice(login_notification, exclude_user_id=user.id)
     except:
         pass  # WebSocket might not be available
     
     return {
-        "user": UserResponse.model_validate(user),
+        "user": presence.apply(UserResponse.model_validate(user)),
         "session_id": session_id
     }
 
@@ -143,13 +147,12 @@ async def logout(
     db: Session = Depends(get_db)
 ):
     """Logout user"""
-    # Update user status to offline
-    current_user.status = "offline"
-    db.commit()
+    # Mark user offline (written to users.status by the next presence snapshot)
+    presence.set_offline(current_user.id)
     
     # Broadcast user offline status to all friends via WebSocket
     try:
-        from websocket.chat import broadcast_user_status, active_connections, broadcast_to_all
+        from websocket.chat import broadcast_user_status, active_connections, broadcast_presence_notice, clear_presence_interest
         user_id = current_user.id
         
         # Close WebSocket connection if exists
@@ -160,11 +163,12 @@ async def logout(
             except:
                 pass
             del active_connections[user_id]
+        clear_presence_interest(user_id)
         
         # Broadcast status change
-        await broadcast_user_status(user_id, "offline", broadcast_to_all_users=True)
+        await broadcast_user_status(user_id, "offline", user_name=current_user.name)
         
-        # Send logout notification to all users
+        # Send logout notification to global presence subscribers
         logout_notification = {
             "type": "user_logout",
             "user_id": user_id,
@@ -172,7 +176,7 @@ async def logout(
             "message": f"{current_user.name} 已登出",
             "timestamp": datetime.utcnow().isoformat()
         }
-        await broadcast_to_all(logout_notification)
+        await broadcast_presence_notice(logout_notification)
     except Exception as e:
         print(f"Error in logout WebSocket broadcast: {e}")
         pass  # WebSocket might not be available
@@ -188,4 +192,4 @@ async def logout(
 @router.get("/me", response_model=UserResponse)
 async def get_me(user: User = Depends(get_current_user_dependency)):
     """Get current user information"""
-    return UserResponse.model_validate(user)
+    return presence.apply(UserResponse.model_validate(user))
@@ -1,13 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 from database import get_db
 from models.user import User
 from models.friendship import Friendship, FriendshipStatus
+from models.change_log import ChangeEntity
 from utils.auth import get_current_user_dependency as get_current_user
+from utils.sync import record_change, get_current_version, make_etag, not_modified
+from utils.friend_cache import friend_cache
+from utils.presence import presence
 
 router = APIRouter()
 
@@ -15,7 +18,7 @@ class UserResponse(BaseModel):
     id: int
     name: str
     email: str
-    avatar: str
+    avatar: Optional[str]
     status: str
 
     class Config:
@@ -23,30 +26,26 @@ class UserResponse(BaseModel):
 
 @router.get("", response_model=List[UserResponse])
 async def get_friends(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get friends list"""
-    # Get all accepted friendships where current user is involved
-    friendships = db.query(Friendship).filter(
-        or_(
-            Friendship.user_id == current_user.id,
-            Friendship.friend_id == current_user.id
-        ),
-        Friendship.status == FriendshipStatus.accepted
-    ).all()
+    version = get_current_version(db, current_user.id, [ChangeEntity.friendship, ChangeEntity.user])
+    etag = make_etag("friends", current_user.id, version, include_presence=True)
+    if not_modified(request, response, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
     
-    # Collect friend IDs
-    friend_ids = set()
-    for friendship in friendships:
-        if friendship.user_id == current_user.id:
-            friend_ids.add(friendship.friend_id)
-        else:
-            friend_ids.add(friendship.user_id)
+    # Friend ids come from the in-memory friend graph, checked against the
+    # friendship version so a new ETag never carries another worker's stale set
+    friend_ids = friend_cache.get_friend_ids(current_user.id, db, verify=True)
+    if not friend_ids:
+        return []
     
     # Get friend users
     friends = db.query(User).filter(User.id.in_(friend_ids)).all()
-    return [UserResponse.model_validate(friend) for friend in friends]
+    return presence.apply_all(UserResponse.model_validate(friend) for friend in friends)
 
 @router.post("/{user_id}", response_model=dict)
 async def add_friend(
@@ -69,40 +68,39 @@ async def add_friend(
             detail="User not found"
         )
     
-    # Check if friendship already exists
-    existing = db.query(Friendship).filter(
-        or_(
-            (Friendship.user_id == current_user.id) & (Friendship.friend_id == user_id),
-            (Friendship.user_id == user_id) & (Friendship.friend_id == current_user.id)
-        )
+    # Look up both directional rows through the unique (user_id, friend_id) index
+    forward = db.query(Friendship).filter(
+        Friendship.user_id == current_user.id,
+        Friendship.friend_id == user_id
     ).first()
+    reverse = db.query(Friendship).filter(
+        Friendship.user_id == user_id,
+        Friendship.friend_id == current_user.id
+    ).first()
+    
+    if (forward and forward.status == FriendshipStatus.accepted
+            and reverse and reverse.status == FriendshipStatus.accepted):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Already friends"
+        )
     
-    if existing:
-        if existing.status == FriendshipStatus.accepted:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Already friends"
-            )
+    # Create or accept both directions of the friendship
+    for row, owner_id, other_id in ((forward, current_user.id, user_id), (reverse, user_id, current_user.id)):
+        if row:
+            row.status = FriendshipStatus.accepted
         else:
-            # Update to accepted
-            existing.status = FriendshipStatus.accepted
-            db.commit()
-            return {"message": "Friend added successfully"}
+            db.add(Friendship(
+                user_id=owner_id,
+                friend_id=other_id,
+                status=FriendshipStatus.accepted
+            ))
     
-    # Create bidirectional friendship
-    friendship1 = Friendship(
-        user_id=current_user.id,
-        friend_id=user_id,
-        status=FriendshipStatus.accepted
-    )
-    friendship2 = Friendship(
-        user_id=user_id,
-        friend_id=current_user.id,
-        status=FriendshipStatus.accepted
-    )
-    db.add(friendship1)
-    db.add(friendship2)
+    # entity_id is the other side of the friendship from the audience's point of view
+    record_change(db, ChangeEntity.friendship, user_id, "added", [current_user.id])
+    record_change(db, ChangeEntity.friendship, current_user.id, "added", [user_id])
     db.commit()
+    friend_cache.add_friendship(current_user.id, user_id)
     
     # Broadcast friend change via WebSocket
     try:
@@ -122,12 +120,13 @@ async def remove_friend(
     """Remove friend"""
     # Delete both directions of friendship
     db.query(Friendship).filter(
-        or_(
-            (Friendship.user_id == current_user.id) & (Friendship.friend_id == user_id),
-            (Friendship.user_id == user_id) & (Friendship.friend_id == current_user.id)
-        )
-    ).delete()
+        Friendship.user_id.in_([current_user.id, user_id]),
+        Friendship.friend_id.in_([current_user.id, user_id])
+    ).delete(synchronize_session=False)
+    record_change(db, ChangeEntity.friendship, user_id, "removed", [current_user.id])
+    record_change(db, ChangeEntity.friendship, current_user.id, "removed", [user_id])
     db.commit()
+    friend_cache.remove_friendship(current_user.id, user_id)
     
     # Broadcast friend change via WebSocket
     try:
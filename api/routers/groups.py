@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
 from sqlalchemy.orm import Session
+from sqlalchemy import insert
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Iterable, List, Optional, Set
 
 from database import get_db
 from models.user import User
 from models.group import Group, GroupMember, GroupDeniedMember, MemberRole
+from models.change_log import ChangeEntity
+from models.group_purge_job import GroupPurgeJob
 from utils.auth import get_current_user_dependency as get_current_user
+from utils.sync import record_change, get_current_version, make_etag, not_modified
+from utils.group_purge import start_group_purge
+from utils.group_cache import group_member_cache
 
 router = APIRouter()
 
@@ -20,6 +26,61 @@ class GroupResponse(BaseModel):
     class Config:
         from_attributes = True
 
+def build_group_responses(db: Session, groups: List[Group]) -> List[GroupResponse]:
+    """Build responses for many groups with one members query and one denied query"""
+    group_ids = [group.id for group in groups]
+    members_by_group = {group_id: [] for group_id in group_ids}
+    denied_by_group = {group_id: [] for group_id in group_ids}
+    
+    if group_ids:
+        for gm in db.query(GroupMember.group_id, GroupMember.user_id).filter(
+            GroupMember.group_id.in_(group_ids)
+        ).all():
+            members_by_group[gm.group_id].append(gm.user_id)
+        for dm in db.query(GroupDeniedMember.group_id, GroupDeniedMember.user_id).filter(
+            GroupDeniedMember.group_id.in_(group_ids)
+        ).all():
+            denied_by_group[dm.group_id].append(dm.user_id)
+    
+    return [
+        GroupResponse(
+            id=group.id,
+            name=group.name,
+            creator_id=group.creator_id,
+            members=members_by_group[group.id],
+            denied_members=denied_by_group[group.id]
+        )
+        for group in groups
+    ]
+
+def existing_user_ids(db: Session, user_ids: Iterable[int]) -> Set[int]:
+    """Return the subset of user_ids that exist, with a single query"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return set()
+    return {u.id for u in db.query(User.id).filter(User.id.in_(user_ids)).all()}
+
+def current_member_ids(db: Session, group_id: int) -> Set[int]:
+    """Return the ids of the group's current members"""
+    return {gm.user_id for gm in db.query(GroupMember.user_id).filter(
+        GroupMember.group_id == group_id
+    ).all()}
+
+def bulk_add_members(db: Session, group_id: int, user_ids: Iterable[int], role: MemberRole = MemberRole.member):
+    """Insert membership rows for many users in one statement"""
+    rows = [{"group_id": group_id, "user_id": user_id, "role": role} for user_id in user_ids]
+    if rows:
+        db.execute(insert(GroupMember), rows)
+
+def bulk_remove_members(db: Session, group_id: int, user_ids: Iterable[int]):
+    """Delete membership rows for many users in one statement"""
+    user_ids = list(user_ids)
+    if user_ids:
+        db.query(GroupMember).filter(
+            GroupMember.group_id == group_id,
+            GroupMember.user_id.in_(user_ids)
+        ).delete(synchronize_session=False)
+
 class CreateGroupRequest(BaseModel):
     name: str
     member_ids: List[int]
@@ -30,35 +91,25 @@ class UpdateGroupRequest(BaseModel):
 
 @router.get("", response_model=List[GroupResponse])
 async def get_groups(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get user's groups"""
+    version = get_current_version(db, current_user.id, [ChangeEntity.group])
+    etag = make_etag("groups", current_user.id, version)
+    if not_modified(request, response, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    
     # Get groups where user is a member
-    group_members = db.query(GroupMember).filter(
+    groups = db.query(Group).join(
+        GroupMember, GroupMember.group_id == Group.id
+    ).filter(
         GroupMember.user_id == current_user.id
     ).all()
     
-    group_ids = [gm.group_id for gm in group_members]
-    groups = db.query(Group).filter(Group.id.in_(group_ids)).all()
-    
-    result = []
-    for group in groups:
-        members = [gm.user_id for gm in db.query(GroupMember).filter(
-            GroupMember.group_id == group.id
-        ).all()]
-        denied = [dm.user_id for dm in db.query(GroupDeniedMember).filter(
-            GroupDeniedMember.group_id == group.id
-        ).all()]
-        result.append(GroupResponse(
-            id=group.id,
-            name=group.name,
-            creator_id=group.creator_id,
-            members=members,
-            denied_members=denied
-        ))
-    
-    return result
+    return build_group_responses(db, groups)
 
 @router.post("", response_model=GroupResponse)
 async def create_group(
@@ -83,27 +134,18 @@ async def create_group(
     )
     db.add(creator_member)
     
-    # Add other members
-    member_ids = set(request.member_ids)
+    # Add other members (only users that exist)
+    member_ids = existing_user_ids(db, request.member_ids)
     member_ids.discard(current_user.id)  # Remove creator if present
+    bulk_add_members(db, new_group.id, sorted(member_ids))
     
-    for member_id in member_ids:
-        # Verify user exists
-        user = db.query(User).filter(User.id == member_id).first()
-        if user:
-            member = GroupMember(
-                group_id=new_group.id,
-                user_id=member_id,
-                role=MemberRole.member
-            )
-            db.add(member)
-    
+    added_ids = [current_user.id] + sorted(member_ids)
+    record_change(db, ChangeEntity.group, new_group.id, "created", audience_group_id=new_group.id)
     db.commit()
     db.refresh(new_group)
+    group_member_cache.invalidate(new_group.id)
     
-    members = [gm.user_id for gm in db.query(GroupMember).filter(
-        GroupMember.group_id == new_group.id
-    ).all()]
+    members = added_ids
     
     # Broadcast group creation via WebSocket
     try:
@@ -150,20 +192,7 @@ async def get_group(
             detail="Not a member of this group"
         )
     
-    members = [gm.user_id for gm in db.query(GroupMember).filter(
-        GroupMember.group_id == group_id
-    ).all()]
-    denied = [dm.user_id for dm in db.query(GroupDeniedMember).filter(
-        GroupDeniedMember.group_id == group_id
-    ).all()]
-    
-    return GroupResponse(
-        id=group.id,
-        name=group.name,
-        creator_id=group.creator_id,
-        members=members,
-        denied_members=denied
-    )
+    return build_group_responses(db, [group])[0]
 
 @router.put("/{group_id}", response_model=GroupResponse)
 async def update_group(
@@ -192,59 +221,44 @@ async def update_group(
             detail="Only group creator or admin can update group"
         )
     
+    previous_ids = current_member_ids(db, group_id)
+    removed_ids = set()
+    
     if request.name is not None:
         group.name = request.name
     
     if request.member_ids is not None:
-        # Remove existing members (except creator)
-        db.query(GroupMember).filter(
-            GroupMember.group_id == group_id,
-            GroupMember.user_id != group.creator_id
-        ).delete()
+        # Apply only the difference so untouched members keep their row, role and joined_at
+        desired_ids = existing_user_ids(db, request.member_ids)
+        desired_ids.add(group.creator_id)  # Always include creator
         
-        # Add new members
-        member_ids = set(request.member_ids)
-        member_ids.add(group.creator_id)  # Always include creator
-        member_ids.discard(current_user.id)
-        
-        for member_id in member_ids:
-            user = db.query(User).filter(User.id == member_id).first()
-            if user:
-                new_member = GroupMember(
-                    group_id=group_id,
-                    user_id=member_id,
-                    role=MemberRole.member if member_id != group.creator_id else MemberRole.admin
-                )
-                db.add(new_member)
-    
+        added_ids = desired_ids - previous_ids
+        removed_ids = previous_ids - desired_ids
+        bulk_remove_members(db, group_id, removed_ids)
+        bulk_add_members(db, group_id, sorted(added_ids - {group.creator_id}))
+        if group.creator_id in added_ids:
+            bulk_add_members(db, group_id, [group.creator_id], MemberRole.admin)
+    
+    # Removed members no longer resolve through the group, so they get rows of their own
+    record_change(db, ChangeEntity.group, group_id, "updated", removed_ids, audience_group_id=group_id)
     db.commit()
+    group_member_cache.invalidate(group_id)
     db.refresh(group)
     
-    members = [gm.user_id for gm in db.query(GroupMember).filter(
-        GroupMember.group_id == group_id
-    ).all()]
-    denied = [dm.user_id for dm in db.query(GroupDeniedMember).filter(
-        GroupDeniedMember.group_id == group_id
-    ).all()]
+    group_response = build_group_responses(db, [group])[0]
     
     # Broadcast group update via WebSocket
     try:
         from websocket.chat import broadcast_group_change
         await broadcast_group_change(group_id, "updated", {
             "name": group.name,
-            "members": members,
-            "denied_members": denied
-        })
+            "members": group_response.members,
+            "denied_members": group_response.denied_members
+        }, notify_user_ids=removed_ids)
     except:
         pass  # WebSocket might not be available
     
-    return GroupResponse(
-        id=group.id,
-        name=group.name,
-        creator_id=group.creator_id,
-        members=members,
-        denied_members=denied
-    )
+    return group_response
 
 @router.delete("/{group_id}", response_model=dict)
 async def delete_group(
@@ -252,7 +266,11 @@ async def delete_group(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Delete group"""
+    """Delete group
+
+    Membership is removed immediately so the group disappears for everyone;
+    its messages, read rows and attachments are purged by a background job.
+    """
     group = db.query(Group).filter(Group.id == group_id).first()
     if not group:
         raise HTTPException(
@@ -272,24 +290,124 @@ async def delete_group(
         GroupMember.group_id == group_id
     ).all()]
     
-    # Delete related records
+    # Delete related records; the group row itself goes once its messages are purged
     db.query(GroupMember).filter(GroupMember.group_id == group_id).delete()
     db.query(GroupDeniedMember).filter(GroupDeniedMember.group_id == group_id).delete()
-    db.delete(group)
+    purge_job = GroupPurgeJob(group_id=group_id, requested_by=current_user.id)
+    db.add(purge_job)
+    # Membership is gone: former members are the audience, once per deletion
+    record_change(db, ChangeEntity.group, group_id, "deleted", member_ids)
     db.commit()
+    group_member_cache.invalidate(group_id)
+    
+    start_group_purge(purge_job.id)
     
     # Broadcast group deletion via WebSocket
     try:
         from websocket.chat import broadcast_group_change
-        await broadcast_group_change(group_id, "deleted", {})
+        await broadcast_group_change(group_id, "deleted", {}, notify_user_ids=set(member_ids))
     except:
         pass  # WebSocket might not be available
     
-    return {"message": "Group deleted successfully"}
+    return {"message": "Group deleted successfully", "purge_job_id": purge_job.id}
+
+@router.get("/{group_id}/purge", response_model=dict)
+async def get_group_purge(
+    group_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Get progress of the background purge of a deleted group"""
+    job = db.query(GroupPurgeJob).filter(
+        GroupPurgeJob.group_id == group_id,
+        GroupPurgeJob.requested_by == current_user.id
+    ).order_by(GroupPurgeJob.id.desc()).first()
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Purge job not found"
+        )
+    
+    return {
+        "id": job.id,
+        "group_id": job.group_id,
+        "status": job.status.value,
+        "messages_deleted": job.messages_deleted,
+        "reads_deleted": job.reads_deleted,
+        "attachments_deleted": job.attachments_deleted,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at
+    }
 
 class AddMemberRequest(BaseModel):
     user_id: int
 
+class BulkMembersRequest(BaseModel):
+    add_ids: List[int] = []
+    remove_ids: List[int] = []
+
+@router.patch("/{group_id}/members", response_model=GroupResponse)
+async def bulk_update_members(
+    group_id: int,
+    request: BulkMembersRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Add and remove many members at once"""
+    group = db.query(Group).filter(Group.id == group_id).first()
+    if not group:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Group not found"
+        )
+    
+    # Check permissions
+    member = db.query(GroupMember).filter(
+        GroupMember.group_id == group_id,
+        GroupMember.user_id == current_user.id
+    ).first()
+    
+    if not member or (member.role != MemberRole.admin and group.creator_id != current_user.id):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only admin can update members"
+        )
+    
+    # Cannot remove creator
+    if group.creator_id in request.remove_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot remove group creator"
+        )
+    
+    previous_ids = current_member_ids(db, group_id)
+    added_ids = existing_user_ids(db, set(request.add_ids) - previous_ids - set(request.remove_ids))
+    removed_ids = set(request.remove_ids) & previous_ids
+    
+    bulk_remove_members(db, group_id, removed_ids)
+    bulk_add_members(db, group_id, sorted(added_ids))
+    if added_ids or removed_ids:
+        record_change(db, ChangeEntity.group, group_id, "members_updated", removed_ids, audience_group_id=group_id)
+    db.commit()
+    group_member_cache.invalidate(group_id)
+    
+    group_response = build_group_responses(db, [group])[0]
+    
+    # Broadcast one change for the whole batch via WebSocket
+    if added_ids or removed_ids:
+        try:
+            from websocket.chat import broadcast_group_change
+            await broadcast_group_change(group_id, "members_updated", {
+                "added": sorted(added_ids),
+                "removed": sorted(removed_ids),
+                "members": group_response.members
+            }, notify_user_ids=removed_ids)
+        except:
+            pass  # WebSocket might not be available
+    
+    return group_response
+
 @router.post("/{group_id}/members", response_model=dict)
 async def add_member(
     group_id: int,
@@ -336,7 +454,9 @@ async def add_member(
         role=MemberRole.member
     )
     db.add(new_member)
+    record_change(db, ChangeEntity.group, group_id, "member_added", audience_group_id=group_id)
     db.commit()
+    group_member_cache.invalidate(group_id)
     
     # Broadcast member addition via WebSocket
     try:
@@ -387,7 +507,9 @@ async def remove_member(
         GroupMember.group_id == group_id,
         GroupMember.user_id == user_id
     ).delete()
+    record_change(db, ChangeEntity.group, group_id, "member_removed", [user_id], audience_group_id=group_id)
     db.commit()
+    group_member_cache.invalidate(group_id)
     
     # Broadcast member removal via WebSocket
     try:
@@ -451,7 +573,9 @@ async def deny_member(
         user_id=user_id
     )
     db.add(denied)
+    record_change(db, ChangeEntity.group, group_id, "denied", [user_id], audience_group_id=group_id)
     db.commit()
+    group_member_cache.invalidate(group_id)
     
     return {"message": "User denied successfully"}
 
@@ -486,6 +610,7 @@ async def un_deny_member(
         GroupDeniedMember.group_id == group_id,
         GroupDeniedMember.user_id == user_id
     ).delete()
+    record_change(db, ChangeEntity.group, group_id, "undenied", audience_group_id=group_id)
     db.commit()
     
     return {"message": "User un-denied successfully"}
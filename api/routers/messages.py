@@ -1,7 +1,8 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Query, Request, Response
+from starlette.requests import ClientDisconnect
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, and_
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 
@@ -11,7 +12,11 @@ from models.message import Message
 from models.message_read import MessageRead
 from models.group import GroupMember, GroupDeniedMember
 from utils.auth import get_current_user_dependency as get_current_user
-from utils.image import process_image_upload
+from utils.image import process_image_upload, store_upload, variant_urls
+from utils.resumable_uploads import (
+    create_upload, load_upload, upload_status, write_chunk, take_completed_upload,
+    remove_upload, expire_uploads
+)
 
 router = APIRouter()
 
@@ -32,6 +37,13 @@ class SendMessageRequest(BaseModel):
     recipient_id: Optional[int] = None
     group_id: Optional[int] = None
 
+class CreateUploadRequest(BaseModel):
+    filename: str
+    size: int = Field(..., ge=1)
+    content_type: Optional[str] = None
+    recipient_id: Optional[int] = None
+    group_id: Optional[int] = None
+
 @router.get("", response_model=List[MessageResponse])
 async def get_messages(
     chat_type: str,  # 'personal' or 'group'
@@ -86,6 +98,8 @@ async def get_messages(
                 "size": 0,  # Size not stored in DB
                 "isImage": msg.attachment_type and msg.attachment_type.startswith("image/")
             }
+            if attachment["isImage"]:
+                attachment["variants"] = variant_urls(msg.attachment_url)
         
         result.append(MessageResponse(
             id=msg.id,
@@ -229,18 +243,8 @@ async def mark_message_read(
     
     return {"message": "Message marked as read"}
 
-@router.post("/upload", response_model=MessageResponse)
-async def upload_message(
-    file: UploadFile = File(...),
-    recipient_id: Optional[int] = None,
-    group_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """Upload attachment (image/file) as message
-    
-    Note: recipient_id and group_id should be sent as form data fields
-    """
+def validate_attachment_target(db: Session, current_user: User, recipient_id: Optional[int], group_id: Optional[int]):
+    """Check that an attachment message can be sent to the recipient or group"""
     if not recipient_id and not group_id:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -273,11 +277,10 @@ async def upload_message(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Not a member of this group"
             )
-    
-    # Process upload
-    attachment_info = await process_image_upload(file)
-    
-    # Create message
+
+def create_attachment_message(db: Session, current_user: User, recipient_id: Optional[int],
+                              group_id: Optional[int], attachment_info: dict) -> MessageResponse:
+    """Store the Message row for a processed upload"""
     new_message = Message(
         sender_id=current_user.id,
         recipient_id=recipient_id,
@@ -299,3 +302,85 @@ async def upload_message(
         attachment=attachment_info,
         timestamp=new_message.timestamp
     )
+
+@router.post("/upload", response_model=MessageResponse)
+async def upload_message(
+    file: UploadFile = File(...),
+    recipient_id: Optional[int] = None,
+    group_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Upload attachment (image/file) as message
+    
+    Note: recipient_id and group_id should be sent as form data fields
+    """
+    validate_attachment_target(db, current_user, recipient_id, group_id)
+    
+    # Process upload
+    attachment_info = await process_image_upload(file)
+    
+    return create_attachment_message(db, current_user, recipient_id, group_id, attachment_info)
+
+@router.post("/uploads", response_model=dict, status_code=status.HTTP_201_CREATED)
+async def create_resumable_upload(
+    request: CreateUploadRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Start a resumable upload; send the bytes with PUT /uploads/{upload_id}"""
+    validate_attachment_target(db, current_user, request.recipient_id, request.group_id)
+    expire_uploads()
+    meta = create_upload(
+        current_user.id, request.filename, request.size, request.content_type,
+        request.recipient_id, request.group_id
+    )
+    return upload_status(meta)
+
+@router.get("/uploads/{upload_id}", response_model=dict)
+async def get_resumable_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Progress of a resumable upload: resume sending from `offset`"""
+    return upload_status(load_upload(upload_id, current_user.id))
+
+@router.put("/uploads/{upload_id}", response_model=dict)
+async def put_upload_chunk(
+    upload_id: str,
+    http_request: Request,
+    offset: int = Query(..., ge=0),
+    current_user: User = Depends(get_current_user)
+):
+    """Append the raw request body at offset (must equal the bytes received so far)"""
+    meta = load_upload(upload_id, current_user.id)
+    try:
+        new_offset = await write_chunk(meta, offset, http_request.stream())
+    except ClientDisconnect:
+        # Nothing to answer; whatever arrived is kept and reported by GET
+        return Response(status_code=status.HTTP_400_BAD_REQUEST)
+    return {"upload_id": upload_id, "offset": new_offset, "size": meta["size"]}
+
+@router.post("/uploads/{upload_id}/complete", response_model=MessageResponse)
+async def complete_resumable_upload(
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Finish a fully received upload and create its message, as POST /upload does"""
+    meta = load_upload(upload_id, current_user.id)
+    # Membership may have changed since the upload started
+    validate_attachment_target(db, current_user, meta["recipient_id"], meta["group_id"])
+    temp_path, sha256 = await take_completed_upload(meta)
+    attachment_info = await store_upload(temp_path, sha256, meta["filename"], meta["content_type"])
+    return create_attachment_message(db, current_user, meta["recipient_id"], meta["group_id"], attachment_info)
+
+@router.delete("/uploads/{upload_id}", response_model=dict)
+async def abort_resumable_upload(
+    upload_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Cancel a resumable upload and drop the bytes received"""
+    load_upload(upload_id, current_user.id)
+    remove_upload(upload_id)
+    return {"message": "Upload cancelled"}
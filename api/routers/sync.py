@@ -0,0 +1,124 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from typing import List, Optional
+import os
+
+from database import get_db
+from models.user import User
+from models.friendship import Friendship, FriendshipStatus
+from models.group import Group, GroupMember
+from models.change_log import ChangeLog, ChangeEntity
+from utils.auth import get_current_user_dependency as get_current_user
+from utils.sync import visible_changes_filter, get_latest_version, changes_pruned_since
+from utils.presence import presence
+from routers.groups import GroupResponse, build_group_responses
+
+router = APIRouter()
+
+# Beyond this many pending changes the client is told to reload everything
+SYNC_MAX_CHANGES = int(os.getenv("SYNC_MAX_CHANGES", "5000"))
+
+class UserResponse(BaseModel):
+    id: int
+    name: str
+    email: str
+    avatar: Optional[str]
+    status: str
+
+    class Config:
+        from_attributes = True
+
+class FriendChanges(BaseModel):
+    added: List[int] = []
+    removed: List[int] = []
+
+class GroupChanges(BaseModel):
+    updated: List[GroupResponse] = []
+    removed: List[int] = []
+
+class SyncResponse(BaseModel):
+    version: int
+    full_resync: bool = False
+    users: List[UserResponse] = []
+    friends: FriendChanges = FriendChanges()
+    groups: GroupChanges = GroupChanges()
+
+@router.get("", response_model=SyncResponse)
+async def sync(
+    since: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Get friends, groups and user profile changes since a version
+
+    Without `since`, only the current version is returned so a client can
+    record its baseline before loading the full lists. A `since` older than
+    the change log retention also gets `full_resync`.
+    """
+    if since is None:
+        return SyncResponse(version=get_latest_version(db))
+
+    if changes_pruned_since(db, since):
+        # Changes after the client's version may have been pruned
+        return SyncResponse(version=get_latest_version(db), full_resync=True)
+
+    changes = db.query(ChangeLog.id, ChangeLog.entity_type, ChangeLog.entity_id).filter(
+        visible_changes_filter(current_user.id),
+        ChangeLog.id > since
+    ).order_by(ChangeLog.id.asc()).limit(SYNC_MAX_CHANGES + 1).all()
+
+    if not changes:
+        return SyncResponse(version=since)
+
+    if len(changes) > SYNC_MAX_CHANGES:
+        # Too far behind: the client should reload the full lists
+        return SyncResponse(version=get_latest_version(db), full_resync=True)
+
+    user_ids = set()
+    friend_ids = set()
+    group_ids = set()
+    for change in changes:
+        if change.entity_type == ChangeEntity.user:
+            user_ids.add(change.entity_id)
+        elif change.entity_type == ChangeEntity.friendship:
+            friend_ids.add(change.entity_id)
+        elif change.entity_type == ChangeEntity.group:
+            group_ids.add(change.entity_id)
+
+    # Changes are collapsed to the current state of each touched entity
+    users = []
+    if user_ids:
+        users = presence.apply_all(
+            UserResponse.model_validate(user)
+            for user in db.query(User).filter(User.id.in_(user_ids)).all()
+        )
+
+    friends = FriendChanges()
+    if friend_ids:
+        current_friend_ids = {f.friend_id for f in db.query(Friendship.friend_id).filter(
+            Friendship.user_id == current_user.id,
+            Friendship.friend_id.in_(friend_ids),
+            Friendship.status == FriendshipStatus.accepted
+        ).all()}
+        friends.added = sorted(current_friend_ids)
+        friends.removed = sorted(friend_ids - current_friend_ids)
+
+    groups = GroupChanges()
+    if group_ids:
+        member_group_ids = {gm.group_id for gm in db.query(GroupMember.group_id).filter(
+            GroupMember.user_id == current_user.id,
+            GroupMember.group_id.in_(group_ids)
+        ).all()}
+        if member_group_ids:
+            groups.updated = build_group_responses(
+                db, db.query(Group).filter(Group.id.in_(member_group_ids)).all()
+            )
+        groups.removed = sorted(group_ids - member_group_ids)
+
+    return SyncResponse(
+        version=changes[-1].id,
+        users=users,
+        friends=friends,
+        groups=groups
+    )
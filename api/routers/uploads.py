@@ -0,0 +1,47 @@
+from fastapi import APIRouter, HTTPException, Query, Request, status
+from typing import Optional
+import mimetypes
+import os
+
+from utils.image import UPLOAD_DIR, RESIZE_FORMATS
+from utils.resize_cache import resize_cache, snap_width
+from utils.upload_serving import serve_upload
+
+router = APIRouter()
+
+@router.api_route("/{filename}", methods=["GET", "HEAD"])
+async def get_upload(
+    request: Request,
+    filename: str,
+    w: Optional[int] = Query(None, ge=1),
+    fmt: Optional[str] = None
+):
+    """Serve an uploaded file, or an image resized to w px wide and/or converted to fmt
+
+    Responses are cacheable forever (names never change content), carry a
+    strong ETag and honour conditional and Range requests.
+    """
+    # Only plain files directly under UPLOAD_DIR; dot names are the temp and cache dirs
+    if filename.startswith(".") or os.path.basename(filename) != filename:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+    path = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found")
+
+    if w is None and fmt is None:
+        return serve_upload(request, path)
+
+    fmt = (fmt or "webp").lower()
+    if fmt == "jpg":
+        fmt = "jpeg"
+    if fmt not in RESIZE_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unsupported format, use one of: {', '.join(RESIZE_FORMATS)}"
+        )
+    mime_type = mimetypes.guess_type(filename)[0] or ""
+    if not mime_type.startswith("image/"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only images can be resized")
+
+    resized_path = await resize_cache.get(filename, snap_width(w), fmt)
+    return serve_upload(request, resized_path, RESIZE_FORMATS[fmt][1])
@@ -1,12 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Request, Response
 from sqlalchemy.orm import Session
+from sqlalchemy import or_, and_
 from pydantic import BaseModel
 from typing import List, Optional
+import base64
+import json
 
 from database import get_db
 from models.user import User
+from models.change_log import ChangeEntity
 from utils.auth import get_current_user_dependency as get_current_user
 from utils.image import process_image_upload
+from utils.attachments import release_attachments
+from utils.sync import record_change, get_current_version, make_etag, not_modified
+from utils.presence import presence
 
 router = APIRouter()
 
@@ -20,18 +27,135 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class DirectoryUser(BaseModel):
+    id: int
+    name: str
+    avatar: Optional[str]
+    status: str
+
+    class Config:
+        from_attributes = True
+
+class DirectoryResponse(BaseModel):
+    items: List[DirectoryUser]
+    next_cursor: Optional[str] = None
+
+# Upper bound for directory page size and ?ids= lookups
+DIRECTORY_MAX_LIMIT = 200
+
+def encode_cursor(name: str, user_id: int) -> str:
+    """Encode a (name, id) keyset position as an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps([name, user_id]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str):
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        name, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(name), int(user_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+def escape_like(value: str) -> str:
+    """Escape LIKE wildcards in user input"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
 class UpdateUserRequest(BaseModel):
     name: Optional[str] = None
     email: Optional[str] = None
 
 @router.get("", response_model=List[UserResponse])
 async def get_users(
+    request: Request,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Get all users (for Strangers list)"""
+    version = get_current_version(db, current_user.id, [ChangeEntity.user])
+    etag = make_etag("users", current_user.id, version, include_presence=True)
+    if not_modified(request, response, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    
     users = db.query(User).filter(User.id != current_user.id).all()
-    return [UserResponse.model_validate(user) for user in users]
+    return presence.apply_all(UserResponse.model_validate(user) for user in users)
+
+@router.get("/directory", response_model=DirectoryResponse)
+async def get_directory(
+    q: Optional[str] = None,
+    match: str = "prefix",  # 'prefix' (index-backed) or 'contains'
+    ids: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Search the user directory, or look up many users by id
+
+    prefix matches names only, so it is one range on (name, id); contains
+    also matches emails and scans. Results are ordered by (name, id) and
+    paginated with an opaque cursor.
+    """
+    limit = max(1, min(limit, DIRECTORY_MAX_LIMIT))
+    
+    # Bulk lookup for hydrating senders: ?ids=1,2,3
+    if ids:
+        try:
+            user_ids = {int(value) for value in ids.split(",") if value.strip()}
+        except ValueError:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="ids must be a comma-separated list of integers"
+            )
+        if len(user_ids) > DIRECTORY_MAX_LIMIT:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"At most {DIRECTORY_MAX_LIMIT} ids per request"
+            )
+        users = db.query(User.id, User.name, User.avatar, User.status).filter(
+            User.id.in_(user_ids)
+        ).all() if user_ids else []
+        return DirectoryResponse(items=presence.apply_all(DirectoryUser.model_validate(u) for u in users))
+    
+    if match not in ("prefix", "contains"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid match. Must be 'prefix' or 'contains'"
+        )
+    
+    query = db.query(User.id, User.name, User.avatar, User.status).filter(User.id != current_user.id)
+    
+    if q:
+        term = escape_like(q.strip())
+        if match == "prefix":
+            # Name only: a single range on ix_users_name_id that already matches the ORDER BY
+            query = query.filter(User.name.like(f"{term}%", escape="\\"))
+        else:
+            query = query.filter(or_(
+                User.name.like(f"%{term}%", escape="\\"),
+                User.email.like(f"%{term}%", escape="\\")
+            ))
+    
+    if cursor:
+        last_name, last_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            User.name > last_name,
+            and_(User.name == last_name, User.id > last_id)
+        ))
+    
+    users = query.order_by(User.name.asc(), User.id.asc()).limit(limit + 1).all()
+    
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1].name, users[-1].id)
+    
+    return DirectoryResponse(
+        items=presence.apply_all(DirectoryUser.model_validate(u) for u in users),
+        next_cursor=next_cursor
+    )
 
 @router.get("/{user_id}", response_model=UserResponse)
 async def get_user(
@@ -46,7 +170,7 @@ async def get_user(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found"
         )
-    return UserResponse.model_validate(user)
+    return presence.apply(UserResponse.model_validate(user))
 
 @router.put("/me", response_model=UserResponse)
 async def update_me(
@@ -70,9 +194,10 @@ async def update_me(
             )
         current_user.email = request.email
     
+    record_change(db, ChangeEntity.user, current_user.id, "updated")
     db.commit()
     db.refresh(current_user)
-    return UserResponse.from_orm(current_user)
+    return presence.apply(UserResponse.from_orm(current_user))
 
 @router.post("/me/avatar", response_model=dict)
 async def upload_avatar(
@@ -80,11 +205,13 @@ async def upload_avatar(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Upload user avatar (UUID, webp)"""
-    attachment_info = await process_image_upload(file)
+    """Upload user avatar (stored by content hash, webp)"""
+    attachment_info = await process_image_upload(file, profile="avatar")
     
-    # Update user avatar
+    # Update user avatar, dropping the reference held by the previous one
+    release_attachments(db, [current_user.avatar])
     current_user.avatar = attachment_info["url"]
+    record_change(db, ChangeEntity.user, current_user.id, "updated")
     db.commit()
     
     return {
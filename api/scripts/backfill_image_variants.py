@@ -0,0 +1,88 @@
+"""Generate image variants for uploads stored before variants existed
+
+Run from the api directory:
+
+    python -m scripts.backfill_image_variants [--dry-run] [--workers N]
+
+Images referenced by users.avatar get the avatar variants, images referenced
+by messages get the chat variants. Existing variants are left alone, so the
+command can be re-run safely.
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from database import SessionLocal
+from models.user import User
+from models.message import Message
+from utils.image import UPLOAD_DIR, missing_variants, make_variants, new_temp_path, remove_quietly
+from utils.attachments import UPLOAD_URL_PREFIX, blob_filename
+
+def collect_work():
+    """{filename: set of profiles} for stored webp images referenced by avatars or messages"""
+    db = SessionLocal()
+    try:
+        work = {}
+        for (url,) in db.query(User.avatar).filter(User.avatar.like(f"{UPLOAD_URL_PREFIX}%.webp")).yield_per(1000):
+            work.setdefault(blob_filename(url), set()).add("avatar")
+        for (url,) in db.query(Message.attachment_url).filter(
+            Message.attachment_url.like(f"{UPLOAD_URL_PREFIX}%.webp")
+        ).distinct().yield_per(1000):
+            work.setdefault(blob_filename(url), set()).add("chat")
+        return work
+    finally:
+        db.close()
+
+def backfill_one(filename: str, variants: list) -> int:
+    """Generate variants for one file via temp files; returns the number written"""
+    temp_paths = [(new_temp_path(".webp"), edge) for _, edge in variants]
+    try:
+        make_variants(os.path.join(UPLOAD_DIR, filename), temp_paths)
+        for (variant, _), (temp_path, _) in zip(variants, temp_paths):
+            os.replace(temp_path, os.path.join(UPLOAD_DIR, variant))
+        return len(variants)
+    finally:
+        for temp_path, _ in temp_paths:
+            remove_quietly(temp_path)
+
+def backfill(dry_run: bool = False, workers: int = 1) -> dict:
+    jobs = []
+    missing_files = 0
+    for filename, profiles in collect_work().items():
+        if not os.path.exists(os.path.join(UPLOAD_DIR, filename)):
+            missing_files += 1
+            continue
+        variants = []
+        for profile in sorted(profiles):
+            variants.extend(missing_variants(filename, profile))
+        if variants:
+            jobs.append((filename, variants))
+
+    result = {
+        "images_needing_variants": len(jobs),
+        "variants_missing": sum(len(variants) for _, variants in jobs),
+        "source_files_missing": missing_files,
+        "dry_run": dry_run,
+    }
+    if dry_run or not jobs:
+        return result
+
+    written = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(backfill_one, filename, variants) for filename, variants in jobs]
+        for future in futures:
+            try:
+                written += future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Error generating variants: {e}")
+    result.update({"variants_written": written, "images_failed": failed})
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate missing image variants for existing uploads")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be generated")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    args = parser.parse_args()
+    print(backfill(dry_run=args.dry_run, workers=args.workers))
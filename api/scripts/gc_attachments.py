@@ -0,0 +1,31 @@
+"""Garbage-collect unreferenced attachment blobs
+
+Run from the api directory:
+
+    python -m scripts.gc_attachments [--dry-run] [--recount]
+
+Deletes files in the content-addressed attachment store whose reference
+count dropped to zero more than ATTACHMENT_GC_GRACE_SECONDS ago.
+--recount first recomputes every count from messages and avatars, which
+repairs counts left behind by crashes between an upload and its message.
+"""
+import argparse
+
+from database import SessionLocal
+from utils.attachments import collect_garbage, recount_references
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Garbage-collect unreferenced attachment blobs")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+    parser.add_argument("--recount", action="store_true", help="Recompute reference counts first")
+    args = parser.parse_args()
+
+    result = {}
+    if args.recount:
+        db = SessionLocal()
+        try:
+            result["blobs_recounted"] = recount_references(db, dry_run=args.dry_run)
+        finally:
+            db.close()
+    result.update(collect_garbage(dry_run=args.dry_run))
+    print(result)
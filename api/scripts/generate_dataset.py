@@ -0,0 +1,370 @@
+"""Bulk-generate a synthetic dataset for capacity testing
+
+Run from the api directory (DATABASE_URL from .env, like the app):
+
+    python -m scripts.generate_dataset --scale 0.1 --seed 1
+
+The defaults (--scale 1) are 100k users, 1M friendships (2M directional
+rows), 10k groups and 10M messages plus their read records. The same seed,
+sizes and --end always produce the same rows, bcrypt salts aside:
+
+- users share one password (--password), hashed with bcrypt once per
+  entry of a small salt pool instead of once per user
+- friendships follow a power-law degree distribution (Chung-Lu graph over
+  Pareto user weights), stored as symmetric row pairs
+- group sizes are Pareto distributed, from 3 members up to --max-group-size
+- messages pick conversations by a Pareto activity weight, so a few chats
+  hold most of the history; most group messages come from a few members
+- direct messages are read by the recipient, group messages by a few
+  members, each with probability --read-ratio
+- --attachment-ratio of messages reference a pool of small placeholder
+  files (images with their chat variants) written to UPLOAD_DIR and
+  registered as attachment_blobs
+
+Rows are written with the models' INSERT statements through the driver's
+executemany, bypassing per-row ORM and type processing, and the
+non-unique indexes of the loaded tables are rebuilt once at the end.
+Existing rows are kept; new ids continue after the current maximum.
+"""
+import argparse
+import bisect
+import hashlib
+import io
+import itertools
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, func, select
+
+from database import Base, engine
+from models import (
+    User, Friendship, FriendshipStatus, Group, GroupMember, MemberRole,
+    Message, MessageRead, AttachmentBlob
+)
+
+FULL_SCALE = {
+    "users": 100_000,
+    "friendships": 1_000_000,
+    "groups": 10_000,
+    "messages": 10_000_000,
+}
+DEFAULT_PASSWORD = "password123"
+
+GIVEN_NAMES = [
+    "Alice", "Bob", "Carol", "David", "Emma", "Frank", "Grace", "Henry", "Ivy", "Jack",
+    "Kate", "Leo", "Mia", "Noah", "Olivia", "Paul", "Quinn", "Ruby", "Sam", "Tina",
+    "Uma", "Victor", "Wendy", "Xavier", "Yuki", "Zoe", "怡君", "志明", "雅婷", "家豪",
+]
+SURNAMES = [
+    "Chen", "Lin", "Huang", "Chang", "Lee", "Wang", "Wu", "Liu", "Tsai", "Yang",
+    "Smith", "Johnson", "Brown", "Garcia", "Miller", "Davis", "Martin", "Sato", "Kim", "Nguyen",
+]
+WORDS = (
+    "ok sure thanks see you tomorrow lunch meeting today later can we talk about the "
+    "project deadline sounds good I will send it tonight did you get my message haha "
+    "nice photo where are you coffee at noon let me check the doc is ready 好 謝謝 明天見"
+).split()
+
+def scaled_sizes(scale: float) -> dict:
+    return {name: max(1, int(count * scale)) for name, count in FULL_SCALE.items()}
+
+def pareto_weights(rng: random.Random, count: int, alpha: float):
+    """Cumulative Pareto weights for weighted sampling with bisect"""
+    return list(itertools.accumulate(rng.paretovariate(alpha) for _ in range(count)))
+
+def weighted_index(rng: random.Random, cumulative) -> int:
+    return bisect.bisect_right(cumulative, rng.random() * cumulative[-1])
+
+class BulkWriter:
+    """Buffered executemany of a model's INSERT, with values already in database form"""
+
+    def __init__(self, conn, model, columns, batch_size: int):
+        compiled = insert(model.__table__).compile(dialect=conn.dialect, column_keys=columns)
+        self.conn = conn
+        self.sql = str(compiled)
+        self.columns = columns
+        self.positional = conn.dialect.positional
+        self.batch_size = batch_size
+        self.rows = []
+        self.written = 0
+
+    def add(self, row: tuple):
+        self.rows.append(row if self.positional else dict(zip(self.columns, row)))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.conn.exec_driver_sql(self.sql, self.rows)
+            self.written += len(self.rows)
+            self.rows = []
+            # Commit per batch: bounded transactions on servers, same speed on SQLite
+            self.conn.commit()
+
+def next_id(conn, model) -> int:
+    return (conn.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+def sql_time(value: datetime) -> str:
+    return value.isoformat(" ", "seconds")
+
+def make_password_hashes(password: str, pool_size: int, rounds: int):
+    import bcrypt
+    return [bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=rounds)).decode() for _ in range(max(1, pool_size))]
+
+def make_placeholder_files(rng: random.Random, count: int, image_share: float):
+    """Write small placeholder uploads (images with chat variants); returns their blob rows"""
+    from PIL import Image
+    from utils.image import UPLOAD_DIR, missing_variants, make_variants
+    from utils.upload_serving import precompress_file
+
+    files = []
+    for index in range(count):
+        if rng.random() < image_share:
+            width, height = rng.choice([(640, 480), (480, 640), (800, 800)])
+            color = tuple(rng.randrange(256) for _ in range(3))
+            image = Image.new("RGB", (width, height), color)
+            image.paste(Image.effect_noise((width // 2, height // 2), 40).convert("RGB"), (width // 4, height // 4))
+            buffer = io.BytesIO()
+            image.save(buffer, "WEBP", quality=80)
+            data, extension, mime_type = buffer.getvalue(), ".webp", "image/webp"
+            name = f"photo_{index}.jpg"
+        else:
+            lines = [" ".join(rng.choices(WORDS, k=12)) for _ in range(rng.randint(20, 200))]
+            data, extension, mime_type = "\n".join(lines).encode(), ".txt", "text/plain"
+            name = f"notes_{index}.txt"
+        sha256 = hashlib.sha256(data).hexdigest()
+        filename = f"{sha256}{extension}"
+        path = os.path.join(UPLOAD_DIR, filename)
+        if not os.path.exists(path):
+            with open(path, "wb") as out:
+                out.write(data)
+        if mime_type.startswith("image/"):
+            variants = missing_variants(filename, "chat")
+            if variants:
+                make_variants(path, [(os.path.join(UPLOAD_DIR, variant), edge) for variant, edge in variants])
+        else:
+            precompress_file(path)
+        files.append({
+            "sha256": sha256, "filename": filename, "name": name, "mime_type": mime_type,
+            "size": len(data), "is_image": mime_type.startswith("image/"), "refs": 0,
+        })
+    return files
+
+def generate(sizes: dict, seed: int = 1, password: str = DEFAULT_PASSWORD, bcrypt_rounds: int = 12,
+             password_pool: int = 8, max_group_size: int = 5000, read_ratio: float = 0.9,
+             group_message_share: float = 0.3, attachment_ratio: float = 0.02, attachment_files: int = 50,
+             days: int = 365, end_time: datetime = None, batch_size: int = 20000) -> dict:
+    """Generate and insert the dataset; returns row counts and timings
+
+    Timestamps spread over the days before end_time (default: today 00:00 UTC).
+    """
+    rng = random.Random(seed)
+    timings = {}
+    started = time.perf_counter()
+    Base.metadata.create_all(bind=engine)
+
+    bulk_tables = [User, Friendship, Group, GroupMember, Message, MessageRead]
+    # Unique indexes stay: they are constraints, not just access paths
+    deferred = [index for model in bulk_tables for index in model.__table__.indexes if not index.unique]
+
+    with engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("PRAGMA synchronous=OFF")
+        for index in deferred:
+            index.drop(conn, checkfirst=True)
+        conn.commit()
+        try:
+            counts = _generate_rows(conn, rng, sizes, password, bcrypt_rounds, password_pool, max_group_size,
+                                    read_ratio, group_message_share, attachment_ratio, attachment_files,
+                                    days, end_time, batch_size, timings)
+        finally:
+            index_started = time.perf_counter()
+            for index in deferred:
+                index.create(conn, checkfirst=True)
+            conn.commit()
+            timings["indexes"] = round(time.perf_counter() - index_started, 3)
+    timings["total"] = round(time.perf_counter() - started, 3)
+    return {"seed": seed, "rows": counts, "seconds": timings}
+
+def _generate_rows(conn, rng, sizes, password, bcrypt_rounds, password_pool, max_group_size,
+                   read_ratio, group_message_share, attachment_ratio, attachment_files,
+                   days, end_time, batch_size, timings) -> dict:
+    counts = {}
+    end_time = end_time or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start_time = end_time - timedelta(days=days)
+
+    def phase(name):
+        timings[name] = round(time.perf_counter() - phase.started, 3)
+        phase.started = time.perf_counter()
+    phase.started = time.perf_counter()
+
+    # Users
+    hashes = make_password_hashes(password, password_pool, bcrypt_rounds)
+    phase("password_hashes")
+    first_user = next_id(conn, User)
+    user_count = sizes["users"]
+    user_ids = range(first_user, first_user + user_count)
+    writer = BulkWriter(conn, User, ["id", "name", "email", "password_hash", "avatar", "status", "created_at", "updated_at"], batch_size)
+    span = (end_time - start_time).total_seconds()
+    for offset, user_id in enumerate(user_ids):
+        given, surname = rng.choice(GIVEN_NAMES), rng.choice(SURNAMES)
+        name = f"{given} {surname}"
+        created = sql_time(start_time + timedelta(seconds=span * offset / user_count))
+        writer.add((
+            user_id, name, f"user{user_id}@example.com", hashes[offset % len(hashes)],
+            f"https://picsum.photos/seed/{user_id}/200", "offline", created, created
+        ))
+    writer.flush()
+    counts["users"] = writer.written
+    phase("users")
+
+    # Friendships: Chung-Lu graph, endpoints drawn proportionally to Pareto weights
+    user_weights = pareto_weights(rng, user_count, 1.8)
+    pair_target = min(sizes["friendships"], user_count * (user_count - 1) // 2)
+    pairs = set()
+    while len(pairs) < pair_target:
+        for _ in range(min(100000, pair_target - len(pairs))):
+            a = weighted_index(rng, user_weights)
+            b = weighted_index(rng, user_weights)
+            if a != b:
+                pairs.add((min(a, b) << 32) | max(a, b))
+    pairs = sorted(pairs)
+    writer = BulkWriter(conn, Friendship, ["user_id", "friend_id", "status", "created_at"], batch_size)
+    accepted = FriendshipStatus.accepted.name
+    for key in pairs:
+        a, b = first_user + (key >> 32), first_user + (key & 0xFFFFFFFF)
+        created = sql_time(start_time + timedelta(seconds=rng.random() * span))
+        writer.add((a, b, accepted, created))
+        writer.add((b, a, accepted, created))
+    writer.flush()
+    counts["friendships"] = writer.written
+    phase("friendships")
+
+    # Groups: Pareto sizes; the first member created the group and is its admin
+    first_group = next_id(conn, Group)
+    group_members = []
+    group_writer = BulkWriter(conn, Group, ["id", "name", "creator_id", "created_at", "updated_at"], batch_size)
+    member_writer = BulkWriter(conn, GroupMember, ["group_id", "user_id", "role", "joined_at"], batch_size)
+    for offset in range(sizes["groups"]):
+        group_id = first_group + offset
+        size = min(user_count, max_group_size, int(3 * rng.paretovariate(1.2)))
+        members = rng.sample(user_ids, max(1, size))
+        group_members.append(members)
+        created = sql_time(start_time + timedelta(seconds=rng.random() * span))
+        group_writer.add((group_id, f"{rng.choice(WORDS)} {rng.choice(WORDS)} #{group_id}", members[0], created, created))
+        for position, user_id in enumerate(members):
+            role = MemberRole.admin.name if position == 0 else MemberRole.member.name
+            member_writer.add((group_id, user_id, role, created))
+    group_writer.flush()
+    member_writer.flush()
+    counts["groups"] = group_writer.written
+    counts["group_members"] = member_writer.written
+    phase("groups")
+
+    # Placeholder attachment files
+    files = make_placeholder_files(rng, attachment_files, 0.6) if attachment_ratio > 0 and attachment_files > 0 else []
+    phase("attachment_files")
+
+    # Messages and read records
+    from utils.attachments import blob_url
+    pair_weights = pareto_weights(rng, len(pairs), 1.2) if pairs else None
+    group_weights = pareto_weights(rng, len(group_members), 1.2) if group_members else None
+    texts = [" ".join(rng.choices(WORDS, k=rng.randint(1, 16))) for _ in range(4096)]
+    first_message = next_id(conn, Message)
+    message_writer = BulkWriter(conn, Message, [
+        "id", "sender_id", "recipient_id", "group_id", "text",
+        "attachment_url", "attachment_name", "attachment_type", "timestamp"
+    ], batch_size)
+    read_writer = BulkWriter(conn, MessageRead, ["message_id", "user_id", "read_at"], batch_size)
+    message_count = sizes["messages"]
+    step = span / max(1, message_count)
+    for offset in range(message_count):
+        message_id = first_message + offset
+        sent_at = start_time + timedelta(seconds=offset * step)
+        readers = ()
+        if group_weights and (pair_weights is None or rng.random() < group_message_share):
+            group_index = weighted_index(rng, group_weights)
+            members = group_members[group_index]
+            # A few members do most of the talking
+            active = members[:max(1, len(members) // 5)] if rng.random() < 0.8 else members
+            sender = rng.choice(active)
+            recipient, group_id = None, first_group + group_index
+            if len(members) > 1 and rng.random() < read_ratio:
+                readers = [m for m in rng.sample(members, min(len(members), 4)) if m != sender][:3]
+        else:
+            key = pairs[weighted_index(rng, pair_weights)]
+            sender, recipient = first_user + (key >> 32), first_user + (key & 0xFFFFFFFF)
+            if rng.random() < 0.5:
+                sender, recipient = recipient, sender
+            group_id = None
+            if rng.random() < read_ratio:
+                readers = (recipient,)
+
+        text, url, name, mime_type = texts[offset & 4095], None, None, None
+        if files and rng.random() < attachment_ratio:
+            file = files[rng.randrange(len(files))]
+            file["refs"] += 1
+            url, name, mime_type = blob_url(file["filename"]), file["name"], file["mime_type"]
+            if rng.random() < 0.7:
+                text = None
+        message_writer.add((message_id, sender, recipient, group_id, text, url, name, mime_type, sql_time(sent_at)))
+        if readers:
+            read_at = sql_time(sent_at + timedelta(seconds=rng.randint(1, 3600)))
+            for reader in readers:
+                read_writer.add((message_id, reader, read_at))
+    message_writer.flush()
+    read_writer.flush()
+    counts["messages"] = message_writer.written
+    counts["message_reads"] = read_writer.written
+    phase("messages")
+
+    # Blob rows with the reference counts the messages above created
+    existing = {row.source_sha256 for row in conn.execute(select(AttachmentBlob.source_sha256))}
+    writer = BulkWriter(conn, AttachmentBlob, [
+        "source_sha256", "is_image", "filename", "mime_type", "size", "ref_count", "created_at", "last_referenced_at"
+    ], batch_size)
+    for file in files:
+        if file["refs"] and file["sha256"] not in existing:
+            writer.add((
+                file["sha256"], file["is_image"], file["filename"], file["mime_type"], file["size"], file["refs"],
+                sql_time(start_time), sql_time(end_time)
+            ))
+    writer.flush()
+    counts["attachment_blobs"] = writer.written
+    phase("attachment_blobs")
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset for capacity testing")
+    parser.add_argument("--scale", type=float, default=1.0, help="Fraction of the full dataset (100k users, 10M messages)")
+    parser.add_argument("--users", type=int, help="Override the scaled number of users")
+    parser.add_argument("--friendships", type=int, help="Override the scaled number of friendships (pairs)")
+    parser.add_argument("--groups", type=int, help="Override the scaled number of groups")
+    parser.add_argument("--messages", type=int, help="Override the scaled number of messages")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="Password of every generated user")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--password-pool", type=int, default=8, help="Distinct bcrypt hashes shared by the users")
+    parser.add_argument("--max-group-size", type=int, default=5000)
+    parser.add_argument("--read-ratio", type=float, default=0.9)
+    parser.add_argument("--group-message-share", type=float, default=0.3)
+    parser.add_argument("--attachment-ratio", type=float, default=0.02)
+    parser.add_argument("--attachment-files", type=int, default=50, help="Placeholder files shared by attachments")
+    parser.add_argument("--days", type=int, default=365, help="History length")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None,
+                        help="End of the history (UTC, default today 00:00); pin it for identical rows on later days")
+    parser.add_argument("--batch-size", type=int, default=20000)
+    args = parser.parse_args()
+
+    sizes = scaled_sizes(args.scale)
+    for name in FULL_SCALE:
+        if getattr(args, name) is not None:
+            sizes[name] = getattr(args, name)
+    print(generate(
+        sizes, seed=args.seed, password=args.password, bcrypt_rounds=args.bcrypt_rounds,
+        password_pool=args.password_pool, max_group_size=args.max_group_size, read_ratio=args.read_ratio,
+        group_message_share=args.group_message_share, attachment_ratio=args.attachment_ratio,
+        attachment_files=args.attachment_files, days=args.days, end_time=args.end, batch_size=args.batch_size
+    ))
@@ -0,0 +1,81 @@
+"""Normalise friendships into symmetric directional rows
+
+Run from the api directory:
+
+    python -m scripts.migrate_friendships [--dry-run]
+
+Every friendship must exist as both (a -> b) and (b -> a) with the same
+status, so readers can use the (user_id, status) index alone. This script
+removes self-friendships, adds missing reverse rows, promotes pairs where
+either side is accepted to accepted on both sides, and creates the
+ix_friendships_user_status index if it is missing.
+"""
+import argparse
+
+from sqlalchemy import insert, select, update, delete, exists, and_
+from sqlalchemy.orm import aliased
+
+from database import engine, SessionLocal
+from models.friendship import Friendship, FriendshipStatus
+
+def migrate(dry_run: bool = False) -> dict:
+    """Run the migration and return the number of rows touched per step"""
+    db = SessionLocal()
+    try:
+        reverse = aliased(Friendship)
+        has_reverse = exists().where(
+            reverse.user_id == Friendship.friend_id,
+            reverse.friend_id == Friendship.user_id
+        )
+        reverse_accepted = exists().where(
+            reverse.user_id == Friendship.friend_id,
+            reverse.friend_id == Friendship.user_id,
+            reverse.status == FriendshipStatus.accepted
+        )
+
+        self_rows = db.query(Friendship).filter(Friendship.user_id == Friendship.friend_id).count()
+        missing_reverse = db.query(Friendship).filter(~has_reverse).count()
+
+        if not dry_run:
+            db.execute(delete(Friendship).where(Friendship.user_id == Friendship.friend_id))
+            # The reverse row keeps the friendship's original date
+            db.execute(insert(Friendship).from_select(
+                ["user_id", "friend_id", "status", "created_at"],
+                select(
+                    Friendship.friend_id, Friendship.user_id, Friendship.status, Friendship.created_at
+                ).where(~has_reverse)
+            ))
+            db.flush()
+
+        mismatched = db.query(Friendship).filter(
+            Friendship.status != FriendshipStatus.accepted,
+            reverse_accepted
+        ).count()
+
+        if not dry_run:
+            # Materialise ids first: some databases refuse an UPDATE that reads its own table
+            ids = [f.id for f in db.query(Friendship.id).filter(
+                Friendship.status != FriendshipStatus.accepted,
+                reverse_accepted
+            ).all()]
+            if ids:
+                db.execute(update(Friendship).where(Friendship.id.in_(ids)).values(status=FriendshipStatus.accepted))
+            db.commit()
+
+            for index in Friendship.__table__.indexes:
+                index.create(bind=engine, checkfirst=True)
+
+        return {
+            "self_friendships_removed": self_rows,
+            "reverse_rows_added": missing_reverse,
+            "statuses_promoted": mismatched,
+            "dry_run": dry_run
+        }
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Normalise friendships into symmetric directional rows")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args()
+    print(migrate(dry_run=args.dry_run))
@@ -0,0 +1,79 @@
+"""Shared fixtures: the app on a throwaway SQLite database"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app reads DATABASE_URL and UPLOAD_DIR at import time
+_tmp_dir = tempfile.mkdtemp()
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'test.db')}"
+os.environ["UPLOAD_DIR"] = os.path.join(_tmp_dir, "uploads")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class QueryCounter:
+    """Counts SQL statements sent by an engine"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.engine = engine
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def close(self):
+        from sqlalchemy import event
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+@pytest.fixture(scope="session")
+def app():
+    import main
+    return main.app
+
+@pytest.fixture
+def db():
+    from database import SessionLocal
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def query_counter():
+    from database import engine
+    counter = QueryCounter(engine)
+    try:
+        yield counter
+    finally:
+        counter.close()
+
+@pytest.fixture
+def make_users(db):
+    """Insert n users and return their ids"""
+    from sqlalchemy import insert, func, select
+    from models.user import User
+
+    def make(n):
+        start = (db.execute(select(func.max(User.id))).scalar() or 0) + 1
+        db.execute(insert(User), [
+            {"name": f"user{i}", "email": f"user{i}@example.com", "password_hash": "x"}
+            for i in range(start, start + n)
+        ])
+        db.commit()
+        return list(range(start, start + n))
+    return make
+
+@pytest.fixture
+def client_for(app):
+    """A TestClient logged in as the given user"""
+    from fastapi.testclient import TestClient
+    from utils.auth import create_session
+
+    def make(user_id):
+        client = TestClient(app)
+        client.cookies.set("session_id", create_session(user_id))
+        return client
+    return make
@@ -0,0 +1,44 @@
+"""Group endpoints must issue a fixed number of queries, whatever the group and member counts"""
+
+SIZES = [(1, 3), (5, 40), (20, 150)]  # (groups, members per group)
+
+def measure(counter, call):
+    before = counter.count
+    response = call()
+    assert response.status_code == 200, response.text
+    return counter.count - before, response.json()
+
+def run_group_endpoints(make_users, client_for, query_counter, groups, members):
+    owner, *others = make_users(members)
+    client = client_for(owner)
+    counts = {}
+
+    for _ in range(groups):
+        counts["create_group"], group = measure(
+            query_counter, lambda: client.post("/api/groups", json={"name": "g", "member_ids": others})
+        )
+        assert len(group["members"]) == members
+
+    counts["get_groups"], listed = measure(query_counter, lambda: client.get("/api/groups"))
+    assert len(listed) == groups
+
+    counts["get_group"], _ = measure(query_counter, lambda: client.get(f"/api/groups/{group['id']}"))
+
+    # Replace half of the members: both additions and removals scale with the group
+    replacements = make_users(members // 2)
+    kept = others[:len(others) - len(replacements)]
+    counts["update_group"], updated = measure(
+        query_counter,
+        lambda: client.put(f"/api/groups/{group['id']}", json={"name": "renamed", "member_ids": kept + replacements})
+    )
+    assert set(updated["members"]) == {owner, *kept, *replacements}
+    return counts
+
+def test_group_endpoint_query_counts_are_constant(make_users, client_for, query_counter):
+    results = [
+        run_group_endpoints(make_users, client_for, query_counter, groups, members)
+        for groups, members in SIZES
+    ]
+    for endpoint in results[0]:
+        counts = [result[endpoint] for result in results]
+        assert len(set(counts)) == 1, f"{endpoint}: {counts} queries for sizes {SIZES}"
@@ -0,0 +1,213 @@
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Set
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models.user import User
+from models.message import Message
+from models.attachment_blob import AttachmentBlob
+from utils.image import UPLOAD_DIR, remove_image_files
+
+load_dotenv()
+
+UPLOAD_URL_PREFIX = "/api/uploads/"
+
+# Unreferenced blobs younger than this are kept, so an upload whose message
+# is still being created is never collected
+ATTACHMENT_GC_GRACE_SECONDS = int(os.getenv("ATTACHMENT_GC_GRACE_SECONDS", "3600"))
+
+def blob_url(filename: str) -> str:
+    return f"{UPLOAD_URL_PREFIX}{filename}"
+
+def blob_filename(url: Optional[str]) -> Optional[str]:
+    """Filename under UPLOAD_DIR for an upload URL, or None for external URLs"""
+    if not url or not url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    return os.path.basename(url)
+
+def acquire_blob(source_sha256: str, is_image: bool) -> Optional[AttachmentBlob]:
+    """Take a reference on an existing blob; None if the content is not stored yet"""
+    db = SessionLocal()
+    try:
+        result = db.execute(update(AttachmentBlob).where(
+            AttachmentBlob.source_sha256 == source_sha256,
+            AttachmentBlob.is_image == is_image
+        ).values(
+            ref_count=AttachmentBlob.ref_count + 1,
+            last_referenced_at=datetime.utcnow()
+        ))
+        if result.rowcount == 0:
+            db.rollback()
+            return None
+        blob = db.query(AttachmentBlob).filter(
+            AttachmentBlob.source_sha256 == source_sha256,
+            AttachmentBlob.is_image == is_image
+        ).first()
+        if not os.path.exists(os.path.join(UPLOAD_DIR, blob.filename)):
+            # File lost (e.g. removed by hand): let the caller store it again
+            db.rollback()
+            return None
+        db.commit()
+        db.refresh(blob)
+        db.expunge(blob)
+        return blob
+    finally:
+        db.close()
+
+def register_blob(source_sha256: str, is_image: bool, filename: str, mime_type: str, size: int) -> AttachmentBlob:
+    """Record a newly stored file with one reference
+
+    If another request stored the same content concurrently, its row wins
+    and gets the reference instead; both wrote the same file name.
+    """
+    db = SessionLocal()
+    try:
+        blob = AttachmentBlob(
+            source_sha256=source_sha256,
+            is_image=is_image,
+            filename=filename,
+            mime_type=mime_type,
+            size=size,
+            ref_count=1,
+            last_referenced_at=datetime.utcnow()
+        )
+        db.add(blob)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+            db.execute(update(AttachmentBlob).where(
+                AttachmentBlob.source_sha256 == source_sha256,
+                AttachmentBlob.is_image == is_image
+            ).values(
+                ref_count=AttachmentBlob.ref_count + 1,
+                last_referenced_at=datetime.utcnow()
+            ))
+            db.commit()
+            blob = db.query(AttachmentBlob).filter(
+                AttachmentBlob.source_sha256 == source_sha256,
+                AttachmentBlob.is_image == is_image
+            ).first()
+        db.refresh(blob)
+        db.expunge(blob)
+        return blob
+    finally:
+        db.close()
+
+def acquire_attachments(db: Session, urls: Iterable[Optional[str]]) -> Set[str]:
+    """Take one reference per URL occurrence, in the caller's transaction
+
+    For rows that reuse an already stored upload by URL (e.g. a message sent
+    over WebSocket with the attachment of a previous upload). Returns the
+    URLs that belong to the blob store.
+    """
+    counts = Counter(name for name in (blob_filename(url) for url in urls) if name)
+    if not counts:
+        return set()
+    blobs = db.query(AttachmentBlob.id, AttachmentBlob.filename).filter(
+        AttachmentBlob.filename.in_(list(counts))
+    ).all()
+    for blob in blobs:
+        db.execute(update(AttachmentBlob).where(AttachmentBlob.id == blob.id).values(
+            ref_count=AttachmentBlob.ref_count + counts[blob.filename],
+            last_referenced_at=datetime.utcnow()
+        ))
+    return {blob_url(blob.filename) for blob in blobs}
+
+def count_references(db: Session, filename: str) -> int:
+    """Messages and avatars currently pointing at a stored file"""
+    url = blob_url(filename)
+    return (
+        db.query(Message.id).filter(Message.attachment_url == url).count()
+        + db.query(User.id).filter(User.avatar == url).count()
+    )
+
+def release_attachments(db: Session, urls: Iterable[Optional[str]]) -> Set[str]:
+    """Drop one reference per URL occurrence, in the caller's transaction
+
+    Returns the URLs that belong to the blob store; anything else (legacy
+    per-upload files) is left for the caller to handle.
+    """
+    counts = Counter(name for name in (blob_filename(url) for url in urls) if name)
+    if not counts:
+        return set()
+    blobs = db.query(AttachmentBlob.id, AttachmentBlob.filename).filter(
+        AttachmentBlob.filename.in_(list(counts))
+    ).all()
+    for blob in blobs:
+        db.execute(update(AttachmentBlob).where(AttachmentBlob.id == blob.id).values(
+            ref_count=AttachmentBlob.ref_count - counts[blob.filename]
+        ))
+    return {blob_url(blob.filename) for blob in blobs}
+
+def recount_references(db: Session, dry_run: bool = False) -> int:
+    """Recompute every blob's ref_count from messages and avatars; returns blobs corrected"""
+    counts = Counter()
+    for (url,) in db.query(Message.attachment_url).filter(
+        Message.attachment_url.like(f"{UPLOAD_URL_PREFIX}%")
+    ).yield_per(1000):
+        counts[blob_filename(url)] += 1
+    for (url,) in db.query(User.avatar).filter(User.avatar.like(f"{UPLOAD_URL_PREFIX}%")).yield_per(1000):
+        counts[blob_filename(url)] += 1
+
+    corrected = 0
+    for blob in db.query(AttachmentBlob).all():
+        actual = counts.get(blob.filename, 0)
+        if blob.ref_count != actual:
+            blob.ref_count = actual
+            corrected += 1
+    if dry_run:
+        db.rollback()
+    else:
+        db.commit()
+    return corrected
+
+def collect_garbage(dry_run: bool = False) -> dict:
+    """Delete blobs with no references that are older than the grace period"""
+    db = SessionLocal()
+    cutoff = datetime.utcnow() - timedelta(seconds=ATTACHMENT_GC_GRACE_SECONDS)
+    deleted = 0
+    freed_bytes = 0
+    try:
+        candidates = db.query(AttachmentBlob.id).filter(
+            AttachmentBlob.ref_count <= 0,
+            AttachmentBlob.last_referenced_at < cutoff
+        ).all()
+        for candidate in candidates:
+            # Lock and re-check: a concurrent upload may have just taken a reference
+            blob = db.query(AttachmentBlob).filter(
+                AttachmentBlob.id == candidate.id,
+                AttachmentBlob.ref_count <= 0
+            ).with_for_update().first()
+            if not blob:
+                db.rollback()
+                continue
+            # The counter is a cache: never delete a file a row still points at
+            actual = count_references(db, blob.filename)
+            if actual > 0:
+                if not dry_run:
+                    blob.ref_count = actual
+                    db.commit()
+                else:
+                    db.rollback()
+                continue
+            if dry_run:
+                deleted += 1
+                freed_bytes += blob.size
+                db.rollback()
+                continue
+            # Remove the file while holding the row lock, then drop the row
+            size = blob.size
+            remove_image_files(blob.filename)
+            db.delete(blob)
+            db.commit()
+            deleted += 1
+            freed_bytes += size
+        return {"blobs_deleted": deleted, "bytes_freed": freed_bytes, "dry_run": dry_run}
+    finally:
+        db.close()
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import FrozenSet, NamedTuple, Optional
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models.friendship import Friendship, FriendshipStatus
+from models.change_log import ChangeLog, ChangeEntity
+
+load_dotenv()
+
+# Number of users whose friend sets are kept in memory
+FRIEND_CACHE_SIZE = int(os.getenv("FRIEND_CACHE_SIZE", "10000"))
+# Seconds a cached set is used without checking change_log; bounds how long
+# another worker's friendship change goes unseen on unverified reads
+FRIEND_CACHE_TTL_SECONDS = float(os.getenv("FRIEND_CACHE_TTL_SECONDS", "30"))
+
+class _Entry(NamedTuple):
+    friend_ids: FrozenSet[int]
+    version: Optional[int]  # Friendship change_log version the set was loaded at, if read
+    checked_at: float
+
+class FriendGraphCache:
+    """LRU cache of accepted-friend adjacency sets, loaded lazily per user
+
+    Writers (add_friend / remove_friend) update cached sets in place so
+    readers in the same process see their changes at once. The cache is
+    per process, so each entry remembers the user's friendship version in
+    change_log: reads with verify=True (the friends list, whose ETag covers
+    that version) compare it with one indexed query and reload on mismatch;
+    other reads recheck once FRIEND_CACHE_TTL_SECONDS have passed.
+    """
+
+    def __init__(self, max_users: int, ttl_seconds: float):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _version(self, db: Session, user_id: int) -> int:
+        # Friendship changes are logged once per side, with that side as the audience
+        return db.query(func.max(ChangeLog.id)).filter(
+            ChangeLog.audience_user_id == user_id,
+            ChangeLog.entity_type == ChangeEntity.friendship
+        ).scalar() or 0
+
+    def _load(self, db: Session, user_id: int) -> FrozenSet[int]:
+        # Friendships are stored in both directions, so user_id alone is enough
+        friendships = db.query(Friendship.friend_id).filter(
+            Friendship.user_id == user_id,
+            Friendship.status == FriendshipStatus.accepted
+        ).all()
+        return frozenset(f.friend_id for f in friendships)
+
+    def _store(self, user_id: int, entry: _Entry):
+        self._entries[user_id] = entry
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    def _refresh(self, db: Session, user_id: int, entry: Optional[_Entry], verify: bool) -> FrozenSet[int]:
+        # Version before the set: a change committed in between only makes the next
+        # check reload. A first unverified load skips it; the first check then reloads.
+        version = self._version(db, user_id) if entry is not None or verify else None
+        if entry is not None and entry.version == version:
+            friend_ids = entry.friend_ids
+        else:
+            friend_ids = self._load(db, user_id)
+        with self._lock:
+            self._store(user_id, _Entry(friend_ids, version, time.monotonic()))
+        return friend_ids
+
+    def get_friend_ids(self, user_id: int, db: Optional[Session] = None, verify: bool = False) -> FrozenSet[int]:
+        """Return the user's accepted friend ids, loading them on first use
+
+        verify=True checks the cached set against change_log first, so it
+        reflects every friendship change committed before the call.
+        """
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                self._entries.move_to_end(user_id)
+                if not verify and time.monotonic() - entry.checked_at < self.ttl_seconds:
+                    return entry.friend_ids
+
+        if db is not None:
+            return self._refresh(db, user_id, entry, verify)
+        db = SessionLocal()
+        try:
+            return self._refresh(db, user_id, entry, verify)
+        finally:
+            db.close()
+
+    def _update(self, user_id: int, friend_id: int, add: bool):
+        with self._lock:
+            for a, b in ((user_id, friend_id), (friend_id, user_id)):
+                entry = self._entries.get(a)
+                if entry is not None:
+                    # The version stays behind, so a verified read still reloads once
+                    friend_ids = entry.friend_ids | {b} if add else entry.friend_ids - {b}
+                    self._entries[a] = entry._replace(friend_ids=friend_ids)
+
+    def add_friendship(self, user_id: int, friend_id: int):
+        """Record a new accepted friendship in any cached sets"""
+        self._update(user_id, friend_id, add=True)
+
+    def remove_friendship(self, user_id: int, friend_id: int):
+        """Drop a friendship from any cached sets"""
+        self._update(user_id, friend_id, add=False)
+
+    def invalidate(self, user_id: int):
+        """Forget a user's cached set so it is reloaded on next use"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+friend_cache = FriendGraphCache(FRIEND_CACHE_SIZE, FRIEND_CACHE_TTL_SECONDS)
@@ -0,0 +1,95 @@
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, FrozenSet, Tuple
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models.group import GroupMember
+
+load_dotenv()
+
+# Number of groups whose member sets are kept in memory
+GROUP_MEMBER_CACHE_SIZE = int(os.getenv("GROUP_MEMBER_CACHE_SIZE", "5000"))
+# Seconds a cached set is used before reloading; bounds how long another
+# worker's membership change goes unseen
+GROUP_MEMBER_CACHE_TTL_SECONDS = float(os.getenv("GROUP_MEMBER_CACHE_TTL_SECONDS", "10"))
+
+class GroupMemberCache:
+    """LRU cache of group member id sets, loaded lazily per group
+
+    Group endpoints invalidate a group after committing a membership change,
+    so hot paths such as ephemeral signals can check membership without a
+    query. The cache is per process: other workers' changes are picked up
+    when an entry expires.
+
+    Loads run outside the lock, so every invalidate stamps its group with a
+    new generation and a load only stores its result if the group was not
+    invalidated after the load started.
+    """
+
+    def __init__(self, max_groups: int, ttl_seconds: float):
+        self.max_groups = max_groups
+        self.ttl_seconds = ttl_seconds
+        self._sets: "OrderedDict[int, Tuple[FrozenSet[int], float]]" = OrderedDict()
+        self._generation = 0
+        # Generation of each group's last invalidate, kept while a load may predate it
+        self._invalidated: Dict[int, int] = {}
+        # Generations at which the loads in flight started
+        self._loading: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def get_member_ids(self, group_id: int) -> FrozenSet[int]:
+        """Return the group's member ids, loading them on first use"""
+        with self._lock:
+            cached = self._sets.get(group_id)
+            if cached is not None and time.monotonic() - cached[1] < self.ttl_seconds:
+                self._sets.move_to_end(group_id)
+                return cached[0]
+            started = self._generation
+            self._loading[started] += 1
+
+        try:
+            db = SessionLocal()
+            try:
+                member_ids = frozenset(gm.user_id for gm in db.query(GroupMember.user_id).filter(
+                    GroupMember.group_id == group_id
+                ).all())
+            finally:
+                db.close()
+        finally:
+            with self._lock:
+                self._loading[started] -= 1
+                if not self._loading[started]:
+                    del self._loading[started]
+
+        with self._lock:
+            # An invalidate that raced the load may mean the set is already stale
+            if self._invalidated.get(group_id, -1) <= started:
+                self._sets[group_id] = (member_ids, time.monotonic())
+                self._sets.move_to_end(group_id)
+                while len(self._sets) > self.max_groups:
+                    self._sets.popitem(last=False)
+            self._prune_invalidated()
+        return member_ids
+
+    def _prune_invalidated(self):
+        # Caller holds the lock; stamps older than every load in flight can no longer matter
+        if len(self._invalidated) <= self.max_groups:
+            return
+        oldest = min(self._loading, default=self._generation + 1)
+        self._invalidated = {
+            group_id: generation for group_id, generation in self._invalidated.items()
+            if generation > oldest
+        }
+
+    def invalidate(self, group_id: int):
+        """Forget a group's cached set so it is reloaded on next use"""
+        with self._lock:
+            self._generation += 1
+            self._invalidated[group_id] = self._generation
+            self._sets.pop(group_id, None)
+            self._prune_invalidated()
+
+group_member_cache = GroupMemberCache(GROUP_MEMBER_CACHE_SIZE, GROUP_MEMBER_CACHE_TTL_SECONDS)
@@ -0,0 +1,225 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update, or_
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models.user import User
+from models.message import Message
+from models.message_read import MessageRead
+from models.group import Group, GroupMember, GroupDeniedMember
+from models.group_purge_job import GroupPurgeJob, PurgeStatus
+from utils.image import UPLOAD_DIR, remove_image_files
+from utils.attachments import UPLOAD_URL_PREFIX, release_attachments
+from utils.presence import WORKER_ID
+
+load_dotenv()
+
+# Messages handled per purge step
+PURGE_MESSAGE_BATCH = int(os.getenv("PURGE_MESSAGE_BATCH", "200"))
+# message_reads rows deleted per purge step
+PURGE_READ_BATCH = int(os.getenv("PURGE_READ_BATCH", "2000"))
+# Pause between committed steps so the purge never hogs the database
+PURGE_THROTTLE_SECONDS = float(os.getenv("PURGE_THROTTLE_SECONDS", "0.05"))
+# A job whose worker has not renewed its lease for this long is taken over by another
+PURGE_LEASE_SECONDS = float(os.getenv("PURGE_LEASE_SECONDS", "60"))
+
+ACTIVE_STATUSES = [PurgeStatus.pending, PurgeStatus.running]
+
+# Running purge tasks: {job_id: task}
+purge_tasks: Dict[int, asyncio.Task] = {}
+
+def claim_purge_job(job_id: int) -> bool:
+    """Take ownership of an unfinished job that is unowned, ours or past its lease
+
+    A single conditional UPDATE: with several workers exactly one claim
+    succeeds, so each job runs once.
+    """
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        result = db.execute(update(GroupPurgeJob).where(
+            GroupPurgeJob.id == job_id,
+            GroupPurgeJob.status.in_(ACTIVE_STATUSES),
+            or_(
+                GroupPurgeJob.owner.is_(None),
+                GroupPurgeJob.owner == WORKER_ID,
+                GroupPurgeJob.lease_expires_at < now
+            )
+        ).values(
+            owner=WORKER_ID,
+            status=PurgeStatus.running,
+            lease_expires_at=now + timedelta(seconds=PURGE_LEASE_SECONDS)
+        ))
+        db.commit()
+        return result.rowcount == 1
+    finally:
+        db.close()
+
+def purging_group_ids(db, group_ids) -> set:
+    """Return which of the given groups have a purge that has not completed
+
+    Such a group's row still exists, so writers must check this before
+    adding rows the purge could miss.
+    """
+    if not group_ids:
+        return set()
+    return {job.group_id for job in db.query(GroupPurgeJob.group_id).filter(
+        GroupPurgeJob.group_id.in_(group_ids),
+        GroupPurgeJob.status != PurgeStatus.completed
+    ).all()}
+
+def _renew_lease(db, job_id: int) -> bool:
+    # In the step's transaction: the row lock also holds off a concurrent reclaim
+    result = db.execute(update(GroupPurgeJob).where(
+        GroupPurgeJob.id == job_id,
+        GroupPurgeJob.owner == WORKER_ID,
+        GroupPurgeJob.status.in_(ACTIVE_STATUSES)
+    ).values(lease_expires_at=datetime.utcnow() + timedelta(seconds=PURGE_LEASE_SECONDS)))
+    return result.rowcount == 1
+
+def _delete_unreferenced_attachments(db, urls: set) -> int:
+    """Delete legacy upload files no longer referenced by other messages or avatars"""
+    urls = {url for url in urls if url and url.startswith(UPLOAD_URL_PREFIX)}
+    if not urls:
+        return 0
+    still_used = {m.attachment_url for m in db.query(Message.attachment_url).filter(
+        Message.attachment_url.in_(urls)
+    ).all()}
+    still_used |= {u.avatar for u in db.query(User.avatar).filter(User.avatar.in_(urls)).all()}
+
+    deleted = 0
+    for url in urls - still_used:
+        filename = os.path.basename(url)
+        if os.path.exists(os.path.join(UPLOAD_DIR, filename)):
+            deleted += 1
+        remove_image_files(filename)
+    return deleted
+
+def purge_group_step(job_id: int) -> bool:
+    """Run one small committed unit of purge work; returns True when the job is finished"""
+    db = SessionLocal()
+    try:
+        # Lost the lease (finished, or reclaimed by another worker): stop here
+        if not _renew_lease(db, job_id):
+            db.rollback()
+            return True
+        job = db.query(GroupPurgeJob).filter(GroupPurgeJob.id == job_id).first()
+
+        message_ids = [m.id for m in db.query(Message.id).filter(
+            Message.group_id == job.group_id
+        ).order_by(Message.id.asc()).limit(PURGE_MESSAGE_BATCH).all()]
+
+        if message_ids:
+            # Read rows first, in bounded chunks, so a message with many readers stays cheap
+            read_ids = [r.id for r in db.query(MessageRead.id).filter(
+                MessageRead.message_id.in_(message_ids)
+            ).limit(PURGE_READ_BATCH).all()]
+            if read_ids:
+                db.query(MessageRead).filter(MessageRead.id.in_(read_ids)).delete(synchronize_session=False)
+                job.reads_deleted += len(read_ids)
+                db.commit()
+                return False
+
+            urls = [m.attachment_url for m in db.query(Message.attachment_url).filter(
+                Message.id.in_(message_ids),
+                Message.attachment_url.isnot(None)
+            ).all()]
+            # Blob-store files are shared: drop references in the same transaction
+            # and leave the files to attachment garbage collection
+            blob_urls = release_attachments(db, urls)
+            db.query(Message).filter(Message.id.in_(message_ids)).delete(synchronize_session=False)
+            job.messages_deleted += len(message_ids)
+            db.commit()
+
+            job.attachments_deleted += _delete_unreferenced_attachments(db, set(urls) - blob_urls)
+            db.commit()
+            return False
+
+        # No messages left: drop any remaining membership rows and the group itself
+        db.query(GroupMember).filter(GroupMember.group_id == job.group_id).delete(synchronize_session=False)
+        db.query(GroupDeniedMember).filter(GroupDeniedMember.group_id == job.group_id).delete(synchronize_session=False)
+        db.query(Group).filter(Group.id == job.group_id).delete(synchronize_session=False)
+        job.status = PurgeStatus.completed
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+def _mark_failed(job_id: int, error: str):
+    db = SessionLocal()
+    try:
+        job = db.query(GroupPurgeJob).filter(
+            GroupPurgeJob.id == job_id,
+            GroupPurgeJob.owner == WORKER_ID
+        ).first()
+        if job:
+            job.status = PurgeStatus.failed
+            job.error = error
+            job.finished_at = datetime.utcnow()
+            db.commit()
+    finally:
+        db.close()
+
+async def run_group_purge(job_id: int):
+    """Purge a deleted group's messages, read rows and attachments in throttled batches"""
+    try:
+        if not await run_in_threadpool(claim_purge_job, job_id):
+            return  # Running on another worker
+        while not await run_in_threadpool(purge_group_step, job_id):
+            await asyncio.sleep(PURGE_THROTTLE_SECONDS)
+    except Exception as e:
+        print(f"Error purging group (job {job_id}): {e}")
+        await run_in_threadpool(_mark_failed, job_id, str(e))
+    finally:
+        purge_tasks.pop(job_id, None)
+
+def start_group_purge(job_id: int):
+    """Schedule a purge job on the running event loop"""
+    if job_id not in purge_tasks:
+        purge_tasks[job_id] = asyncio.create_task(run_group_purge(job_id))
+
+def reclaimable_purge_jobs() -> List[int]:
+    """Unfinished jobs that are unowned or whose owner stopped renewing the lease"""
+    db = SessionLocal()
+    try:
+        return [job.id for job in db.query(GroupPurgeJob.id).filter(
+            GroupPurgeJob.status.in_(ACTIVE_STATUSES),
+            or_(
+                GroupPurgeJob.owner.is_(None),
+                GroupPurgeJob.owner == WORKER_ID,
+                GroupPurgeJob.lease_expires_at < datetime.utcnow()
+            )
+        ).all()]
+    finally:
+        db.close()
+
+# Background loop resuming jobs, started on app startup
+supervisor_task: Optional[asyncio.Task] = None
+
+async def run_purge_supervisor():
+    """Resume jobs left by a previous process, then keep taking over expired leases"""
+    while True:
+        try:
+            for job_id in await run_in_threadpool(reclaimable_purge_jobs):
+                start_group_purge(job_id)
+        except Exception as e:
+            print(f"Error resuming group purges: {e}")
+        await asyncio.sleep(PURGE_LEASE_SECONDS)
+
+def start_purge_supervisor():
+    """Schedule the supervisor loop on the running event loop"""
+    global supervisor_task
+    if supervisor_task is None:
+        supervisor_task = asyncio.create_task(run_purge_supervisor())
+
+def stop_purge_supervisor():
+    """Cancel the supervisor loop"""
+    global supervisor_task
+    if supervisor_task is not None:
+        supervisor_task.cancel()
+        supervisor_task = None
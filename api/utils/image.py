@@ -1,77 +1,426 @@
 import uuid
 import os
-import io
-from PIL import Image
-from fastapi import UploadFile
+import time
+import asyncio
+import hashlib
+import mimetypes
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+from PIL import Image, UnidentifiedImageError
+from fastapi import UploadFile, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
 
+from utils.metrics import image_processing_seconds
+
 load_dotenv()
 
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
 
-# Ensure upload directory exists
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Partial uploads live here until they are renamed into UPLOAD_DIR (same filesystem)
+UPLOAD_TMP_DIR = os.path.join(UPLOAD_DIR, ".tmp")
+
+# Ensure upload directories exist
+os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+
+# Uploads are copied in chunks of this size, so memory stays flat per request
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# Largest accepted upload in bytes (413 beyond this)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+
+# Precompressed copies stored next to text uploads: {content-coding: file suffix}, preferred first
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Worker processes for image transcoding (0 transcodes in the event loop, for debugging only)
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Transcodes allowed to run or wait for a worker before uploads are rejected with 503
+IMAGE_MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", str(max(1, IMAGE_WORKERS) * 4)))
+# Seconds an upload waits for its transcode before giving up with 504
+IMAGE_TIMEOUT_SECONDS = float(os.getenv("IMAGE_TIMEOUT_SECONDS", "30"))
+# Uploads with more source pixels than this are rejected before decoding (413)
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))
+# Longest side of stored images; larger photos are scaled down on upload
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "2560"))
+
+def parse_variants(spec: str) -> Dict[str, int]:
+    """Parse "name:max_edge,..." into {name: max_edge}"""
+    variants = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, _, edge = item.strip().partition(":")
+            variants[name.strip()] = int(edge)
+    return variants
+
+# Downscaled copies generated next to each stored image: {name: longest edge in px}
+VARIANT_PROFILES = {
+    "chat": parse_variants(os.getenv("CHAT_IMAGE_VARIANTS", "thumb:320,medium:960")),
+    "avatar": parse_variants(os.getenv("AVATAR_IMAGE_VARIANTS", "64:64,200:200")),
+}
+VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", "80"))
+
+# Output formats for on-demand resizing: {fmt query value: (PIL format, mime type)}
+RESIZE_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+_image_pool: Optional[ProcessPoolExecutor] = None
+_pending_transcodes = 0
+
+def new_temp_path(suffix: str = "") -> str:
+    """A fresh path under UPLOAD_TMP_DIR"""
+    return os.path.join(UPLOAD_TMP_DIR, f"{uuid.uuid4()}{suffix}.part")
+
+def remove_quietly(path: Optional[str]):
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def cleanup_upload_temp(max_age_seconds: float = 3600):
+    """Remove partial uploads left behind by a crash or restart"""
+    cutoff = time.time() - max_age_seconds
+    for name in os.listdir(UPLOAD_TMP_DIR):
+        path = os.path.join(UPLOAD_TMP_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def upload_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File exceeds the {UPLOAD_MAX_BYTES} byte upload limit"
+    )
+
+async def stream_to_temp(file: UploadFile) -> Tuple[str, int, str]:
+    """Copy an upload to a temp file in fixed-size chunks, hashing as it goes
+
+    Returns (temp_path, size, sha256 hex). Uploads over UPLOAD_MAX_BYTES are
+    rejected as soon as the limit is crossed, or up front when the size is known.
+    """
+    if file.size is not None and file.size > UPLOAD_MAX_BYTES:
+        raise upload_too_large()
+    
+    path = new_temp_path()
+    digest = hashlib.sha256()
+    size = 0
+    await file.seek(0)
+    try:
+        with open(path, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise upload_too_large()
+                digest.update(chunk)
+                await run_in_threadpool(out.write, chunk)
+    except BaseException:
+        remove_quietly(path)
+        raise
+    return path, size, digest.hexdigest()
+
+def variant_filename(filename: str, name: str) -> str:
+    """Stored name of a variant: {stem}_{name}.webp"""
+    return f"{os.path.splitext(filename)[0]}_{name}.webp"
+
+def variant_urls(url: str, profile: str = "chat") -> Dict[str, str]:
+    """{"full": url, variant: url} for an uploaded image; variants not generated yet fall back to full"""
+    urls = {"full": url}
+    filename = os.path.basename(url)
+    for name in VARIANT_PROFILES.get(profile, {}):
+        variant = variant_filename(filename, name)
+        exists = os.path.exists(os.path.join(UPLOAD_DIR, variant))
+        urls[name] = f"{os.path.dirname(url)}/{variant}" if exists else url
+    return urls
+
+def missing_variants(filename: str, profile: str) -> List[Tuple[str, int]]:
+    """(variant filename, max edge) for the profile's variants not on disk yet"""
+    return [
+        (variant_filename(filename, name), edge)
+        for name, edge in VARIANT_PROFILES.get(profile, {}).items()
+        if not os.path.exists(os.path.join(UPLOAD_DIR, variant_filename(filename, name)))
+    ]
+
+def remove_image_files(filename: str):
+    """Remove a stored upload and every variant or precompressed copy generated from it"""
+    remove_quietly(os.path.join(UPLOAD_DIR, filename))
+    for suffix in PRECOMPRESSED_SUFFIXES.values():
+        remove_quietly(os.path.join(UPLOAD_DIR, filename + suffix))
+    names = {name for variants in VARIANT_PROFILES.values() for name in variants}
+    for name in names:
+        remove_quietly(os.path.join(UPLOAD_DIR, variant_filename(filename, name)))
+
+class ImageTooLarge(ValueError):
+    """Source image has more pixels than IMAGE_MAX_PIXELS"""
+
+def open_scaled(src_path: str, max_width: int, max_height: int) -> Image.Image:
+    """Decode an image no larger than needed to fit max_width x max_height
+
+    The pixel budget is checked from the header, before anything is decoded.
+    JPEG is decoded directly at 1/2, 1/4 or 1/8 scale (draft mode); other
+    formats are shrunk by an integer factor (reduce) before the final
+    LANCZOS resize, which then only works on a small image.
+    """
+    image = Image.open(src_path)
+    if image.width * image.height > IMAGE_MAX_PIXELS:
+        image.close()
+        raise ImageTooLarge(f"Image exceeds {IMAGE_MAX_PIXELS} pixels")
+    
+    scale = min(max_width / image.width, max_height / image.height)
+    if scale >= 1:
+        image.load()
+        return image
+    
+    target = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+    # No-op for anything but JPEG; never goes below the requested size
+    image.draft('RGB', target)
+    if image.mode == 'P':
+        image = image.convert('RGBA')
+    factor = min(image.width // target[0], image.height // target[1])
+    if factor >= 2:
+        try:
+            image = image.reduce(factor)
+        except ValueError:
+            pass  # Mode without reduce support: the resize below does all the work
+    if image.width > target[0] or image.height > target[1]:
+        image = image.resize(target, Image.Resampling.LANCZOS)
+    return image
+
+def flatten_to_rgb(image: Image.Image) -> Image.Image:
+    """Convert to RGB, flattening transparency onto white"""
+    if image.mode in ('RGBA', 'LA', 'P'):
+        rgb_image = Image.new('RGB', image.size, (255, 255, 255))
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        rgb_image.paste(image, mask=image.split()[-1])
+        return rgb_image
+    return image if image.mode == 'RGB' else image.convert('RGB')
 
-async def process_image_upload(file: UploadFile) -> dict:
+def _save_variants(image: Image.Image, variants: List[Tuple[str, int]]):
+    for dest_path, edge in variants:
+        variant = image.copy()
+        variant.thumbnail((edge, edge), Image.Resampling.LANCZOS)
+        variant.save(dest_path, 'WEBP', quality=VARIANT_QUALITY)
+
+def make_variants(src_path: str, variants: List[Tuple[str, int]]) -> dict:
+    """Generate variants from an already stored image; returns timings (worker process)"""
+    largest = max(edge for _, edge in variants)
+    started = time.perf_counter()
+    image = flatten_to_rgb(open_scaled(src_path, largest, largest))
+    decoded = time.perf_counter()
+    _save_variants(image, variants)
+    return {"decode_seconds": decoded - started, "encode_seconds": time.perf_counter() - decoded}
+
+def resize_image(src_path: str, dest_path: str, width: int, fmt: str) -> dict:
+    """Save a stored image at most width px wide in one of RESIZE_FORMATS; returns size and timings (worker process)"""
+    started = time.perf_counter()
+    image = flatten_to_rgb(open_scaled(src_path, width, IMAGE_MAX_PIXELS))
+    decoded = time.perf_counter()
+    image.save(dest_path, RESIZE_FORMATS[fmt][0], quality=VARIANT_QUALITY)
+    return {
+        "size": os.path.getsize(dest_path),
+        "decode_seconds": decoded - started,
+        "encode_seconds": time.perf_counter() - decoded,
+    }
+
+def transcode_image(src_path: str, dest_path: str, variants: List[Tuple[str, int]] = ()) -> dict:
+    """Decode an image, flatten transparency onto white and save it as WEBP
+
+    The stored image is capped at IMAGE_MAX_EDGE on its longest side, and
+    variants are (dest_path, max_edge) pairs saved from the same decoded image.
+    Returns {size, width, height, decode_seconds, encode_seconds}.
+    Runs in a worker process, so it must stay a picklable module-level function.
+    """
+    started = time.perf_counter()
+    image = flatten_to_rgb(open_scaled(src_path, IMAGE_MAX_EDGE, IMAGE_MAX_EDGE))
+    decoded = time.perf_counter()
+    image.save(dest_path, 'WEBP', quality=85)
+    _save_variants(image, variants)
+    return {
+        "size": os.path.getsize(dest_path),
+        "width": image.width,
+        "height": image.height,
+        "decode_seconds": decoded - started,
+        "encode_seconds": time.perf_counter() - decoded,
+    }
+
+def get_image_pool() -> ProcessPoolExecutor:
+    """Create the transcoding pool on first use"""
+    global _image_pool
+    if _image_pool is None:
+        # spawn: never fork a process that is running an event loop and DB pools
+        _image_pool = ProcessPoolExecutor(
+            max_workers=IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _image_pool
+
+def shutdown_image_pool():
+    """Stop worker processes (called on app shutdown)"""
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+        _image_pool = None
+
+def discard_image_pool(pool: ProcessPoolExecutor):
+    """Drop a pool whose worker died so the next job starts a fresh one"""
+    global _image_pool
+    if _image_pool is pool:
+        _image_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _transcode_finished(_future):
+    global _pending_transcodes
+    _pending_transcodes -= 1
+
+async def run_image_job(fn, *args):
+    """Run an image function on the process pool with a bounded queue and a timeout
+
+    Decode and encode timings returned by the function are recorded in
+    image_processing_seconds.
+    """
+    global _pending_transcodes
+    try:
+        if IMAGE_WORKERS <= 0:
+            result = fn(*args)
+        else:
+            if _pending_transcodes >= IMAGE_MAX_PENDING:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Image processing is busy, please retry",
+                    headers={"Retry-After": "1"}
+                )
+            
+            loop = asyncio.get_running_loop()
+            pool = get_image_pool()
+            future = loop.run_in_executor(pool, fn, *args)
+            # The slot is released when the worker actually finishes, even after a timeout
+            _pending_transcodes += 1
+            future.add_done_callback(_transcode_finished)
+            result = await asyncio.wait_for(asyncio.shield(future), timeout=IMAGE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Image processing timed out"
+        )
+    except BrokenProcessPool:
+        # A worker crashed (e.g. killed for memory); every later submit would fail too
+        discard_image_pool(pool)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Image processing restarted, please retry",
+            headers={"Retry-After": "1"}
+        )
+    except ImageTooLarge as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    except (UnidentifiedImageError, OSError, ValueError, Image.DecompressionBombError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid image file"
+        )
+    
+    if isinstance(result, dict):
+        image_processing_seconds.observe(result["decode_seconds"], fn.__name__, "decode")
+        image_processing_seconds.observe(result["encode_seconds"], fn.__name__, "encode")
+    return result
+
+async def ensure_variants(filename: str, profile: str):
+    """Generate any of the profile's variants that are missing for a stored image"""
+    missing = missing_variants(filename, profile)
+    if not missing:
+        return
+    temp_paths = [(new_temp_path(".webp"), edge) for _, edge in missing]
+    try:
+        await run_image_job(make_variants, os.path.join(UPLOAD_DIR, filename), temp_paths)
+        for (variant, _), (temp_path, _) in zip(missing, temp_paths):
+            os.replace(temp_path, os.path.join(UPLOAD_DIR, variant))
+    finally:
+        for temp_path, _ in temp_paths:
+            remove_quietly(temp_path)
+
+async def process_image_upload(file: UploadFile, profile: str = "chat") -> dict:
     """
-    Process image upload: convert to webp with UUID filename
-    Returns: {url, name, mimeType, size, isImage}
+    Process image upload: convert to webp, stored by content hash
+    Returns: {url, name, mimeType, size, isImage, sha256, variants (images only)}
+    
+    profile selects the variant set ("chat" or "avatar"), see VARIANT_PROFILES.
+    
+    The upload is streamed to a temp file first; sha256 is the hash of the
+    uploaded bytes.
     """
-    # Generate UUID filename
-    file_uuid = str(uuid.uuid4())
-    file_extension = os.path.splitext(file.filename)[1].lower()
+    temp_path, _, sha256 = await stream_to_temp(file)
+    return await store_upload(temp_path, sha256, file.filename, file.content_type, profile)
+
+async def store_upload(temp_path: str, sha256: str, original_name: Optional[str], content_type: Optional[str], profile: str = "chat") -> dict:
+    """Store a fully received upload (taking ownership of temp_path) and return its attachment dict
+
+    Content that is already stored is not transcoded or written again: the
+    existing file and URL are reused and its reference count is incremented.
+    """
+    from utils.attachments import acquire_blob, register_blob, blob_url
+    from utils.upload_serving import is_compressible, precompress_file
     
     # Check if it's an image
-    is_image = file.content_type and file.content_type.startswith('image/')
+    is_image = bool(content_type and content_type.startswith('image/'))
     
-    if is_image:
-        # Read image
-        image_data = await file.read()
-        
-        # Open with Pillow
-        image = Image.open(io.BytesIO(image_data))
-        
-        # Convert to RGB if necessary (for formats like PNG with transparency)
-        if image.mode in ('RGBA', 'LA', 'P'):
-            rgb_image = Image.new('RGB', image.size, (255, 255, 255))
-            if image.mode == 'P':
-                image = image.convert('RGBA')
-            rgb_image.paste(image, mask=image.split()[-1] if image.mode in ('RGBA', 'LA') else None)
-            image = rgb_image
-        
-        # Save as webp
-        webp_filename = f"{file_uuid}.webp"
-        webp_path = os.path.join(UPLOAD_DIR, webp_filename)
-        image.save(webp_path, 'WEBP', quality=85)
-        
-        file_size = os.path.getsize(webp_path)
-        
-        return {
-            "url": f"/api/uploads/{webp_filename}",
-            "name": file.filename or "image.webp",
-            "mimeType": "image/webp",
-            "size": file_size,
-            "isImage": True
-        }
-    else:
-        # For non-image files, save as-is with UUID
-        file_uuid = str(uuid.uuid4())
-        file_extension = os.path.splitext(file.filename)[1] if file.filename else ""
-        saved_filename = f"{file_uuid}{file_extension}"
-        saved_path = os.path.join(UPLOAD_DIR, saved_filename)
-        
-        # Save file
-        await file.seek(0)
-        with open(saved_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        file_size = os.path.getsize(saved_path)
+    try:
+        blob = acquire_blob(sha256, is_image)
+        if blob is None:
+            if is_image:
+                # Decode and save as webp in a worker process
+                filename = f"{sha256}.webp"
+                mime_type = "image/webp"
+                webp_temp_path = new_temp_path(".webp")
+                missing = missing_variants(filename, profile)
+                variant_temp_paths = [new_temp_path(".webp") for _ in missing]
+                try:
+                    file_size = (await run_image_job(
+                        transcode_image, temp_path, webp_temp_path,
+                        [(variant_temp, edge) for variant_temp, (_, edge) in zip(variant_temp_paths, missing)]
+                    ))["size"]
+                    # Variants first, so the full image never appears without them
+                    for variant_temp, (variant, _) in zip(variant_temp_paths, missing):
+                        os.replace(variant_temp, os.path.join(UPLOAD_DIR, variant))
+                    os.replace(webp_temp_path, os.path.join(UPLOAD_DIR, filename))
+                finally:
+                    for path in [webp_temp_path] + variant_temp_paths:
+                        remove_quietly(path)
+            else:
+                # For non-image files, keep the bytes as-is
+                file_extension = os.path.splitext(original_name)[1].lower() if original_name else ""
+                filename = f"{sha256}{file_extension}"
+                mime_type = content_type or "application/octet-stream"
+                os.replace(temp_path, os.path.join(UPLOAD_DIR, filename))
+                temp_path = None
+                file_size = os.path.getsize(os.path.join(UPLOAD_DIR, filename))
+                if is_compressible(mimetypes.guess_type(filename)[0] or mime_type):
+                    await run_in_threadpool(precompress_file, os.path.join(UPLOAD_DIR, filename))
+            blob = register_blob(sha256, is_image, filename, mime_type, file_size)
+        elif is_image:
+            # Known content, possibly first used with this profile
+            await ensure_variants(blob.filename, profile)
         
-        return {
-            "url": f"/api/uploads/{saved_filename}",
-            "name": file.filename or "file",
-            "mimeType": file.content_type or "application/octet-stream",
-            "size": file_size,
-            "isImage": False
+        attachment = {
+            "url": blob_url(blob.filename),
+            "name": original_name or ("image.webp" if is_image else "file"),
+            "mimeType": blob.mime_type if is_image else (content_type or blob.mime_type),
+            "size": blob.size,
+            "isImage": is_image,
+            "sha256": sha256
         }
+        if is_image:
+            attachment["variants"] = variant_urls(attachment["url"], profile)
+        return attachment
+    finally:
+        remove_quietly(temp_path)
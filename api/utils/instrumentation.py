@@ -0,0 +1,128 @@
+import time
+from typing import Optional, Set
+
+from utils.metrics import (
+    Gauge, ws_connections, ws_frames_sent, ws_frames_received, ws_send_failures,
+    ws_send_queue_depth, http_request_seconds, db_pool_checkout_seconds
+)
+
+# Frame types clients may send; anything else is counted as "other" so clients cannot grow the label set
+CLIENT_FRAME_TYPES = {"message", "batch", "signal", "subscribe_presence", "unsubscribe_presence", "ping"}
+
+class _Connection:
+    __slots__ = ("pending",)
+
+    def __init__(self):
+        self.pending = 0
+
+# Accepted WebSocket connections, for the queue depth gauge
+_open_connections: Set[_Connection] = set()
+
+ws_send_queue_depth_max = Gauge(
+    "chat_ws_send_queue_depth_max",
+    "Most sends pending on any single connection right now",
+    function=lambda: max((connection.pending for connection in _open_connections), default=0)
+)
+
+def frame_type(text: Optional[str]) -> str:
+    """Type of a JSON frame without decoding it; every frame starts with its "type" key"""
+    if not text or not text.startswith('{"type":'):
+        return "other"
+    start = text.find('"', 8)
+    end = text.find('"', start + 1)
+    if start == -1 or start > 10 or end == -1:
+        return "other"
+    return text[start + 1:end]
+
+class MetricsMiddleware:
+    """ASGI middleware recording HTTP latency per route and WebSocket traffic
+
+    Wraps send/receive rather than the endpoints, so every frame is counted
+    whichever code path sent it, at the cost of one prefix check per frame.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "websocket":
+            await self._websocket(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _http(self, scope, receive, send):
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Set by the router on the shared scope; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_seconds.observe(time.perf_counter() - started, scope["method"], route, status_code)
+
+    async def _websocket(self, scope, receive, send):
+        connection = _Connection()
+        accepted = False
+
+        async def send_wrapper(message):
+            nonlocal accepted
+            if message["type"] != "websocket.send":
+                if message["type"] == "websocket.accept":
+                    accepted = True
+                    ws_connections.inc()
+                    _open_connections.add(connection)
+                await send(message)
+                return
+            kind = frame_type(message.get("text")) if message.get("text") is not None else "binary"
+            ws_send_queue_depth.observe(connection.pending)
+            connection.pending += 1
+            try:
+                await send(message)
+            except Exception:
+                ws_send_failures.inc(kind)
+                raise
+            finally:
+                connection.pending -= 1
+            ws_frames_sent.inc(kind)
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "websocket.receive":
+                kind = frame_type(message.get("text")) if message.get("text") is not None else "binary"
+                ws_frames_received.inc(kind if kind in CLIENT_FRAME_TYPES or kind == "binary" else "other")
+            return message
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            if accepted:
+                ws_connections.dec()
+                _open_connections.discard(connection)
+
+def instrument_engine(engine):
+    """Time pool checkouts and export pool occupancy for an engine"""
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        started = time.perf_counter()
+        try:
+            return connect()
+        finally:
+            db_pool_checkout_seconds.observe(time.perf_counter() - started)
+
+    # Engine.raw_connection() goes through pool.connect(), for sessions and Core alike
+    pool.connect = timed_connect
+    # QueuePool statistics; other pool classes lack them and the gauges are skipped
+    Gauge("chat_db_pool_checked_out", "Database connections currently checked out", function=lambda: pool.checkedout())
+    Gauge("chat_db_pool_size", "Configured database pool size", function=lambda: pool.size())
+    Gauge("chat_db_pool_overflow", "Database connections open beyond the pool size", function=lambda: max(0, pool.overflow()))
@@ -0,0 +1,172 @@
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond sends up to slow fan-outs
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Recipient-count buckets for fan-outs, from direct chats up to the largest groups
+FANOUT_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Sends already waiting on the same connection when another one starts
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+
+# All metrics created in this process, in registration order
+REGISTRY: List = []
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Tuple, extra: str = "") -> str:
+    """Format a Prometheus label set such as {group_id="1",le="0.5"}"""
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Histogram:
+    """Minimal in-process histogram exported in Prometheus text format"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # {labelvalues: [bucket counts..., +Inf count, sum]}
+        self._series: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labelvalues):
+        """Record one observation"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        """Render HELP/TYPE and all series lines"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labelvalues, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += series[len(self.buckets)]
+            labels = _format_labels(self.labelnames, labelvalues, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {series[-1]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labelvalues)} {cumulative}")
+        return lines
+
+class Counter:
+    """Monotonic in-process counter exported in Prometheus text format"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+class Gauge:
+    """Current value, either maintained with inc/dec/set or read from function at scrape time"""
+
+    def __init__(self, name: str, documentation: str, function: Optional[Callable[[], float]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self._value = 0.0
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        with self._lock:
+            self._value = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                return []  # Source unavailable (e.g. pool without stats); skip rather than fail the scrape
+        else:
+            value = self._value
+        lines.append(f"{self.name} {value}")
+        return lines
+
+def render_prometheus() -> str:
+    """Render every registered metric in Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# Time to deliver one broadcast to all online recipients, by kind
+# (group_message, group_change, presence, signal); no per-group label, its cardinality is unbounded
+broadcast_fanout_seconds = Histogram(
+    "chat_broadcast_fanout_seconds",
+    "Time spent fanning a frame out to online recipients",
+    labelnames=("kind",)
+)
+
+# Online recipients of one broadcast, by kind
+broadcast_fanout_size = Histogram(
+    "chat_broadcast_fanout_size",
+    "Online recipients of one broadcast",
+    labelnames=("kind",),
+    buckets=FANOUT_SIZE_BUCKETS
+)
+
+# WebSocket traffic, recorded by MetricsMiddleware at the ASGI boundary
+ws_connections = Gauge("chat_ws_connections", "Open WebSocket connections")
+ws_frames_sent = Counter("chat_ws_frames_sent_total", "WebSocket frames sent, by frame type", labelnames=("type",))
+ws_frames_received = Counter("chat_ws_frames_received_total", "WebSocket frames received, by frame type", labelnames=("type",))
+ws_send_failures = Counter("chat_ws_send_failures_total", "WebSocket sends that raised, by frame type", labelnames=("type",))
+ws_send_queue_depth = Histogram(
+    "chat_ws_send_queue_depth",
+    "Sends already pending on the same connection when a send starts",
+    buckets=QUEUE_DEPTH_BUCKETS
+)
+
+# HTTP latency by route template (not raw path, which is unbounded)
+http_request_seconds = Histogram(
+    "chat_http_request_seconds",
+    "HTTP request latency until the response is sent",
+    labelnames=("method", "route", "status")
+)
+
+# Time to get a connection from the SQLAlchemy pool; its _count is the number of checkouts
+db_pool_checkout_seconds = Histogram(
+    "chat_db_pool_checkout_seconds",
+    "Time spent waiting for a database connection from the pool"
+)
+
+# Image decode / encode time in the worker, by job (transcode_image, make_variants, resize_image)
+image_processing_seconds = Histogram(
+    "chat_image_processing_seconds",
+    "Time spent decoding and encoding images",
+    labelnames=("operation", "stage")
+)
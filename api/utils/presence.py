@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import os
+import secrets
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Set
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update, delete, insert
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models.user import User, UserStatus
+from models.user_presence import UserPresence
+
+load_dotenv()
+
+# Identifies this process in user_presence; defaults to host and pid
+WORKER_ID = os.getenv("PRESENCE_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"[:64]
+# Seconds between presence snapshots written to the database
+PRESENCE_FLUSH_SECONDS = float(os.getenv("PRESENCE_FLUSH_SECONDS", "5"))
+# Rows from workers that stopped heartbeating for this long are dropped
+PRESENCE_STALE_SECONDS = float(os.getenv("PRESENCE_STALE_SECONDS", "60"))
+
+def presence_digest(user_ids: Iterable[int]) -> str:
+    """Short digest of a set of online user ids"""
+    data = ",".join(str(user_id) for user_id in sorted(set(user_ids)))
+    return hashlib.blake2b(data.encode(), digest_size=8).hexdigest()
+
+class PresenceMap:
+    """Authoritative online/offline state, kept in memory and snapshotted to the DB
+
+    Each worker tracks its own users (logged in, or with open WebSocket
+    connections) and learns about other workers' users from user_presence
+    on every flush. users.status is only written by the flush, in bulk,
+    for users whose state changed.
+
+    snapshot_tag is a digest of the online set read back by the last flush;
+    list ETags use it, so it is the same on every worker that read the same
+    snapshot and survives restarts. A local status change replaces it with a
+    unique tag until the next flush.
+    """
+
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self._online: Set[int] = set()
+        self._connections: Dict[int, int] = {}
+        self._remote_online: Set[int] = set()
+        self._dirty: Set[int] = set()
+        self._reconciled = False
+        self._lock = threading.Lock()
+        # Local status changes since start, so a flush does not overwrite a newer tag
+        self._generation = 0
+        self.snapshot_tag = self._unique_tag()
+
+    def _unique_tag(self) -> str:
+        # Until the next flush, a tag no other process or snapshot can produce
+        return f"local{secrets.token_hex(6)}"
+
+    def _set(self, user_id: int, online: bool) -> bool:
+        # Caller holds the lock
+        was_online = user_id in self._online or user_id in self._remote_online
+        if online:
+            self._online.add(user_id)
+        else:
+            self._online.discard(user_id)
+            self._connections.pop(user_id, None)
+        self._dirty.add(user_id)
+        is_online = user_id in self._online or user_id in self._remote_online
+        if was_online != is_online:
+            self._generation += 1
+            self.snapshot_tag = self._unique_tag()
+        return was_online != is_online
+
+    def set_online(self, user_id: int) -> bool:
+        """Mark a user online (login/register); returns True if the status changed"""
+        with self._lock:
+            return self._set(user_id, True)
+
+    def set_offline(self, user_id: int) -> bool:
+        """Mark a user offline on this worker (logout); returns True if the status changed"""
+        with self._lock:
+            return self._set(user_id, False)
+
+    def connect(self, user_id: int) -> bool:
+        """Count a new WebSocket connection"""
+        with self._lock:
+            self._connections[user_id] = self._connections.get(user_id, 0) + 1
+            return self._set(user_id, True)
+
+    def disconnect(self, user_id: int) -> bool:
+        """Drop a WebSocket connection; the user goes offline with the last one"""
+        with self._lock:
+            remaining = self._connections.get(user_id, 0) - 1
+            if remaining > 0:
+                self._connections[user_id] = remaining
+                return False
+            return self._set(user_id, False)
+
+    def is_online(self, user_id: int) -> bool:
+        return user_id in self._online or user_id in self._remote_online
+
+    def status_of(self, user_id: int) -> str:
+        return UserStatus.online.value if self.is_online(user_id) else UserStatus.offline.value
+
+    def apply(self, item):
+        """Overwrite `status` on a response model with the live value"""
+        item.status = self.status_of(item.id)
+        return item
+
+    def apply_all(self, items: Iterable) -> list:
+        return [self.apply(item) for item in items]
+
+    def flush(self, shutting_down: bool = False) -> int:
+        """Write this worker's changes and refresh other workers' users; returns users updated"""
+        with self._lock:
+            if shutting_down:
+                self._dirty |= self._online
+                self._online = set()
+                self._connections = {}
+            dirty = self._dirty
+            self._dirty = set()
+            local_online = set(self._online)
+            generation = self._generation
+
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=PRESENCE_STALE_SECONDS)
+        db = SessionLocal()
+        try:
+            if dirty:
+                db.execute(delete(UserPresence).where(
+                    UserPresence.worker_id == self.worker_id,
+                    UserPresence.user_id.in_(dirty)
+                ))
+                rows = [
+                    {"worker_id": self.worker_id, "user_id": user_id, "last_seen": now}
+                    for user_id in dirty & local_online
+                ]
+                if rows:
+                    db.execute(insert(UserPresence), rows)
+            # Heartbeat for everything this worker still holds
+            db.execute(update(UserPresence).where(
+                UserPresence.worker_id == self.worker_id
+            ).values(last_seen=now))
+
+            # Expire rows left behind by workers that died without a clean shutdown
+            stale_ids = {row.user_id for row in db.query(UserPresence.user_id).filter(
+                UserPresence.last_seen < cutoff
+            ).all()}
+            if stale_ids:
+                db.execute(delete(UserPresence).where(UserPresence.last_seen < cutoff))
+
+            present = db.query(UserPresence.worker_id, UserPresence.user_id).all()
+            remote_online = {row.user_id for row in present if row.worker_id != self.worker_id}
+            snapshot_tag = presence_digest(row.user_id for row in present)
+
+            changed = dirty | stale_ids
+            updated = 0
+            if changed:
+                online_ids = changed & (local_online | remote_online)
+                offline_ids = changed - online_ids
+                # Keep updated_at untouched: presence is not a profile change
+                for ids, value in ((online_ids, UserStatus.online), (offline_ids, UserStatus.offline)):
+                    if ids:
+                        result = db.execute(update(User).where(
+                            User.id.in_(ids),
+                            User.status != value
+                        ).values(status=value, updated_at=User.updated_at))
+                        updated += result.rowcount
+            if not self._reconciled:
+                # First flush: users.status may still say online from before a restart
+                present_ids = db.query(UserPresence.user_id)
+                result = db.execute(update(User).where(
+                    User.status == UserStatus.online,
+                    User.id.notin_(present_ids.scalar_subquery())
+                ).values(status=UserStatus.offline, updated_at=User.updated_at))
+                updated += result.rowcount
+            db.commit()
+            self._reconciled = True
+        except Exception:
+            db.rollback()
+            with self._lock:
+                self._dirty |= dirty
+            raise
+        finally:
+            db.close()
+
+        with self._lock:
+            self._remote_online = remote_online
+            if generation == self._generation:
+                self.snapshot_tag = snapshot_tag
+        return updated
+
+presence = PresenceMap(WORKER_ID)
+
+# Background flush loop, started on app startup
+presence_task: Optional[asyncio.Task] = None
+
+async def run_presence_flusher():
+    """Periodically snapshot presence to the database"""
+    while True:
+        await asyncio.sleep(PRESENCE_FLUSH_SECONDS)
+        try:
+            await run_in_threadpool(presence.flush)
+        except Exception as e:
+            print(f"Error flushing presence: {e}")
+
+def start_presence_flusher():
+    """Schedule the flush loop on the running event loop"""
+    global presence_task
+    if presence_task is None:
+        presence_task = asyncio.create_task(run_presence_flusher())
+
+async def stop_presence_flusher():
+    """Stop the flush loop and mark this worker's users offline"""
+    global presence_task
+    if presence_task is not None:
+        presence_task.cancel()
+        presence_task = None
+    try:
+        await run_in_threadpool(presence.flush, True)
+    except Exception as e:
+        print(f"Error flushing presence on shutdown: {e}")
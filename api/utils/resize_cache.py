@@ -0,0 +1,122 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+from utils.image import UPLOAD_DIR, new_temp_path, remove_quietly, resize_image, run_image_job
+
+load_dotenv()
+
+# Resized copies live here, next to the uploads (same filesystem for atomic renames)
+RESIZE_CACHE_DIR = os.path.join(UPLOAD_DIR, ".cache")
+# Total size of the resize cache before least recently used files are evicted
+RESIZE_CACHE_MAX_BYTES = int(os.getenv("RESIZE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Requested widths are rounded up to one of these, so clients cannot fill the cache with one-off sizes
+RESIZE_WIDTHS = sorted(int(w) for w in os.getenv(
+    "RESIZE_WIDTHS", "64,128,200,320,480,640,960,1280,1920"
+).split(",") if w.strip())
+
+def snap_width(width: Optional[int]) -> int:
+    """Smallest allowed width >= width (the largest one when width is None or beyond it)"""
+    for allowed in RESIZE_WIDTHS:
+        if width is not None and width <= allowed:
+            return allowed
+    return RESIZE_WIDTHS[-1]
+
+class ResizeCache:
+    """Size-bounded LRU of resized uploads on disk
+
+    Entries are tracked in memory and rebuilt from file atimes on first use,
+    so recency survives a restart. Concurrent requests for the same missing
+    entry share one resize job. The cache is per process; several workers
+    sharing UPLOAD_DIR each track (and evict) only what they see.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for name in os.listdir(self.directory):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            found.append((stat.st_atime, name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._total_bytes += size
+        self._loaded = True
+        self._evict()
+
+    def _evict(self, keep: Optional[str] = None):
+        # keep: the entry about to be served, even if it alone exceeds the limit
+        while self._total_bytes > self.max_bytes and self._entries and next(iter(self._entries)) != keep:
+            name, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            remove_quietly(os.path.join(self.directory, name))
+
+    def _add(self, key: str, size: int):
+        self._total_bytes += size - self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._evict(keep=key)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Path of a cached entry, marking it as recently used"""
+        if not self._loaded:
+            self._load()
+        if key not in self._entries:
+            return None
+        path = os.path.join(self.directory, key)
+        try:
+            # atime doubles as the recency order after a restart; mtime is left
+            # alone because it feeds the ETag and Last-Modified of the response
+            stat = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), stat.st_mtime_ns))
+        except FileNotFoundError:
+            self._total_bytes -= self._entries.pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return path
+
+    async def _render(self, filename: str, key: str, width: int, fmt: str) -> str:
+        temp_path = new_temp_path(f".{fmt}")
+        try:
+            size = (await run_image_job(resize_image, os.path.join(UPLOAD_DIR, filename), temp_path, width, fmt))["size"]
+            path = os.path.join(self.directory, key)
+            os.replace(temp_path, path)
+        finally:
+            remove_quietly(temp_path)
+        self._add(key, size)
+        return path
+
+    def _finished(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # Retrieve the error so it is not logged when every waiter went away
+            task.exception()
+
+    async def get(self, filename: str, width: int, fmt: str) -> str:
+        """Path of filename resized to width in fmt, resizing on first request"""
+        key = f"{os.path.splitext(filename)[0]}_w{width}.{fmt}"
+        path = self.lookup(key)
+        if path:
+            return path
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._render(filename, key, width, fmt))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        # A client that disconnects must not cancel the job for the others
+        return await asyncio.shield(task)
+
+resize_cache = ResizeCache(RESIZE_CACHE_DIR, RESIZE_CACHE_MAX_BYTES)
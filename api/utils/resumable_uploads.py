@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, BinaryIO, Dict, Iterator, Optional, Tuple
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from dotenv import load_dotenv
+
+from utils.image import UPLOAD_DIR, UPLOAD_CHUNK_SIZE, UPLOAD_MAX_BYTES, new_temp_path, remove_quietly
+
+try:
+    import fcntl
+except ImportError:  # Windows: chunk writes are then only serialised within one worker
+    fcntl = None
+
+load_dotenv()
+
+# One directory per upload: meta.json plus the bytes received so far (same filesystem as UPLOAD_DIR)
+RESUMABLE_UPLOAD_DIR = os.path.join(UPLOAD_DIR, ".resumable")
+# Largest file accepted through the resumable protocol; the single-shot UPLOAD_MAX_BYTES
+# unless raised explicitly (e.g. to allow large videos)
+RESUMABLE_UPLOAD_MAX_BYTES = int(os.getenv("RESUMABLE_UPLOAD_MAX_BYTES", str(UPLOAD_MAX_BYTES)))
+# Uploads with no activity for this long are deleted
+RESUMABLE_UPLOAD_TTL_SECONDS = int(os.getenv("RESUMABLE_UPLOAD_TTL_SECONDS", str(24 * 3600)))
+
+os.makedirs(RESUMABLE_UPLOAD_DIR, exist_ok=True)
+
+_UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Queues requests for the same upload within this process: {upload_id: lock}; across
+# workers an exclusive lock on the data file decides (see _locked_data_file)
+_upload_locks: Dict[str, asyncio.Lock] = {}
+
+def _upload_path(upload_id: str, name: str) -> str:
+    return os.path.join(RESUMABLE_UPLOAD_DIR, upload_id, name)
+
+def upload_data_path(upload_id: str) -> str:
+    return _upload_path(upload_id, "data")
+
+def _last_activity(upload_id: str) -> float:
+    return max(
+        os.path.getmtime(_upload_path(upload_id, "meta.json")),
+        os.path.getmtime(upload_data_path(upload_id))
+    )
+
+def upload_offset(upload_id: str) -> int:
+    """Bytes received so far; the data file on disk is the source of truth"""
+    return os.path.getsize(upload_data_path(upload_id))
+
+@contextmanager
+def _locked_data_file(upload_id: str) -> Iterator[Tuple[BinaryIO, int]]:
+    """Open the data file under an exclusive lock shared by every worker; yields (file, offset)
+
+    The lock is not waited for: another worker holding it is writing or
+    finishing the same upload, so this request gets 409. The upload may
+    have been finished or removed before the lock was taken (404).
+    """
+    not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    path = upload_data_path(upload_id)
+    try:
+        data = open(path, "r+b")  # Never created here: a missing file is a finished upload
+    except FileNotFoundError:
+        raise not_found
+    with data:
+        if fcntl is not None:
+            try:
+                fcntl.flock(data.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                current = os.fstat(data.fileno()).st_size
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Upload is busy in another request",
+                    headers={"Upload-Offset": str(current)}
+                )
+        try:
+            # The file may have been moved out by a completed upload after we opened it
+            unchanged = os.stat(path).st_ino == os.fstat(data.fileno()).st_ino
+        except FileNotFoundError:
+            unchanged = False
+        if not unchanged:
+            raise not_found
+        yield data, os.fstat(data.fileno()).st_size
+
+def upload_status(meta: dict) -> dict:
+    expires_at = _last_activity(meta["upload_id"]) + RESUMABLE_UPLOAD_TTL_SECONDS
+    return {
+        "upload_id": meta["upload_id"],
+        "filename": meta["filename"],
+        "content_type": meta["content_type"],
+        "size": meta["size"],
+        "offset": upload_offset(meta["upload_id"]),
+        "expires_at": datetime.fromtimestamp(expires_at, tz=timezone.utc).isoformat(),
+    }
+
+def create_upload(user_id: int, filename: str, size: int, content_type: Optional[str],
+                  recipient_id: Optional[int], group_id: Optional[int]) -> dict:
+    """Start an upload; returns its metadata"""
+    if size > RESUMABLE_UPLOAD_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"File exceeds the {RESUMABLE_UPLOAD_MAX_BYTES} byte upload limit"
+        )
+    upload_id = uuid.uuid4().hex
+    meta = {
+        "upload_id": upload_id,
+        "user_id": user_id,
+        "filename": filename,
+        "size": size,
+        "content_type": content_type,
+        "recipient_id": recipient_id,
+        "group_id": group_id,
+    }
+    os.makedirs(os.path.join(RESUMABLE_UPLOAD_DIR, upload_id))
+    open(upload_data_path(upload_id), "wb").close()
+    # meta.json last: a directory without it is an interrupted create and gets expired
+    with open(_upload_path(upload_id, "meta.json"), "w") as out:
+        json.dump(meta, out)
+    return meta
+
+def remove_upload(upload_id: str):
+    shutil.rmtree(os.path.join(RESUMABLE_UPLOAD_DIR, upload_id), ignore_errors=True)
+    _upload_locks.pop(upload_id, None)
+
+def load_upload(upload_id: str, user_id: int) -> dict:
+    """Metadata of one of the user's live uploads (404 for unknown, foreign or expired ones)"""
+    not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+    if not _UPLOAD_ID_PATTERN.match(upload_id):
+        raise not_found
+    try:
+        with open(_upload_path(upload_id, "meta.json")) as source:
+            meta = json.load(source)
+        expired = _last_activity(upload_id) + RESUMABLE_UPLOAD_TTL_SECONDS < time.time()
+    except (OSError, ValueError):
+        raise not_found
+    if meta["user_id"] != user_id:
+        raise not_found
+    if expired:
+        remove_upload(upload_id)
+        raise not_found
+    return meta
+
+async def write_chunk(meta: dict, offset: int, chunks: AsyncIterator[bytes]) -> int:
+    """Append a request body at offset; returns the new offset
+
+    offset must equal the bytes already received (409 otherwise, with the
+    current offset in Upload-Offset). Bytes that arrived before a dropped
+    connection are kept, so the client resumes from the offset it reads back.
+    """
+    upload_id = meta["upload_id"]
+    lock = _upload_locks.setdefault(upload_id, asyncio.Lock())
+    async with lock:
+        with _locked_data_file(upload_id) as (out, current):
+            if offset != current:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"Upload is at offset {current}",
+                    headers={"Upload-Offset": str(current)}
+                )
+            out.seek(current)
+            async for chunk in chunks:
+                if current + len(chunk) > meta["size"]:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail="Chunk goes past the declared upload size",
+                        headers={"Upload-Offset": str(current)}
+                    )
+                await run_in_threadpool(out.write, chunk)
+                current += len(chunk)
+        return current
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+async def take_completed_upload(meta: dict) -> Tuple[str, str]:
+    """Move a fully received upload out of the resumable area; returns (temp_path, sha256)"""
+    upload_id = meta["upload_id"]
+    lock = _upload_locks.setdefault(upload_id, asyncio.Lock())
+    async with lock:
+        with _locked_data_file(upload_id) as (_, current):
+            if current != meta["size"]:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail=f"Upload is incomplete: {current} of {meta['size']} bytes received",
+                    headers={"Upload-Offset": str(current)}
+                )
+            temp_path = new_temp_path()
+            os.replace(upload_data_path(upload_id), temp_path)
+            remove_upload(upload_id)
+    try:
+        return temp_path, await run_in_threadpool(_hash_file, temp_path)
+    except BaseException:
+        remove_quietly(temp_path)
+        raise
+
+def expire_uploads() -> int:
+    """Delete uploads idle for longer than RESUMABLE_UPLOAD_TTL_SECONDS; returns how many"""
+    cutoff = time.time() - RESUMABLE_UPLOAD_TTL_SECONDS
+    removed = 0
+    for upload_id in os.listdir(RESUMABLE_UPLOAD_DIR):
+        try:
+            stale = _last_activity(upload_id) < cutoff
+        except OSError:
+            # Half-created: judge by the directory itself
+            try:
+                stale = os.path.getmtime(os.path.join(RESUMABLE_UPLOAD_DIR, upload_id)) < cutoff
+            except OSError:
+                continue
+        if stale:
+            remove_upload(upload_id)
+            removed += 1
+    return removed
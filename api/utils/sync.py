@@ -0,0 +1,173 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from sqlalchemy import func, or_, and_, insert, select
+from typing import Iterable, List, Optional
+from dotenv import load_dotenv
+
+from database import SessionLocal
+from models.change_log import ChangeLog, ChangeEntity
+from models.group import GroupMember
+
+load_dotenv()
+
+# Change log rows older than this are pruned; clients behind them get full_resync
+CHANGE_LOG_RETENTION_DAYS = float(os.getenv("CHANGE_LOG_RETENTION_DAYS", "30"))
+# Seconds between prune passes
+CHANGE_LOG_PRUNE_SECONDS = float(os.getenv("CHANGE_LOG_PRUNE_SECONDS", "3600"))
+# change_log rows deleted per committed prune step
+CHANGE_LOG_PRUNE_BATCH = int(os.getenv("CHANGE_LOG_PRUNE_BATCH", "5000"))
+
+def record_change(
+    db: Session,
+    entity_type: ChangeEntity,
+    entity_id: int,
+    action: str,
+    audience_user_ids: Optional[Iterable[int]] = None,
+    audience_group_id: Optional[int] = None
+):
+    """Append change log rows in the caller's transaction
+
+    audience_group_id records a single row for the group's members, resolved
+    through group_members when read; audience_user_ids then only needs the
+    users who are no longer members (removed, denied, or the group deleted).
+    Without either, the change is visible to every user (e.g. profile
+    updates); with only audience_user_ids, one row is written per user.
+    """
+    def row(user_id=None, group_id=None):
+        return {
+            "entity_type": entity_type, "entity_id": entity_id, "action": action,
+            "audience_user_id": user_id, "audience_group_id": group_id
+        }
+
+    if audience_user_ids is None and audience_group_id is None:
+        rows = [row()]
+    else:
+        rows = [row(user_id=user_id) for user_id in set(audience_user_ids or ())]
+        if audience_group_id is not None:
+            rows.append(row(group_id=audience_group_id))
+    if rows:
+        db.execute(insert(ChangeLog), rows)
+
+def visible_changes_filter(user_id: int):
+    """Filter for change rows visible to the given user"""
+    return or_(
+        and_(ChangeLog.audience_user_id.is_(None), ChangeLog.audience_group_id.is_(None)),
+        ChangeLog.audience_user_id == user_id,
+        ChangeLog.audience_group_id.in_(
+            select(GroupMember.group_id).where(GroupMember.user_id == user_id)
+        )
+    )
+
+def get_current_version(db: Session, user_id: int, entity_types: List[ChangeEntity]) -> int:
+    """Latest change log id visible to the user for the given entity types
+
+    visible_changes_filter is an OR no single index serves, so max(id) is
+    taken per branch and type, each an index seek, in one statement: global
+    and per-user rows on ix_change_log_user_type, and one lookup per group
+    the user belongs to on ix_change_log_group_type.
+    """
+    lookups = []
+    for entity_type in entity_types:
+        for audience_user_id in (None, user_id):
+            lookups.append(select(func.max(ChangeLog.id)).where(
+                ChangeLog.audience_user_id.is_(None) if audience_user_id is None
+                else ChangeLog.audience_user_id == audience_user_id,
+                ChangeLog.audience_group_id.is_(None),
+                ChangeLog.entity_type == entity_type
+            ).scalar_subquery())
+        per_group = select(
+            select(func.max(ChangeLog.id)).where(
+                ChangeLog.audience_group_id == GroupMember.group_id,
+                ChangeLog.entity_type == entity_type
+            ).correlate(GroupMember).scalar_subquery().label("version")
+        ).where(GroupMember.user_id == user_id).subquery()
+        lookups.append(select(func.max(per_group.c.version)).scalar_subquery())
+    return max((version or 0 for version in db.execute(select(*lookups)).one()), default=0)
+
+def get_latest_version(db: Session) -> int:
+    """Latest change log id of any audience, a valid cursor for every user"""
+    return db.query(func.max(ChangeLog.id)).scalar() or 0
+
+def changes_pruned_since(db: Session, since: int) -> bool:
+    """Whether rows newer than since may have been pruned
+
+    Pruning removes a prefix of ids, so any id below the oldest kept row may
+    be gone.
+    """
+    oldest = db.query(func.min(ChangeLog.id)).scalar()
+    return oldest is not None and since + 1 < oldest
+
+def prune_change_log() -> int:
+    """Delete change log rows older than the retention period; returns rows deleted
+
+    The newest row is always kept, so the oldest kept id marks the pruned
+    prefix and ids never restart after a prune.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=CHANGE_LOG_RETENTION_DAYS)
+    deleted = 0
+    db = SessionLocal()
+    try:
+        latest = get_latest_version(db)
+        horizon = db.query(func.max(ChangeLog.id)).filter(ChangeLog.created_at < cutoff).scalar()
+        if not horizon:
+            return 0
+        upper = min(horizon, latest - 1)
+        while True:
+            batch_end = db.query(ChangeLog.id).filter(ChangeLog.id <= upper).order_by(
+                ChangeLog.id.asc()
+            ).offset(CHANGE_LOG_PRUNE_BATCH - 1).limit(1).scalar() or upper
+            result = db.query(ChangeLog).filter(ChangeLog.id <= batch_end).delete(synchronize_session=False)
+            db.commit()
+            deleted += result
+            if batch_end >= upper:
+                return deleted
+    finally:
+        db.close()
+
+# Background prune loop, started on app startup
+prune_task: Optional[asyncio.Task] = None
+
+async def run_change_log_pruner():
+    """Periodically prune the change log"""
+    while True:
+        try:
+            await run_in_threadpool(prune_change_log)
+        except Exception as e:
+            print(f"Error pruning change log: {e}")
+        await asyncio.sleep(CHANGE_LOG_PRUNE_SECONDS)
+
+def start_change_log_pruner():
+    """Schedule the prune loop on the running event loop"""
+    global prune_task
+    if prune_task is None:
+        prune_task = asyncio.create_task(run_change_log_pruner())
+
+def stop_change_log_pruner():
+    """Cancel the prune loop"""
+    global prune_task
+    if prune_task is not None:
+        prune_task.cancel()
+        prune_task = None
+
+def make_etag(kind: str, user_id: int, version: int, include_presence: bool = False) -> str:
+    """Build a strong ETag for a per-user list response"""
+    tag = f"{kind}-{user_id}-{version}"
+    if include_presence:
+        # Status changes are pushed over WebSocket, not written to change_log: the
+        # presence part is the digest of the last snapshot of user_presence
+        from utils.presence import presence
+        tag += f"-p{presence.snapshot_tag}"
+    return f'"{tag}"'
+
+def not_modified(request: Request, response: Response, etag: str) -> bool:
+    """Set the ETag header and report whether the client's cached copy is still current"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
@@ -0,0 +1,197 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional, Tuple
+
+import anyio
+from fastapi import Request, Response
+from dotenv import load_dotenv
+
+from utils.image import PRECOMPRESSED_SUFFIXES, new_temp_path, remove_quietly
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only without it
+    brotli = None
+
+load_dotenv()
+
+# Upload URLs never change content (names come from content hashes), so caches may keep them for good
+UPLOAD_CACHE_CONTROL = os.getenv("UPLOAD_CACHE_CONTROL", "public, max-age=31536000, immutable")
+# Bytes read per chunk when the server cannot send the file itself
+UPLOAD_SEND_CHUNK_SIZE = int(os.getenv("UPLOAD_SEND_CHUNK_SIZE", str(256 * 1024)))
+# Text uploads at least this large get .gz (and .br with brotli installed) copies
+PRECOMPRESS_MIN_BYTES = int(os.getenv("PRECOMPRESS_MIN_BYTES", "1024"))
+
+# Mime types worth compressing; images, video and archives are already compressed
+_COMPRESSIBLE_TYPES = {
+    "application/json", "application/javascript", "application/xml",
+    "application/x-yaml", "application/sql", "image/svg+xml",
+}
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def is_compressible(mime_type: Optional[str]) -> bool:
+    return bool(mime_type) and (mime_type.startswith("text/") or mime_type in _COMPRESSIBLE_TYPES)
+
+def precompress_file(path: str):
+    """Write .gz (and .br) copies of a stored text file when they are smaller (thread pool)"""
+    if os.path.getsize(path) < PRECOMPRESS_MIN_BYTES:
+        return
+    with open(path, "rb") as source:
+        data = source.read()
+    compressors = {"gzip": lambda raw: gzip.compress(raw, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressors["br"] = lambda raw: brotli.compress(raw, quality=11)
+    for encoding, compress in compressors.items():
+        compressed = compress(data)
+        # Not worth a second representation for a few percent
+        if len(compressed) > len(data) * 0.9:
+            continue
+        temp_path = new_temp_path(PRECOMPRESSED_SUFFIXES[encoding])
+        try:
+            with open(temp_path, "wb") as out:
+                out.write(compressed)
+            os.replace(temp_path, path + PRECOMPRESSED_SUFFIXES[encoding])
+        finally:
+            remove_quietly(temp_path)
+
+def _accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        key, _, value = params.strip().partition("=")
+        try:
+            if key.strip() == "q" and float(value) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+def _etag(path: str, stat_result: os.stat_result) -> str:
+    """Strong validator: changes whenever the file is replaced"""
+    token = f"{os.path.basename(path)}:{stat_result.st_ino}:{stat_result.st_size}:{stat_result.st_mtime_ns}"
+    return '"' + hashlib.sha1(token.encode()).hexdigest() + '"'
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        # Weak comparison, as required for If-None-Match
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def _parse_range(request: Request, etag: str, size: int) -> Tuple[Optional[Tuple[int, int]], bool]:
+    """((start, end inclusive) or None for the whole file, satisfiable)
+
+    Only single ranges are honoured; multi-range requests get the full file,
+    which RFC 9110 allows.
+    """
+    header = request.headers.get("range")
+    if not header:
+        return None, True
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() != etag:
+        return None, True
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None, True
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return None, False
+        return (max(0, size - length), size - 1), True
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return None, False
+    return (start, end), True
+
+class FileRangeResponse(Response):
+    """Send [offset, offset + length) of a file, via the server's zero-copy send when offered
+
+    The ASGI zero-copy extension takes the open file object. uvicorn does
+    not advertise it, so under uvicorn the chunked read below is always used.
+    """
+
+    def __init__(self, path: str, offset: int, length: int, status_code: int, headers: dict, media_type: str):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.headers["content-length"] = str(length)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(self.path, "rb") as file:
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": file,
+                    "offset": self.offset,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            return
+
+        remaining = self.length
+        async with await anyio.open_file(self.path, "rb") as file:
+            await file.seek(self.offset)
+            while remaining > 0:
+                chunk = await file.read(min(UPLOAD_SEND_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            # File shrank underneath us; end the body so the connection is not left hanging
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+def serve_upload(request: Request, path: str, media_type: Optional[str] = None) -> Response:
+    """Respond with a stored upload: immutable caching, strong ETag, 304, Range/206 and precompressed text"""
+    media_type = media_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    headers = {"cache-control": UPLOAD_CACHE_CONTROL, "accept-ranges": "bytes"}
+
+    if is_compressible(media_type):
+        headers["vary"] = "Accept-Encoding"
+        accepted = _accepted_encodings(request)
+        for encoding, suffix in PRECOMPRESSED_SUFFIXES.items():
+            if encoding in accepted and os.path.isfile(path + suffix):
+                path = path + suffix
+                headers["content-encoding"] = encoding
+                break
+
+    stat_result = os.stat(path)
+    etag = _etag(path, stat_result)
+    headers["etag"] = etag
+    headers["last-modified"] = formatdate(stat_result.st_mtime, usegmt=True)
+
+    if _not_modified(request, etag, stat_result.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    size = stat_result.st_size
+    byte_range, satisfiable = _parse_range(request, etag, size)
+    if not satisfiable:
+        headers["content-range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    if byte_range is None:
+        return FileRangeResponse(path, 0, size, 200, headers, media_type)
+    start, end = byte_range
+    headers["content-range"] = f"bytes {start}-{end}/{size}"
+    return FileRangeResponse(path, start, end - start + 1, 206, headers, media_type)
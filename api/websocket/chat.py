@@ -1,22 +1,217 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
 from fastapi.security import HTTPBearer
 from sqlalchemy.orm import Session
-from typing import Dict, Set
+from sqlalchemy import func
+from typing import Dict, Set, Optional, Iterable, Tuple
+import asyncio
 import json
+import os
+import time
 from datetime import datetime
 
 from database import get_db, SessionLocal
 from models.user import User
 from models.message import Message
+from models.message_read import MessageRead
 from models.group import Group, GroupMember
-from models.friendship import Friendship, FriendshipStatus
 from utils.auth import get_session_user_id, sessions
+from utils.presence import presence
+from utils.metrics import broadcast_fanout_seconds, broadcast_fanout_size
+from utils.friend_cache import friend_cache
+from utils.group_cache import group_member_cache
+from utils.image import variant_urls
+from utils.attachments import acquire_attachments
+from utils.group_purge import purging_group_ids
 
 router = APIRouter()
 
 # WebSocket connection pool: {user_id: websocket}
 active_connections: Dict[int, WebSocket] = {}
 
+# Presence interest: {watched_user_id: {subscriber_id}} from `subscribe_presence`
+presence_subscribers: Dict[int, Set[int]] = {}
+# Reverse index for cleanup: {subscriber_id: {watched_user_id}}
+presence_subscriptions: Dict[int, Set[int]] = {}
+# Group chat each user currently has open, and its reverse {group_id: {user_id}}
+open_group_by_user: Dict[int, int] = {}
+open_group_viewers: Dict[int, Set[int]] = {}
+# Users who opted in to every login/logout notification
+global_presence_subscribers: Set[int] = set()
+# Maximum explicit presence subscriptions per connection
+PRESENCE_MAX_SUBSCRIPTIONS = int(os.getenv("PRESENCE_MAX_SUBSCRIPTIONS", "500"))
+
+# Groups with at least this many members use bundled, sharded fan-out
+LARGE_GROUP_THRESHOLD = int(os.getenv("LARGE_GROUP_THRESHOLD", "200"))
+# Connections served by one fan-out worker task
+FANOUT_SHARD_SIZE = int(os.getenv("FANOUT_SHARD_SIZE", "500"))
+# Sends between explicit yields to the event loop inside a shard
+FANOUT_YIELD_EVERY = 50
+
+# Maximum number of operations accepted in one `batch` frame
+WS_BATCH_MAX_OPERATIONS = int(os.getenv("WS_BATCH_MAX_OPERATIONS", "100"))
+
+# Ephemeral signals: allowed kinds, how long an active signal lives on the
+# client without a refresh, and a per-user token bucket
+EPHEMERAL_SIGNAL_KINDS = {"typing", "viewing"}
+SIGNAL_TTL_SECONDS = float(os.getenv("SIGNAL_TTL_SECONDS", "6"))
+SIGNAL_RATE_PER_SECOND = float(os.getenv("SIGNAL_RATE_PER_SECOND", "10"))
+SIGNAL_BURST = int(os.getenv("SIGNAL_BURST", "20"))
+# Active signals per user: {user_id: {(kind, target, target_id): last_forwarded_at}}
+active_signals: Dict[int, Dict[Tuple[str, str, int], float]] = {}
+# Token buckets: {user_id: (tokens, updated_at)}
+signal_buckets: Dict[int, Tuple[float, float]] = {}
+
+# Reconnect replay limits
+REPLAY_BATCH_SIZE = int(os.getenv("REPLAY_BATCH_SIZE", "100"))
+REPLAY_MAX_MESSAGES = int(os.getenv("REPLAY_MAX_MESSAGES", "1000"))
+
+def serialize_message(message: Message) -> dict:
+    """Convert a Message row into a `message` frame"""
+    attachment = None
+    if message.attachment_url:
+        attachment = {
+            "url": message.attachment_url,
+            "name": message.attachment_name or "",
+            "mimeType": message.attachment_type or "",
+            "size": 0,  # Size not stored in DB
+            "isImage": bool(message.attachment_type and message.attachment_type.startswith("image/"))
+        }
+        if attachment["isImage"]:
+            attachment["variants"] = variant_urls(message.attachment_url)
+    
+    return {
+        "type": "message",
+        "id": message.id,
+        "sender_id": message.sender_id,
+        "recipient_id": message.recipient_id,
+        "group_id": message.group_id,
+        "text": message.text,
+        "attachment": attachment,
+        "timestamp": message.timestamp.isoformat()
+    }
+
+async def replay_missed_messages(websocket: WebSocket, user_id: int, last_message_id: int):
+    """Stream messages sent after last_message_id to a reconnecting user in batched frames
+    
+    Each side of a conversation (received, sent, group) is read with its own
+    (column, id) index range scan and the results are merged by id.
+    
+    Group messages follow membership at reconnect time: messages of a group
+    the user left, was removed from or that was deleted while disconnected
+    are not replayed, as the REST API no longer serves them either. The
+    client learns of the removal from /api/sync.
+    """
+    db = SessionLocal()
+    try:
+        group_ids = [gm.group_id for gm in db.query(GroupMember.group_id).filter(
+            GroupMember.user_id == user_id
+        ).all()]
+        
+        fetch_limit = REPLAY_MAX_MESSAGES + 1
+        queries = [
+            db.query(Message).filter(Message.recipient_id == user_id, Message.id > last_message_id),
+            db.query(Message).filter(Message.sender_id == user_id, Message.id > last_message_id),
+        ]
+        if group_ids:
+            queries.append(db.query(Message).filter(
+                Message.group_id.in_(group_ids),
+                Message.id > last_message_id
+            ))
+        
+        missed = {}
+        for query in queries:
+            for msg in query.order_by(Message.id.asc()).limit(fetch_limit).all():
+                missed[msg.id] = msg
+        
+        ordered = [missed[message_id] for message_id in sorted(missed)]
+        truncated = len(ordered) > REPLAY_MAX_MESSAGES
+        ordered = ordered[:REPLAY_MAX_MESSAGES]
+        
+        for start in range(0, len(ordered), REPLAY_BATCH_SIZE):
+            batch = ordered[start:start + REPLAY_BATCH_SIZE]
+            await websocket.send_json({
+                "type": "replay",
+                "messages": [serialize_message(msg) for msg in batch]
+            })
+        
+        # Tell the client where the replay stopped; if truncated it should refetch over REST
+        await websocket.send_json({
+            "type": "replay_complete",
+            "count": len(ordered),
+            "last_message_id": ordered[-1].id if ordered else last_message_id,
+            "truncated": truncated
+        })
+    finally:
+        db.close()
+
+def build_message_notification(message: Message, sender: User, group: Group = None) -> dict:
+    """Build the `message_notification` frame for a new message"""
+    text = message.text
+    notification = {
+        "type": "message_notification",
+        "message_id": message.id,
+        "sender_id": sender.id,
+        "sender_name": sender.name,
+        "text": text[:50] + "..." if text and len(text) > 50 else text,
+        "timestamp": message.timestamp.isoformat()
+    }
+    if group:
+        notification["group_id"] = group.id
+        notification["group_name"] = group.name
+    else:
+        notification["recipient_id"] = message.recipient_id
+    return notification
+
+def parse_last_message_id(websocket: WebSocket) -> Optional[int]:
+    """Read the `last_message_id` replay cursor from the connect handshake"""
+    value = websocket.query_params.get("last_message_id")
+    if value is None:
+        return None
+    try:
+        last_message_id = int(value)
+    except ValueError:
+        return None
+    return last_message_id if last_message_id >= 0 else None
+
+def encode_frame(frame: dict) -> str:
+    """Serialize a frame once, the same way WebSocket.send_json does"""
+    return json.dumps(frame, separators=(",", ":"), ensure_ascii=False)
+
+def bundle_frames(*frames: dict) -> dict:
+    """Merge several frames for the same recipient into one `bundle` frame"""
+    return {"type": "bundle", "frames": list(frames)}
+
+async def _send_shard(websockets: list, payload: str):
+    """Send a pre-encoded payload to one shard of connections"""
+    for index, websocket in enumerate(websockets, 1):
+        try:
+            await websocket.send_text(payload)
+        except:
+            pass  # Connection might be closed
+        if index % FANOUT_YIELD_EVERY == 0:
+            # Let other connections' traffic through during very large fan-outs
+            await asyncio.sleep(0)
+
+async def fanout_payload(user_ids: Iterable[int], payload: str) -> int:
+    """Send one pre-encoded payload to every online user, sharded across worker tasks
+
+    Returns the number of online recipients.
+    """
+    websockets = [active_connections[user_id] for user_id in user_ids if user_id in active_connections]
+    if not websockets:
+        return 0
+    shards = [websockets[i:i + FANOUT_SHARD_SIZE] for i in range(0, len(websockets), FANOUT_SHARD_SIZE)]
+    if len(shards) == 1:
+        await _send_shard(shards[0], payload)
+    else:
+        await asyncio.gather(*(_send_shard(shard, payload) for shard in shards))
+    return len(websockets)
+
+def observe_fanout(kind: str, started: float, recipients: int):
+    """Record one broadcast's duration and online recipient count"""
+    broadcast_fanout_seconds.observe(time.perf_counter() - started, kind)
+    broadcast_fanout_size.observe(recipients, kind)
+
 async def broadcast_to_all(message: dict, exclude_user_id: int = None):
     """Broadcast message to all connected users"""
     for user_id, websocket in list(active_connections.items()):
@@ -27,49 +222,103 @@ async def broadcast_to_all(message: dict, exclude_user_id: int = None):
         except:
             pass  # Connection might be closed
 
-async def broadcast_user_status(user_id: int, status: str, broadcast_to_all_users: bool = False):
-    """Broadcast user status change to all friends, or all users if broadcast_to_all_users=True"""
-    db = SessionLocal()
-    try:
-        user = db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return
-        
-        # Prepare status update message
-        status_update = {
-            "type": "user_status_update",
-            "user_id": user_id,
-            "user_name": user.name,
-            "status": status,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        if broadcast_to_all_users:
-            # Broadcast to all connected users
-            await broadcast_to_all(status_update, exclude_user_id=user_id)
-        else:
-            # Get all friends
-            friendships = db.query(Friendship).filter(
-                ((Friendship.user_id == user_id) | (Friendship.friend_id == user_id)),
-                Friendship.status == FriendshipStatus.accepted
-            ).all()
-            
-            friend_ids = set()
-            for friendship in friendships:
-                if friendship.user_id == user_id:
-                    friend_ids.add(friendship.friend_id)
-                else:
-                    friend_ids.add(friendship.user_id)
-            
-            # Broadcast to all friends
-            for friend_id in friend_ids:
-                if friend_id in active_connections:
-                    try:
-                        await active_connections[friend_id].send_json(status_update)
-                    except:
-                        pass  # Connection might be closed
-    finally:
-        db.close()
+def presence_audience(user_id: int) -> Set[int]:
+    """Users interested in this user's presence
+    
+    Friends, viewers of an open group chat the user belongs to, explicit
+    `subscribe_presence` subscribers and global subscribers.
+    """
+    audience = set(friend_cache.get_friend_ids(user_id))
+    audience |= presence_subscribers.get(user_id, set())
+    audience |= global_presence_subscribers
+    
+    # Open groups' member sets come from the cache, so fan-out stays off the database
+    for group_id, viewers in list(open_group_viewers.items()):
+        if user_id in group_member_cache.get_member_ids(group_id):
+            audience |= viewers
+    
+    audience.discard(user_id)
+    return audience
+
+def set_open_group(user_id: int, group_id: Optional[int]):
+    """Record which group chat a user has open (None closes it)"""
+    previous = open_group_by_user.pop(user_id, None)
+    if previous is not None:
+        viewers = open_group_viewers.get(previous)
+        if viewers:
+            viewers.discard(user_id)
+            if not viewers:
+                del open_group_viewers[previous]
+    if group_id is not None:
+        open_group_by_user[user_id] = group_id
+        open_group_viewers.setdefault(group_id, set()).add(user_id)
+
+def unsubscribe_presence(subscriber_id: int, user_ids: Iterable[int]):
+    """Drop explicit presence subscriptions"""
+    targets = presence_subscriptions.get(subscriber_id)
+    if not targets:
+        return
+    for user_id in list(user_ids):
+        targets.discard(user_id)
+        subscribers = presence_subscribers.get(user_id)
+        if subscribers:
+            subscribers.discard(subscriber_id)
+            if not subscribers:
+                del presence_subscribers[user_id]
+    if not targets:
+        del presence_subscriptions[subscriber_id]
+
+def clear_presence_interest(user_id: int):
+    """Forget everything a disconnected user was watching"""
+    unsubscribe_presence(user_id, list(presence_subscriptions.get(user_id, ())))
+    set_open_group(user_id, None)
+    global_presence_subscribers.discard(user_id)
+
+async def broadcast_presence_notice(message: dict, exclude_user_id: int = None):
+    """Send login/logout notices to users who opted in to global presence"""
+    for user_id in list(global_presence_subscribers):
+        if user_id == exclude_user_id or user_id not in active_connections:
+            continue
+        try:
+            await active_connections[user_id].send_json(message)
+        except:
+            pass  # Connection might be closed
+
+async def broadcast_user_status(user_id: int, status: str, user_name: str = None):
+    """Broadcast user status change to the users interested in it (see presence_audience)
+    
+    Pass user_name when the caller already has it; friend ids come from the
+    in-memory friend graph, so the common path does not touch the DB.
+    """
+    if user_name is None:
+        db = SessionLocal()
+        try:
+            user = db.query(User).filter(User.id == user_id).first()
+            if not user:
+                return
+            user_name = user.name
+        finally:
+            db.close()
+    
+    # Prepare status update message
+    status_update = {
+        "type": "user_status_update",
+        "user_id": user_id,
+        "user_name": user_name,
+        "status": status,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    
+    started = time.perf_counter()
+    recipients = 0
+    for audience_id in presence_audience(user_id):
+        if audience_id in active_connections:
+            recipients += 1
+            try:
+                await active_connections[audience_id].send_json(status_update)
+            except:
+                pass  # Connection might be closed
+    observe_fanout("presence", started, recipients)
 
 async def broadcast_friend_change(user_id: int, friend_id: int, action: str):
     """Broadcast friend change (add/remove) to both users"""
@@ -93,8 +342,8 @@ async def broadcast_friend_change(user_id: int, friend_id: int, action: str):
         except:
             pass
 
-async def broadcast_group_change(group_id: int, action: str, data: dict = None):
-    """Broadcast group change to all members"""
+async def broadcast_group_change(group_id: int, action: str, data: dict = None, notify_user_ids: Set[int] = None):
+    """Broadcast group change to all members, plus notify_user_ids (e.g. members just removed)"""
     db = SessionLocal()
     try:
         group = db.query(Group).filter(Group.id == group_id).first()
@@ -123,6 +372,9 @@ async def broadcast_group_change(group_id: int, action: str, data: dict = None):
             "user_info": user_info
         }
         
+        started = time.perf_counter()
+        system_message = None
+        
         # Send system message to group members for member_added/member_removed
         if action in ["member_added", "member_removed"] and user_info:
             system_message = {
@@ -135,7 +387,18 @@ async def broadcast_group_change(group_id: int, action: str, data: dict = None):
                 "text": f"{user_info['name']} {'加入' if action == 'member_added' else '離開'}了群組 {group.name}",
                 "timestamp": datetime.utcnow().isoformat()
             }
-            
+        
+        if len(member_ids) >= LARGE_GROUP_THRESHOLD:
+            # Large group: one bundled frame per member, encoded once and sent in shards
+            member_frame = bundle_frames(system_message, group_notification) if system_message else group_notification
+            recipients = await fanout_payload(member_ids, encode_frame(member_frame))
+            extra_ids = set(notify_user_ids or ()) - member_ids
+            if extra_ids:
+                recipients += await fanout_payload(extra_ids, encode_frame(group_notification))
+            observe_fanout("group_change", started, recipients)
+            return
+        
+        if system_message:
             for member_id in member_ids:
                 if member_id in active_connections:
                     try:
@@ -144,12 +407,15 @@ async def broadcast_group_change(group_id: int, action: str, data: dict = None):
                         pass
         
         # Send group change notification
-        for member_id in member_ids:
+        recipients = 0
+        for member_id in member_ids | set(notify_user_ids or ()):
             if member_id in active_connections:
+                recipients += 1
                 try:
                     await active_connections[member_id].send_json(group_notification)
                 except:
                     pass
+        observe_fanout("group_change", started, recipients)
     finally:
         db.close()
 
@@ -193,15 +459,8 @@ async def websocket_endpoint(websocket: WebSocket):
         if user is None:
             return
         
-        # Update user status to online
-        db = SessionLocal()
-        try:
-            db_user = db.query(User).filter(User.id == user.id).first()
-            if db_user:
-                db_user.status = "online"
-                db.commit()
-        finally:
-            db.close()
+        # Mark user online in the presence map (no per-connect DB write)
+        presence.connect(user.id)
         
         # Store connection
         active_connections[user.id] = websocket
@@ -209,43 +468,33 @@ async def websocket_endpoint(websocket: WebSocket):
         # Send all friends' current status to the newly connected user
         db = SessionLocal()
         try:
-            # Get all friends
-            friendships = db.query(Friendship).filter(
-                ((Friendship.user_id == user.id) | (Friendship.friend_id == user.id)),
-                Friendship.status == FriendshipStatus.accepted
-            ).all()
-            
-            friend_ids = set()
-            for friendship in friendships:
-                if friendship.user_id == user.id:
-                    friend_ids.add(friendship.friend_id)
-                else:
-                    friend_ids.add(friendship.user_id)
+            friend_ids = friend_cache.get_friend_ids(user.id, db)
             
-            # Send status update for each friend
-            for friend_id in friend_ids:
-                friend_user = db.query(User).filter(User.id == friend_id).first()
-                if friend_user:
-                    status_update = {
-                        "type": "user_status_update",
-                        "user_id": friend_id,
-                        "user_name": friend_user.name,
-                        "status": friend_user.status or "offline"
-                    }
-                    try:
-                        await websocket.send_json(status_update)
-                    except:
-                        pass
+            # Send status update for each friend (one query for all of them)
+            friend_users = db.query(User.id, User.name).filter(
+                User.id.in_(friend_ids)
+            ).all() if friend_ids else []
+            for friend_user in friend_users:
+                status_update = {
+                    "type": "user_status_update",
+                    "user_id": friend_user.id,
+                    "user_name": friend_user.name,
+                    "status": presence.status_of(friend_user.id)
+                }
+                try:
+                    await websocket.send_json(status_update)
+                except:
+                    pass
         finally:
             db.close()
         
         # Broadcast user online status to all friends
         try:
-            await broadcast_user_status(user.id, "online")
+            await broadcast_user_status(user.id, "online", user_name=user.name)
         except Exception as e:
             print(f"Error broadcasting user status: {e}")
         
-        # Broadcast login notification to all users
+        # Broadcast login notification to global presence subscribers
         try:
             login_notification = {
                 "type": "user_login",
@@ -254,17 +503,32 @@ async def websocket_endpoint(websocket: WebSocket):
                 "message": f"{user.name} 已登入",
                 "timestamp": datetime.utcnow().isoformat()
             }
-            await broadcast_to_all(login_notification, exclude_user_id=user.id)
+            await broadcast_presence_notice(login_notification, exclude_user_id=user.id)
         except Exception as e:
             print(f"Error broadcasting login notification: {e}")
         
-        # Send connection confirmation
+        # Send connection confirmation; any later message is delivered live, so the
+        # latest id is a valid replay cursor for a client that has not seen one yet
+        db = SessionLocal()
+        try:
+            latest_message_id = db.query(func.max(Message.id)).scalar() or 0
+        finally:
+            db.close()
         await websocket.send_json({
             "type": "connected",
             "user_id": user.id,
-            "message": "Connected to chat"
+            "message": "Connected to chat",
+            "last_message_id": latest_message_id
         })
         
+        # Replay messages missed while disconnected
+        last_message_id = parse_last_message_id(websocket)
+        if last_message_id is not None:
+            try:
+                await replay_missed_messages(websocket, user.id, last_message_id)
+            except Exception as e:
+                print(f"Error replaying missed messages: {e}")
+        
         # Listen for messages
         while True:
             try:
@@ -273,6 +537,14 @@ async def websocket_endpoint(websocket: WebSocket):
                 
                 if message_data.get("type") == "message":
                     await handle_message(user, message_data)
+                elif message_data.get("type") == "batch":
+                    await handle_batch(user, message_data)
+                elif message_data.get("type") == "signal":
+                    await handle_signal(user, message_data)
+                elif message_data.get("type") == "subscribe_presence":
+                    await handle_subscribe_presence(user, message_data)
+                elif message_data.get("type") == "unsubscribe_presence":
+                    unsubscribe_presence(user.id, message_data.get("user_ids") or [])
                 elif message_data.get("type") == "ping":
                     # Heartbeat/ping response
                     await websocket.send_json({"type": "pong"})
@@ -298,25 +570,19 @@ async def websocket_endpoint(websocket: WebSocket):
         # Remove connection
         if user and user.id in active_connections:
             del active_connections[user.id]
+        if user:
+            clear_presence_interest(user.id)
+            await clear_signals(user.id)
         
         # Update user status to offline and broadcast
-        if user:
-            db = SessionLocal()
-            try:
-                db_user = db.query(User).filter(User.id == user.id).first()
-                if db_user:
-                    db_user.status = "offline"
-                    db.commit()
-            finally:
-                db.close()
-            
+        if user and presence.disconnect(user.id):
             # Broadcast user offline status to all users (not just friends)
             try:
-                await broadcast_user_status(user.id, "offline", broadcast_to_all_users=True)
+                await broadcast_user_status(user.id, "offline", user_name=user.name)
             except Exception as e:
                 print(f"Error broadcasting user offline status: {e}")
             
-            # Broadcast logout notification to all users
+            # Broadcast logout notification to global presence subscribers
             try:
                 logout_notification = {
                     "type": "user_logout",
@@ -325,32 +591,26 @@ async def websocket_endpoint(websocket: WebSocket):
                     "message": f"{user.name} 已登出",
                     "timestamp": datetime.utcnow().isoformat()
                 }
-                await broadcast_to_all(logout_notification)
+                await broadcast_presence_notice(logout_notification)
             except Exception as e:
                 print(f"Error broadcasting logout notification: {e}")
     except Exception as e:
         # Remove connection on error
         if user and user.id in active_connections:
             del active_connections[user.id]
+        if user:
+            clear_presence_interest(user.id)
+            await clear_signals(user.id)
         
         # Update status if we have user
-        if user:
-            db = SessionLocal()
-            try:
-                db_user = db.query(User).filter(User.id == user.id).first()
-                if db_user:
-                    db_user.status = "offline"
-                    db.commit()
-            finally:
-                db.close()
-            
+        if user and presence.disconnect(user.id):
             # Broadcast user offline status to all users (not just friends)
             try:
-                await broadcast_user_status(user.id, "offline", broadcast_to_all_users=True)
+                await broadcast_user_status(user.id, "offline", user_name=user.name)
             except Exception as e2:
                 print(f"Error broadcasting user offline status: {e2}")
             
-            # Broadcast logout notification to all users
+            # Broadcast logout notification to global presence subscribers
             try:
                 logout_notification = {
                     "type": "user_logout",
@@ -359,7 +619,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     "message": f"{user.name} 已登出",
                     "timestamp": datetime.utcnow().isoformat()
                 }
-                await broadcast_to_all(logout_notification)
+                await broadcast_presence_notice(logout_notification)
             except Exception as e2:
                 print(f"Error broadcasting logout notification: {e2}")
         
@@ -387,6 +647,21 @@ async def handle_message(sender: User, message_data: dict):
     
     db = SessionLocal()
     try:
+        if group_id:
+            # Same checks as `batch`: a deleted group keeps its row until purged,
+            # and a message added meanwhile would be missed by the purge
+            is_member = db.query(GroupMember.id).filter(
+                GroupMember.group_id == group_id,
+                GroupMember.user_id == sender.id
+            ).first() is not None
+            if not is_member or purging_group_ids(db, [group_id]):
+                if sender.id in active_connections:
+                    await active_connections[sender.id].send_json({
+                        "type": "error",
+                        "message": "Not a member of this group"
+                    })
+                return
+
         # Save message to database
         new_message = Message(
             sender_id=sender.id,
@@ -398,6 +673,8 @@ async def handle_message(sender: User, message_data: dict):
             attachment_type=attachment.get("mimeType") if attachment else None
         )
         db.add(new_message)
+        # A reused upload URL is one more reference on its stored file
+        acquire_attachments(db, [new_message.attachment_url])
         db.commit()
         db.refresh(new_message)
         
@@ -433,15 +710,7 @@ async def handle_message(sender: User, message_data: dict):
             
             # Send notification to recipient if they're not in the chat window
             # (This is a dynamic notification - you can enhance this logic)
-            notification = {
-                "type": "message_notification",
-                "message_id": new_message.id,
-                "sender_id": sender.id,
-                "sender_name": sender.name,
-                "recipient_id": recipient_id,
-                "text": text[:50] + "..." if text and len(text) > 50 else text,
-                "timestamp": new_message.timestamp.isoformat()
-            }
+            notification = build_message_notification(new_message, sender)
             if recipient_id in active_connections:
                 try:
                     await active_connections[recipient_id].send_json(notification)
@@ -456,9 +725,25 @@ async def handle_message(sender: User, message_data: dict):
             ).all()
             
             member_ids = {m.user_id for m in members}
+            started = time.perf_counter()
+            
+            if group and len(member_ids) >= LARGE_GROUP_THRESHOLD:
+                # Large group: message and notification share one frame per recipient,
+                # encoded once and delivered by sharded worker tasks
+                notification = build_message_notification(new_message, sender, group)
+                recipients = await fanout_payload(
+                    member_ids - {sender.id},
+                    encode_frame(bundle_frames(message_response, notification))
+                )
+                await fanout_payload([sender.id], encode_frame(message_response))
+                observe_fanout("group_message", started, recipients)
+                return
             
+            recipients = 0
             for member_id in member_ids:
                 if member_id in active_connections:
+                    if member_id != sender.id:
+                        recipients += 1
                     try:
                         await active_connections[member_id].send_json(message_response)
                     except:
@@ -466,22 +751,325 @@ async def handle_message(sender: User, message_data: dict):
             
             # Send notification to group members who might not be viewing the chat
             if group:
-                notification = {
-                    "type": "message_notification",
-                    "message_id": new_message.id,
-                    "sender_id": sender.id,
-                    "sender_name": sender.name,
-                    "group_id": group_id,
-                    "group_name": group.name,
-                    "text": text[:50] + "..." if text and len(text) > 50 else text,
-                    "timestamp": new_message.timestamp.isoformat()
-                }
+                notification = build_message_notification(new_message, sender, group)
                 for member_id in member_ids:
                     if member_id != sender.id and member_id in active_connections:
                         try:
                             await active_connections[member_id].send_json(notification)
                         except:
                             pass
+            observe_fanout("group_message", started, recipients)
                     
     finally:
         db.close()
+
+async def handle_batch(sender: User, batch_data: dict):
+    """Handle a `batch` frame carrying several messages and read acknowledgements
+    
+    All operations are persisted in a single transaction, and every online
+    recipient gets one combined `batch` delivery frame.
+    """
+    operations = batch_data.get("operations") or []
+    sender_ws = active_connections.get(sender.id)
+    
+    if not isinstance(operations, list) or len(operations) > WS_BATCH_MAX_OPERATIONS:
+        if sender_ws:
+            await sender_ws.send_json({
+                "type": "error",
+                "message": f"Batch must be a list of at most {WS_BATCH_MAX_OPERATIONS} operations"
+            })
+        return
+    
+    db = SessionLocal()
+    try:
+        message_ops = [
+            (index, op) for index, op in enumerate(operations)
+            if isinstance(op, dict) and op.get("type") == "message"
+        ]
+        read_ops = [op for op in operations if isinstance(op, dict) and op.get("type") == "read"]
+        errors = []
+        
+        # Membership for every group referenced in the batch, in one query
+        requested_group_ids = {op.get("group_id") for _, op in message_ops if op.get("group_id")}
+        member_group_ids = set()
+        if requested_group_ids:
+            member_group_ids = {gm.group_id for gm in db.query(GroupMember.group_id).filter(
+                GroupMember.user_id == sender.id,
+                GroupMember.group_id.in_(requested_group_ids)
+            ).all()}
+            member_group_ids -= purging_group_ids(db, member_group_ids)
+        
+        new_messages = []
+        for index, op in message_ops:
+            recipient_id = op.get("recipient_id")
+            group_id = op.get("group_id")
+            attachment = op.get("attachment")
+            if not recipient_id and not group_id:
+                errors.append({"index": index, "message": "Either recipient_id or group_id must be provided"})
+                continue
+            if group_id and group_id not in member_group_ids:
+                errors.append({"index": index, "message": "Not a member of this group"})
+                continue
+            new_messages.append((op, Message(
+                sender_id=sender.id,
+                recipient_id=recipient_id,
+                group_id=group_id,
+                text=op.get("text"),
+                attachment_url=attachment.get("url") if attachment else None,
+                attachment_name=attachment.get("name") if attachment else None,
+                attachment_type=attachment.get("mimeType") if attachment else None
+            )))
+        db.add_all([message for _, message in new_messages])
+        acquire_attachments(db, [message.attachment_url for _, message in new_messages])
+        
+        # Read acknowledgements: validate access and skip already-read rows in bulk
+        read_ids = {op.get("message_id") for op in read_ops if op.get("message_id")}
+        read_messages = []
+        if read_ids:
+            candidates = db.query(Message).filter(Message.id.in_(read_ids)).all()
+            candidate_group_ids = {m.group_id for m in candidates if m.group_id}
+            readable_group_ids = set()
+            if candidate_group_ids:
+                readable_group_ids = {gm.group_id for gm in db.query(GroupMember.group_id).filter(
+                    GroupMember.user_id == sender.id,
+                    GroupMember.group_id.in_(candidate_group_ids)
+                ).all()}
+            already_read = {mr.message_id for mr in db.query(MessageRead.message_id).filter(
+                MessageRead.user_id == sender.id,
+                MessageRead.message_id.in_(read_ids)
+            ).all()}
+            for message in candidates:
+                if message.recipient_id and message.recipient_id != sender.id:
+                    continue
+                if message.group_id and message.group_id not in readable_group_ids:
+                    continue
+                if message.id in already_read:
+                    continue
+                read_messages.append(message)
+            db.add_all([MessageRead(message_id=m.id, user_id=sender.id) for m in read_messages])
+        
+        db.commit()
+        for _, message in new_messages:
+            db.refresh(message)
+        
+        # Group members and names for fan-out, loaded once per batch
+        groups_by_id = {}
+        members_by_group = {}
+        delivered_group_ids = {message.group_id for _, message in new_messages if message.group_id}
+        if delivered_group_ids:
+            groups_by_id = {g.id: g for g in db.query(Group).filter(Group.id.in_(delivered_group_ids)).all()}
+            for gm in db.query(GroupMember.group_id, GroupMember.user_id).filter(
+                GroupMember.group_id.in_(delivered_group_ids)
+            ).all():
+                members_by_group.setdefault(gm.group_id, set()).add(gm.user_id)
+        
+        # Collect combined frames per recipient
+        deliveries: Dict[int, dict] = {}
+        def delivery_for(user_id: int) -> dict:
+            return deliveries.setdefault(user_id, {"type": "batch", "messages": [], "notifications": [], "reads": []})
+        
+        for op, message in new_messages:
+            message_response = serialize_message(message)
+            if op.get("attachment"):
+                message_response["attachment"] = op.get("attachment")
+            
+            if message.recipient_id:
+                recipients = {message.recipient_id, sender.id}
+                notification = build_message_notification(message, sender)
+                notified = {message.recipient_id}
+            else:
+                recipients = members_by_group.get(message.group_id, set())
+                group = groups_by_id.get(message.group_id)
+                notification = build_message_notification(message, sender, group) if group else None
+                notified = recipients - {sender.id}
+            
+            for user_id in recipients:
+                if user_id in active_connections:
+                    delivery_for(user_id)["messages"].append(message_response)
+            if notification:
+                for user_id in notified:
+                    if user_id in active_connections:
+                        delivery_for(user_id)["notifications"].append(notification)
+        
+        for message in read_messages:
+            if message.sender_id in active_connections:
+                delivery_for(message.sender_id)["reads"].append({
+                    "type": "message_read",
+                    "message_id": message.id,
+                    "user_id": sender.id
+                })
+        
+        for user_id, frame in deliveries.items():
+            websocket = active_connections.get(user_id)
+            if websocket:
+                try:
+                    await websocket.send_json(frame)
+                except:
+                    pass  # Connection might be closed
+        
+        if sender_ws:
+            await sender_ws.send_json({
+                "type": "batch_ack",
+                "batch_id": batch_data.get("batch_id"),
+                "message_ids": [message.id for _, message in new_messages],
+                "read_message_ids": [message.id for message in read_messages],
+                "errors": errors
+            })
+    finally:
+        db.close()
+
+async def handle_subscribe_presence(user: User, data: dict):
+    """Handle `subscribe_presence`: explicit user ids, the open group chat, and global opt-in
+    
+    Replies with a `presence_snapshot` of the newly watched users.
+    """
+    websocket = active_connections.get(user.id)
+    user_ids = {int(user_id) for user_id in (data.get("user_ids") or [])}
+    user_ids.discard(user.id)
+    
+    current = presence_subscriptions.get(user.id, set())
+    if len(current | user_ids) > PRESENCE_MAX_SUBSCRIPTIONS:
+        if websocket:
+            await websocket.send_json({
+                "type": "error",
+                "message": f"At most {PRESENCE_MAX_SUBSCRIPTIONS} presence subscriptions per connection"
+            })
+        return
+    
+    if "global" in data:
+        if data.get("global"):
+            global_presence_subscribers.add(user.id)
+        else:
+            global_presence_subscribers.discard(user.id)
+    
+    db = SessionLocal()
+    try:
+        snapshot_ids = set(user_ids)
+        
+        if "group_id" in data:
+            group_id = data.get("group_id")
+            if group_id is None:
+                set_open_group(user.id, None)
+            else:
+                # Also warms the cache presence_audience reads for this group
+                member_ids = group_member_cache.get_member_ids(group_id)
+                if user.id not in member_ids:
+                    if websocket:
+                        await websocket.send_json({
+                            "type": "error",
+                            "message": "Not a member of this group"
+                        })
+                    return
+                set_open_group(user.id, group_id)
+                snapshot_ids |= member_ids - {user.id}
+        
+        for user_id in user_ids:
+            presence_subscribers.setdefault(user_id, set()).add(user.id)
+            presence_subscriptions.setdefault(user.id, set()).add(user_id)
+        
+        users = db.query(User.id, User.name).filter(
+            User.id.in_(snapshot_ids)
+        ).all() if snapshot_ids else []
+    finally:
+        db.close()
+    
+    if websocket:
+        await websocket.send_json({
+            "type": "presence_snapshot",
+            "users": [
+                {"user_id": u.id, "user_name": u.name, "status": presence.status_of(u.id)}
+                for u in users
+            ]
+        })
+
+def take_signal_token(user_id: int) -> bool:
+    """Per-user token bucket for ephemeral signals"""
+    now = time.monotonic()
+    tokens, updated_at = signal_buckets.get(user_id, (SIGNAL_BURST, now))
+    tokens = min(SIGNAL_BURST, tokens + (now - updated_at) * SIGNAL_RATE_PER_SECOND)
+    if tokens < 1:
+        signal_buckets[user_id] = (tokens, now)
+        return False
+    signal_buckets[user_id] = (tokens - 1, now)
+    return True
+
+def signal_recipients(sender_id: int, recipient_id, group_id) -> Optional[Set[int]]:
+    """Who may receive a signal, using the same rules as messages; None if not allowed"""
+    if group_id:
+        member_ids = group_member_cache.get_member_ids(group_id)
+        if sender_id not in member_ids:
+            return None
+        return set(member_ids) - {sender_id}
+    if recipient_id and recipient_id != sender_id:
+        return {recipient_id}
+    return None
+
+async def send_signal(sender_id: int, kind: str, active: bool, recipient_id, group_id, recipients: Set[int]):
+    frame = {
+        "type": "signal",
+        "kind": kind,
+        "active": active,
+        "user_id": sender_id,
+        "recipient_id": recipient_id,
+        "group_id": group_id,
+        "ttl": SIGNAL_TTL_SECONDS
+    }
+    started = time.perf_counter()
+    sent = await fanout_payload(recipients, encode_frame(frame))
+    observe_fanout("signal", started, sent)
+
+async def handle_signal(sender: User, data: dict):
+    """Handle an ephemeral `signal` (typing, viewing) without touching the database
+    
+    Signals are coalesced per (user, conversation, kind): while a signal is
+    active, repeats are dropped until half its TTL has passed. Dropped or
+    rate-limited signals get no reply.
+    """
+    kind = data.get("kind")
+    if kind not in EPHEMERAL_SIGNAL_KINDS:
+        return
+    recipient_id = data.get("recipient_id")
+    group_id = data.get("group_id")
+    active = bool(data.get("active", True))
+    key = (kind, "group" if group_id else "user", group_id or recipient_id)
+    
+    now = time.monotonic()
+    user_signals = active_signals.get(sender.id, {})
+    last_sent = user_signals.get(key)
+    if active and last_sent is not None and now - last_sent < SIGNAL_TTL_SECONDS / 2:
+        return  # Still fresh on the recipients' side
+    if not active and (last_sent is None or now - last_sent >= SIGNAL_TTL_SECONDS):
+        return  # Nothing to clear: never sent, or already expired on the client
+    
+    if not take_signal_token(sender.id):
+        return
+    recipients = signal_recipients(sender.id, recipient_id, group_id)
+    if recipients is None:
+        return
+    
+    if active:
+        active_signals.setdefault(sender.id, {})[key] = now
+    else:
+        user_signals.pop(key, None)
+        if not user_signals:
+            active_signals.pop(sender.id, None)
+    await send_signal(sender.id, kind, active, recipient_id, group_id, recipients)
+
+async def clear_signals(user_id: int):
+    """Cancel a disconnected user's active signals and forget its rate limit"""
+    signal_buckets.pop(user_id, None)
+    user_signals = active_signals.pop(user_id, None)
+    if not user_signals:
+        return
+    now = time.monotonic()
+    for (kind, target, target_id), last_sent in user_signals.items():
+        if now - last_sent >= SIGNAL_TTL_SECONDS:
+            continue
+        recipient_id = target_id if target == "user" else None
+        group_id = target_id if target == "group" else None
+        recipients = signal_recipients(user_id, recipient_id, group_id)
+        if recipients:
+            try:
+                await send_signal(user_id, kind, False, recipient_id, group_id, recipients)
+            except Exception as e:
+                print(f"Error clearing signals: {e}")
@@ -1,5 +1,5 @@
 
-import React, { useState, useEffect, useMemo, useCallback } from 'react';
+import React, { useState, useEffect, useMemo, useCallback, useRef } from 'react';
 import { Theme, User, Group, ChatSession, Message, Attachment } from './types';
 import Sidebar from './components/Sidebar';
 import ChatWindow from './components/ChatWindow';
@@ -8,17 +8,42 @@ import GroupManagement from './components/GroupManagement';
 import ProfileModal from './components/ProfileModal';
 import Login from './components/Login';
 import Register from './components/Register';
-import { authApi, usersApi, friendsApi, groupsApi, messagesApi } from './services/api';
+import { authApi, usersApi, friendsApi, groupsApi, messagesApi, syncApi, DirectoryUser, SyncResponse } from './services/api';
 import { getWebSocket, WebSocketMessage } from './services/websocket';
 
+// Strangers are paged from the user directory instead of loading every user
+const STRANGERS_PAGE_SIZE = 50;
+// Upper bound of one ?ids= directory lookup (DIRECTORY_MAX_LIMIT on the server)
+const DIRECTORY_LOOKUP_LIMIT = 200;
+
+const directoryToUser = (u: DirectoryUser): User => ({
+  id: u.id,
+  name: u.name,
+  email: '',
+  avatar: u.avatar || '',
+  status: u.status,
+});
+
+// Append users not already in the list; earlier entries (e.g. friends) win
+const mergeUsers = (base: User[], extra: User[]): User[] => {
+  const known = new Set(base.map(u => u.id));
+  return [...base, ...extra.filter(u => !known.has(u.id))];
+};
+
 const App: React.FC = () => {
   const [theme, setTheme] = useState<Theme>('light');
   const [authView, setAuthView] = useState<'login' | 'register' | 'chat'>('login');
   const [currentUser, setCurrentUser] = useState<User | null>(null);
   const [users, setUsers] = useState<User[]>([]);
+  const [strangersCursor, setStrangersCursor] = useState<string | null>(null);
+  // Change log version the loaded lists reflect; a reconnect asks /api/sync for what changed since
+  const syncVersionRef = useRef<number | null>(null);
   const [groups, setGroups] = useState<Group[]>([]);
   const [messages, setMessages] = useState<Message[]>([]);
   const [activeSession, setActiveSession] = useState<ChatSession | null>(null);
+  // Typing signals: {"personal:2" | "group:5": {userId: expiresAt}}
+  const [typing, setTyping] = useState<Record<string, Record<number, number>>>({});
+  const [now, setNow] = useState(Date.now());
   const [isManagingGroup, setIsManagingGroup] = useState(false);
   const [isProfileOpen, setIsProfileOpen] = useState(false);
   const [isMobileSidebarOpen, setIsMobileSidebarOpen] = useState(false);
@@ -104,17 +129,32 @@ const App: React.FC = () => {
     if (!currentUser) return;
     setLoading(true);
     try {
-      // Load users (for Strangers list)
-      const allUsers = await usersApi.getUsers();
-      setUsers(allUsers);
+      // Record the baseline first, so changes made while the lists load are synced again
+      const { version } = await syncApi.getChanges();
       
       // Load friends
       const friends = await friendsApi.getFriends();
       setFriendIds(friends.map(f => f.id));
       
+      // First page of the directory (for Strangers list)
+      const page = await usersApi.searchDirectory({ limit: STRANGERS_PAGE_SIZE });
+      let loaded = mergeUsers(friends, page.items.map(directoryToUser));
+      setStrangersCursor(page.nextCursor);
+      
       // Load groups
       const userGroups = await groupsApi.getGroups();
       setGroups(userGroups);
+      
+      // Group members outside the loaded pages, so their names can be shown
+      const known = new Set(loaded.map(u => u.id));
+      const missing = [...new Set(userGroups.flatMap(g => g.members))]
+        .filter(id => id !== currentUser.id && !known.has(id));
+      for (let i = 0; i < missing.length; i += DIRECTORY_LOOKUP_LIMIT) {
+        const lookup = await usersApi.lookupUsers(missing.slice(i, i + DIRECTORY_LOOKUP_LIMIT));
+        loaded = mergeUsers(loaded, lookup.items.map(directoryToUser));
+      }
+      setUsers(loaded);
+      syncVersionRef.current = version;
     } catch (err) {
       console.error('Failed to load data:', err);
     } finally {
@@ -122,11 +162,79 @@ const App: React.FC = () => {
     }
   };
 
+  const loadMoreStrangers = async () => {
+    if (!strangersCursor) return;
+    try {
+      const page = await usersApi.searchDirectory({ limit: STRANGERS_PAGE_SIZE, cursor: strangersCursor });
+      setUsers(prev => mergeUsers(prev, page.items.map(directoryToUser)));
+      setStrangersCursor(page.nextCursor);
+    } catch (err) {
+      console.error('Failed to load more users:', err);
+    }
+  };
+
+  // Apply friends, groups and profile changes missed while the WebSocket was down
+  const syncChanges = async () => {
+    const since = syncVersionRef.current;
+    if (since === null) return;
+    try {
+      const changes: SyncResponse = await syncApi.getChanges(since);
+      if (changes.fullResync) {
+        await loadData();
+        return;
+      }
+      const updatedUsers = new Map(changes.users.map(u => [u.id, u]));
+      const added = changes.friends.added;
+      const removed = new Set(changes.friends.removed);
+      let newUsers: User[] = [];
+      if (added.length) {
+        const lookup = await usersApi.lookupUsers(added.slice(0, DIRECTORY_LOOKUP_LIMIT));
+        newUsers = lookup.items.map(directoryToUser);
+      }
+      setUsers(prev => mergeUsers(
+        prev.map(u => updatedUsers.has(u.id) ? { ...u, ...updatedUsers.get(u.id)! } : u),
+        newUsers
+      ));
+      setFriendIds(prev => [...prev.filter(id => !removed.has(id) && !added.includes(id)), ...added]);
+      const updatedGroups = new Map(changes.groups.updated.map(g => [g.id, g]));
+      const removedGroups = new Set(changes.groups.removed);
+      setGroups(prev => [
+        ...prev.filter(g => !removedGroups.has(g.id) && !updatedGroups.has(g.id)),
+        ...changes.groups.updated,
+      ]);
+      syncVersionRef.current = changes.version;
+    } catch (err) {
+      console.error('Failed to sync changes:', err);
+    }
+  };
+
   const connectWebSocket = () => {
     const ws = getWebSocket();
     ws.connect();
     
+    ws.onConnect((reconnected) => {
+      // Friend and group events sent while disconnected are not replayed
+      if (reconnected) {
+        syncChanges();
+      }
+    });
+    
     ws.onMessage((message: WebSocketMessage) => {
+      if (message.type === 'signal' && message.kind === 'typing' && message.user_id) {
+        // Group signals are keyed by group; personal ones by the sender
+        const key = message.group_id ? `group:${message.group_id}` : `personal:${message.user_id}`;
+        const senderId = message.user_id;
+        setTyping(prev => {
+          const entries = { ...(prev[key] || {}) };
+          if (message.active) {
+            entries[senderId] = Date.now() + (message.ttl || 6) * 1000;
+          } else {
+            delete entries[senderId];
+          }
+          return { ...prev, [key]: entries };
+        });
+        return;
+      }
       if (message.type === 'message' && message.id) {
         const newMessage: Message = {
           id: message.id,
@@ -140,6 +248,11 @@ const App: React.FC = () => {
         
         // Check if this is an update to a pending message or a new message
         setMessages(prev => {
+          // Already shown (e.g. loaded over REST, or delivered live and replayed)
+          if (prev.some(m => m.id === newMessage.id)) {
+            return prev;
+          }
+          
           // Check if we have a pending message (temporary ID) that matches
           const pendingIndex = prev.findIndex(m => 
             m.id < 0 && // Temporary ID (negative)
@@ -233,7 +346,8 @@ const App: React.FC = () => {
       } else if (message.type === 'group_change') {
         // Reload groups when group is created/updated/deleted
         if (message.action === 'created' || message.action === 'updated' || message.action === 'deleted' || 
-            message.action === 'member_added' || message.action === 'member_removed') {
+            message.action === 'member_added' || message.action === 'member_removed' ||
+            message.action === 'members_updated') {
           loadData();
           
           // If it's a member_added or member_removed, also show system message in active chat
@@ -278,6 +392,8 @@ const App: React.FC = () => {
     setActiveSession(null);
     setMessages([]);
     setUsers([]);
+    setStrangersCursor(null);
+    syncVersionRef.current = null;
     setGroups([]);
     setFriendIds([]);
   };
@@ -338,6 +454,39 @@ const App: React.FC = () => {
     }
   }, [activeSession?.id, activeSession?.type, currentUser?.id]);
 
+  // Tick while anyone is typing so indicators expire after their TTL
+  useEffect(() => {
+    if (!Object.values(typing).some(entries => Object.keys(entries).length > 0)) return;
+    const timer = setInterval(() => {
+      const current = Date.now();
+      setNow(current);
+      // Drop expired entries so the timer stops once nobody is typing
+      setTyping(prev => {
+        const next: Record<string, Record<number, number>> = {};
+        Object.entries(prev).forEach(([key, entries]) => {
+          const live = Object.entries(entries).filter(([, expiresAt]) => expiresAt > current);
+          if (live.length > 0) next[key] = Object.fromEntries(live);
+        });
+        return next;
+      });
+    }, 1000);
+    return () => clearInterval(timer);
+  }, [typing]);
+
+  // Watch presence of whoever is in the open chat (friends are always pushed)
+  useEffect(() => {
+    if (!currentUser) return;
+    const ws = getWebSocket();
+    if (activeSession?.type === 'group') {
+      ws.subscribePresence({ groupId: activeSession.id });
+    } else if (activeSession?.type === 'personal') {
+      ws.subscribePresence({ userIds: [activeSession.id], groupId: null });
+      return () => ws.unsubscribePresence([activeSession.id]);
+    } else {
+      ws.subscribePresence({ groupId: null });
+    }
+  }, [activeSession?.id, activeSession?.type, currentUser?.id]);
+
   const loadMessages = async () => {
     if (!activeSession || !currentUser) return;
     
@@ -361,6 +510,7 @@ const App: React.FC = () => {
       convertedMessages.sort((a, b) => a.timestamp - b.timestamp);
       
       setMessages(convertedMessages);
+      getWebSocket().noteLoadedMessages(convertedMessages.map(m => m.id));
       
       // Scroll to bottom after messages are loaded
       setTimeout(() => {
@@ -468,6 +618,20 @@ const App: React.FC = () => {
     }
   }, [messages, activeSession, currentUser]);
 
+  const typingUserIds = activeSession
+    ? Object.entries(typing[`${activeSession.type}:${activeSession.id}`] || {})
+        .filter(([, expiresAt]) => expiresAt > now)
+        .map(([id]) => Number(id))
+    : [];
+
+  const handleTyping = (active: boolean) => {
+    if (!activeSession) return;
+    // The server coalesces repeats, so every keystroke can be forwarded
+    getWebSocket().sendSignal('typing', active, activeSession.type === 'group'
+      ? { groupId: activeSession.id }
+      : { recipientId: activeSession.id });
+  };
+
   const activeGroup = activeSession?.type === 'group' 
     ? groups.find(g => g.id === activeSession.id) 
     : null;
@@ -508,6 +672,8 @@ const App: React.FC = () => {
           onOpenProfile={() => setIsProfileOpen(true)}
           friendIds={friendIds}
           onAddFriend={handleAddFriend}
+          hasMoreStrangers={strangersCursor !== null}
+          onLoadMoreStrangers={loadMoreStrangers}
           onCloseMobile={() => setIsMobileSidebarOpen(false)}
         />
       </div>
@@ -551,6 +717,8 @@ const App: React.FC = () => {
                 currentUser={currentUser}
                 users={users}
                 onSendMessage={sendMessage}
+                typingUserIds={typingUserIds}
+                onTyping={handleTyping}
               />
             )
           ) : (
@@ -1,7 +1,7 @@
 
 import React, { useState, useEffect, useRef } from 'react';
 import { User, Message, ChatSession, Attachment } from '../types';
-import { messagesApi } from '../services/api';
+import { messagesApi, avatarVariant, avatarFallback } from '../services/api';
 
 interface ChatWindowProps {
   session: ChatSession;
@@ -9,9 +9,11 @@ interface ChatWindowProps {
   currentUser: User;
   users: User[];
   onSendMessage: (text?: string, attachment?: Attachment) => void;
+  typingUserIds?: number[];
+  onTyping?: (active: boolean) => void;
 }
 
-const ChatWindow: React.FC<ChatWindowProps> = ({ session, messages, currentUser, users, onSendMessage }) => {
+const ChatWindow: React.FC<ChatWindowProps> = ({ session, messages, currentUser, users, onSendMessage, typingUserIds = [], onTyping }) => {
   const [inputText, setInputText] = useState('');
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
@@ -37,6 +39,7 @@ const ChatWindow: React.FC<ChatWindowProps> = ({ session, messages, currentUser,
     if (inputText.trim()) {
       onSendMessage(inputText);
       setInputText('');
+      onTyping?.(false);
     }
   };
 
@@ -82,7 +85,16 @@ const ChatWindow: React.FC<ChatWindowProps> = ({ session, messages, currentUser,
     if (attachment.isImage) {
       return (
         <div className="mt-2 rounded-lg overflow-hidden border border-gray-200 dark:border-gray-700 max-w-full">
-          <img src={attachment.url} alt={attachment.name} className="max-w-full h-auto block" />
+          <a href={attachment.url} target="_blank" rel="noopener noreferrer">
+            <img
+              src={attachment.variants?.thumb || attachment.url}
+              srcSet={attachment.variants ? `${attachment.variants.thumb} 320w, ${attachment.variants.medium} 960w` : undefined}
+              sizes="(max-width: 640px) 80vw, 320px"
+              alt={attachment.name}
+              loading="lazy"
+              className="max-w-full h-auto block"
+            />
+          </a>
         </div>
       );
     }
@@ -134,7 +146,7 @@ const ChatWindow: React.FC<ChatWindowProps> = ({ session, messages, currentUser,
           return (
             <div key={msg.id} className={`flex items-end gap-2 ${isMeSent ? 'flex-row-reverse' : 'flex-row'}`}>
               <div className="relative flex-shrink-0">
-                <img src={sender.avatar} className="w-7 h-7 sm:w-8 sm:h-8 rounded-full border border-gray-100 dark:border-gray-800 object-cover" alt={sender.name} />
+                <img src={avatarVariant(sender.avatar, 64)} onError={avatarFallback(sender.avatar)} className="w-7 h-7 sm:w-8 sm:h-8 rounded-full border border-gray-100 dark:border-gray-800 object-cover" alt={sender.name} />
                 {sender.status === 'online' && (
                   <span className="absolute bottom-0 right-0 w-2 h-2 bg-green-500 border border-white dark:border-gray-900 rounded-full"></span>
                 )}
@@ -163,6 +175,11 @@ const ChatWindow: React.FC<ChatWindowProps> = ({ session, messages, currentUser,
       </div>
 
       <div className="p-3 sm:p-4 border-t border-gray-100 dark:border-gray-800 bg-white/50 dark:bg-gray-900/50">
+        {typingUserIds.length > 0 && (
+          <p className="text-xs text-gray-400 mb-2 px-1">
+            {typingUserIds.map(id => users.find(u => u.id === id)?.name || `User ${id}`).join(', ')} typing...
+          </p>
+        )}
         <form onSubmit={handleSend} className="flex gap-2 items-center">
           <input 
             type="file" 
@@ -183,7 +200,10 @@ const ChatWindow: React.FC<ChatWindowProps> = ({ session, messages, currentUser,
           <input
             type="text"
             value={inputText}
-            onChange={(e) => setInputText(e.target.value)}
+            onChange={(e) => {
+              setInputText(e.target.value);
+              onTyping?.(e.target.value.length > 0);
+            }}
             placeholder="Type a message..."
             className="flex-1 min-w-0 bg-gray-100 dark:bg-gray-800 border-none rounded-xl px-4 py-2.5 sm:py-3 focus:ring-2 focus:ring-primary outline-none transition-all dark:text-white text-sm"
           />
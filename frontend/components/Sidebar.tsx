@@ -1,6 +1,7 @@
 
 import React, { useState, useRef, useEffect } from 'react';
 import { User, Group, ChatSession, Theme } from '../types';
+import { avatarVariant, avatarFallback } from '../services/api';
 
 interface SidebarProps {
   users: User[];
@@ -15,12 +16,15 @@ interface SidebarProps {
   onOpenProfile: () => void;
   friendIds: number[];
   onAddFriend: (userId: number) => void;
+  hasMoreStrangers?: boolean;
+  onLoadMoreStrangers?: () => void;
   onCloseMobile?: () => void;
 }
 
 const Sidebar: React.FC<SidebarProps> = ({ 
   users, groups, activeSession, setActiveSession, currentUser, onNewGroup,
-  theme, toggleTheme, onLogout, onOpenProfile, friendIds, onAddFriend, onCloseMobile
+  theme, toggleTheme, onLogout, onOpenProfile, friendIds, onAddFriend,
+  hasMoreStrangers = false, onLoadMoreStrangers, onCloseMobile
 }) => {
   const [expanded, setExpanded] = useState({
     friends: true,
@@ -58,7 +62,7 @@ const Sidebar: React.FC<SidebarProps> = ({
       }`}
     >
       <div className="relative flex-shrink-0">
-        <img src={user.avatar} className="w-9 h-9 rounded-full object-cover border border-gray-200 dark:border-gray-700" alt="" />
+        <img src={avatarVariant(user.avatar, 64)} onError={avatarFallback(user.avatar)} className="w-9 h-9 rounded-full object-cover border border-gray-200 dark:border-gray-700" alt="" />
         {user.status === 'online' && (
           <span className="absolute bottom-0 right-0 w-2.5 h-2.5 bg-green-500 border-2 border-white dark:border-gray-900 rounded-full"></span>
         )}
@@ -78,7 +82,7 @@ const Sidebar: React.FC<SidebarProps> = ({
       className="w-full flex items-center gap-3 px-3 py-2.5 rounded-xl transition-all mb-1 group"
     >
       <div className="relative flex-shrink-0 opacity-60">
-        <img src={user.avatar} className="w-9 h-9 rounded-full object-cover grayscale-[40%]" alt="" />
+        <img src={avatarVariant(user.avatar, 64)} onError={avatarFallback(user.avatar)} className="w-9 h-9 rounded-full object-cover grayscale-[40%]" alt="" />
       </div>
       <div className="flex-1 text-left min-w-0">
         <p className="text-sm font-semibold text-gray-500 dark:text-gray-400 truncate">{user.name}</p>
@@ -232,11 +236,19 @@ const Sidebar: React.FC<SidebarProps> = ({
           >
             <span className="flex items-center gap-2">
               <svg className={`w-3 h-3 transition-transform duration-200 ${expanded.strangers ? 'rotate-90' : ''}`} fill="none" stroke="currentColor" viewBox="0 0 24 24"><path strokeLinecap="round" strokeLinejoin="round" strokeWidth={3} d="M9 5l7 7-7 7" /></svg>
-              Strangers ({strangers.length})
+              Strangers ({strangers.length}{hasMoreStrangers ? '+' : ''})
             </span>
           </button>
-          <div className={`overflow-hidden transition-all duration-300 ${expanded.strangers ? 'max-h-[1000px] opacity-100 mt-1' : 'max-h-0 opacity-0'}`}>
+          <div className={`overflow-hidden transition-all duration-300 ${expanded.strangers ? 'max-h-[1000px] overflow-y-auto opacity-100 mt-1' : 'max-h-0 opacity-0'}`}>
             {strangers.map(renderStrangerItem)}
+            {hasMoreStrangers && onLoadMoreStrangers && (
+              <button
+                onClick={onLoadMoreStrangers}
+                className="w-full px-3 py-2 text-xs font-semibold text-primary hover:bg-gray-100 dark:hover:bg-gray-800 rounded-xl transition-colors"
+              >
+                Load more
+              </button>
+            )}
           </div>
         </section>
       </div>
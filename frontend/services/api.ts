@@ -1,4 +1,6 @@
 // API Client for Chat Room Backend
+import type { SyntheticEvent } from 'react';
+
 const API_BASE_URL = 'http://localhost:8000/api';
 
 // Helper function to convert snake_case to camelCase
@@ -23,6 +25,25 @@ function toCamelCase(obj: any): any {
   return obj;
 }
 
+// Small avatar variant generated at upload time (e.g. /api/uploads/<sha>_64.webp);
+// other URLs are returned unchanged
+export function avatarVariant(url: string, size: 64 | 200): string {
+  const match = url?.match(/^(.*\/api\/uploads\/[0-9a-f]{64})\.webp$/);
+  return match ? `${match[1]}_${size}.webp` : url;
+}
+
+// Fall back to the original avatar when a variant has not been generated yet
+export function avatarFallback(url: string) {
+  return (event: SyntheticEvent<HTMLImageElement>) => {
+    if (event.currentTarget.src !== url) event.currentTarget.src = url;
+  };
+}
+
+// Files larger than this use the resumable upload endpoints
+const RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const RESUMABLE_CHUNK_SIZE = 4 * 1024 * 1024;
+const RESUMABLE_MAX_RETRIES = 5;
+
 // Helper function to convert camelCase to snake_case
 function toSnakeCase(obj: any): any {
   if (obj === null || obj === undefined) {
@@ -81,6 +102,55 @@ async function apiRequest<T>(
   return toCamelCase(data) as T;
 }
 
+// Large files: send in chunks and pick up from the server's offset after a failure
+async function uploadMessageResumable(
+  file: File,
+  recipientId?: number,
+  groupId?: number,
+  onProgress?: (sent: number, total: number) => void
+): Promise<Message> {
+  const upload = await apiRequest<{ uploadId: string; offset: number }>('/messages/uploads', {
+    method: 'POST',
+    body: JSON.stringify({
+      filename: file.name,
+      size: file.size,
+      contentType: file.type || undefined,
+      recipientId,
+      groupId,
+    }),
+  });
+
+  let offset = upload.offset;
+  let failures = 0;
+  while (offset < file.size) {
+    try {
+      const response = await fetch(
+        `${API_BASE_URL}/messages/uploads/${upload.uploadId}?offset=${offset}`,
+        {
+          method: 'PUT',
+          credentials: 'include',
+          headers: { 'Content-Type': 'application/octet-stream' },
+          body: file.slice(offset, offset + RESUMABLE_CHUNK_SIZE),
+        }
+      );
+      if (!response.ok) throw new Error(`HTTP ${response.status}`);
+      offset = (await response.json()).offset;
+      failures = 0;
+      onProgress?.(offset, file.size);
+    } catch (error) {
+      if (++failures > RESUMABLE_MAX_RETRIES) throw error;
+      await new Promise(resolve => setTimeout(resolve, 500 * 2 ** failures));
+      // Part of the chunk may have arrived: continue from what the server has
+      const status = await apiRequest<{ offset: number }>(`/messages/uploads/${upload.uploadId}`);
+      offset = status.offset;
+    }
+  }
+
+  return apiRequest<Message>(`/messages/uploads/${upload.uploadId}/complete`, {
+    method: 'POST',
+  });
+}
+
 // Auth API
 export const authApi = {
   register: async (name: string, email: string, password: string) => {
@@ -118,6 +188,19 @@ export const usersApi = {
     return apiRequest<User>(`/users/${userId}`);
   },
   
+  searchDirectory: async (params: { q?: string; match?: 'prefix' | 'contains'; limit?: number; cursor?: string }) => {
+    const query = new URLSearchParams();
+    if (params.q) query.set('q', params.q);
+    if (params.match) query.set('match', params.match);
+    if (params.limit) query.set('limit', String(params.limit));
+    if (params.cursor) query.set('cursor', params.cursor);
+    return apiRequest<{ items: DirectoryUser[]; nextCursor: string | null }>(`/users/directory?${query.toString()}`);
+  },
+  
+  lookupUsers: async (userIds: number[]) => {
+    return apiRequest<{ items: DirectoryUser[] }>(`/users/directory?ids=${userIds.join(',')}`);
+  },
+  
   updateMe: async (updates: { name?: string; email?: string }) => {
     return apiRequest<User>('/users/me', {
       method: 'PUT',
@@ -164,6 +247,14 @@ export const friendsApi = {
   },
 };
 
+// Sync API: friends, groups and profile changes since a change log version
+export const syncApi = {
+  // Without `since`, only the current version (the baseline to record before loading lists)
+  getChanges: async (since?: number) => {
+    return apiRequest<SyncResponse>(since === undefined ? '/sync' : `/sync?since=${since}`);
+  },
+};
+
 // Groups API
 export const groupsApi = {
   getGroups: async () => {
@@ -251,6 +342,9 @@ export const messagesApi = {
   },
   
   uploadMessage: async (file: File, recipientId?: number, groupId?: number) => {
+    if (file.size > RESUMABLE_UPLOAD_THRESHOLD) {
+      return uploadMessageResumable(file, recipientId, groupId);
+    }
     const formData = new FormData();
     formData.append('file', file);
     if (recipientId !== undefined) formData.append('recipient_id', recipientId.toString());
@@ -270,6 +364,8 @@ export const messagesApi = {
     const data = await response.json();
     return toCamelCase(data) as Message;
   },
+  
+  uploadMessageResumable,
 };
 
 // Types (matching API response format)
@@ -281,12 +377,28 @@ export interface User {
   status: 'online' | 'offline';
 }
 
+export interface DirectoryUser {
+  id: number;
+  name: string;
+  avatar: string | null;
+  status: 'online' | 'offline';
+}
+
+export interface SyncResponse {
+  version: number;
+  fullResync: boolean;
+  users: User[];
+  friends: { added: number[]; removed: number[] };
+  groups: { updated: Group[]; removed: number[] };
+}
+
 export interface Attachment {
   url: string;
   name: string;
   mimeType: string;
   size: number;
   isImage: boolean;
+  variants?: Record<string, string>;
 }
 
 export interface Message {
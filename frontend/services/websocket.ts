@@ -3,7 +3,7 @@
 const WS_BASE_URL = 'ws://localhost:8000/ws/chat';
 
 export interface WebSocketMessage {
-  type: 'message' | 'connected' | 'error' | 'user_status_update' | 'friend_change' | 'group_change' | 'message_read' | 'user_login' | 'user_logout' | 'system_message' | 'message_notification';
+  type: 'message' | 'connected' | 'error' | 'user_status_update' | 'friend_change' | 'group_change' | 'message_read' | 'user_login' | 'user_logout' | 'system_message' | 'message_notification' | 'replay' | 'replay_complete' | 'batch' | 'batch_ack' | 'bundle' | 'presence_snapshot' | 'signal';
   id?: number;
   senderId?: number;
   recipientId?: number;
@@ -15,6 +15,7 @@ export interface WebSocketMessage {
     mimeType: string;
     size: number;
     isImage: boolean;
+    variants?: Record<string, string>;
   };
   timestamp?: string;
   message?: string;
@@ -34,11 +35,46 @@ export interface WebSocketMessage {
   // Message notification
   senderName?: string;
   groupName?: string;
+  // Reconnect replay (last_message_id also on `connected`: the server's latest id)
+  messages?: WebSocketMessage[];
+  count?: number;
+  last_message_id?: number;
+  truncated?: boolean;
+  // Batch delivery
+  notifications?: WebSocketMessage[];
+  reads?: WebSocketMessage[];
+  // Bundled frames (large-group fan-out)
+  frames?: WebSocketMessage[];
+  // Presence snapshot
+  users?: { user_id: number; user_name: string; status: 'online' | 'offline' }[];
+  // Ephemeral signal (typing / viewing), fields as sent by the server
+  kind?: SignalKind;
+  active?: boolean;
+  ttl?: number;
+  user_id?: number;
+  recipient_id?: number | null;
+  group_id?: number | null;
 }
 
+export type SignalKind = 'typing' | 'viewing';
+
+export type BatchOperation =
+  | { type: 'message'; text?: string; attachment?: WebSocketMessage['attachment']; recipient_id?: number; group_id?: number }
+  | { type: 'read'; message_id: number };
+
+export interface PresenceInterest {
+  userIds?: number[];
+  groupId?: number | null;
+  global?: boolean;
+}
+
+// Recently dispatched message ids remembered to drop duplicates
+const SEEN_MESSAGE_IDS_LIMIT = 1000;
+
 export type MessageHandler = (message: WebSocketMessage) => void;
 export type ErrorHandler = (error: Event) => void;
-export type ConnectHandler = () => void;
+// reconnected is false for the first connection after connect()/disconnect()
+export type ConnectHandler = (reconnected: boolean) => void;
 export type DisconnectHandler = () => void;
 
 export class ChatWebSocket {
@@ -51,6 +87,11 @@ export class ChatWebSocket {
   private connectHandlers: ConnectHandler[] = [];
   private disconnectHandlers: DisconnectHandler[] = [];
   private isManualClose = false;
+  private lastMessageId: number | null = null;
+  private hasConnected = false;
+  // A message sent while the server replays can arrive both live and in `replay`
+  private seenMessageIds = new Set<number>();
+  private presenceInterest: PresenceInterest = {};
 
   connect(): void {
     if (this.ws && this.ws.readyState === WebSocket.OPEN) {
@@ -58,12 +99,20 @@ export class ChatWebSocket {
     }
 
     this.isManualClose = false;
-    this.ws = new WebSocket(WS_BASE_URL);
+    // Resume from the last seen message so the server replays what we missed
+    const url = this.lastMessageId !== null
+      ? `${WS_BASE_URL}?last_message_id=${this.lastMessageId}`
+      : WS_BASE_URL;
+    this.ws = new WebSocket(url);
 
     this.ws.onopen = () => {
       console.log('WebSocket connected');
       this.reconnectAttempts = 0;
-      this.connectHandlers.forEach(handler => handler());
+      const reconnected = this.hasConnected;
+      this.hasConnected = true;
+      this.connectHandlers.forEach(handler => handler(reconnected));
+      // Subscriptions live on the connection, so restore them after a reconnect
+      this.sendPresenceInterest(this.presenceInterest);
       
       // Start heartbeat to keep connection alive
       this.startHeartbeat();
@@ -72,7 +121,33 @@ export class ChatWebSocket {
     this.ws.onmessage = (event) => {
       try {
         const message: WebSocketMessage = JSON.parse(event.data);
-        this.messageHandlers.forEach(handler => handler(message));
+        if (message.type === 'replay' && message.messages) {
+          // Unpack replayed messages so handlers see ordinary message frames
+          message.messages.forEach(replayed => this.dispatch(replayed));
+          return;
+        }
+        if (message.type === 'bundle' && message.frames) {
+          // Several frames merged into one by the server
+          message.frames.forEach(m => this.dispatch(m));
+          return;
+        }
+        if (message.type === 'batch') {
+          // Combined delivery frame: messages, notifications and read receipts
+          (message.messages || []).forEach(m => this.dispatch(m));
+          (message.notifications || []).forEach(m => this.dispatch(m));
+          (message.reads || []).forEach(m => this.dispatch(m));
+          return;
+        }
+        if (message.type === 'connected' && this.lastMessageId === null && message.last_message_id !== undefined) {
+          // Nothing seen yet: later messages arrive live, so replay from the server's latest id
+          this.lastMessageId = message.last_message_id;
+        }
+        if (message.type === 'presence_snapshot' && message.users) {
+          // Current statuses of newly watched users, as ordinary status updates
+          message.users.forEach(u => this.dispatch({ type: 'user_status_update', ...u } as WebSocketMessage));
+          return;
+        }
+        this.dispatch(message);
       } catch (error) {
         console.error('Failed to parse WebSocket message:', error);
       }
@@ -101,6 +176,10 @@ export class ChatWebSocket {
   disconnect(): void {
     this.stopHeartbeat();
     this.isManualClose = true;
+    this.lastMessageId = null;
+    this.hasConnected = false;
+    this.seenMessageIds.clear();
+    this.presenceInterest = {};
     if (this.ws) {
       this.ws.close();
       this.ws = null;
@@ -116,6 +195,7 @@ export class ChatWebSocket {
       mimeType: string;
       size: number;
       isImage: boolean;
+      variants?: Record<string, string>;
     },
     recipientId?: number,
     groupId?: number
@@ -135,6 +215,59 @@ export class ChatWebSocket {
     this.ws.send(JSON.stringify(message));
   }
 
+  sendBatch(operations: BatchOperation[], batchId?: string): void {
+    if (!this.ws || this.ws.readyState !== WebSocket.OPEN) {
+      throw new Error('WebSocket is not connected');
+    }
+
+    this.ws.send(JSON.stringify({
+      type: 'batch',
+      batch_id: batchId,
+      operations,
+    }));
+  }
+
+  sendSignal(kind: SignalKind, active: boolean, target: { recipientId?: number; groupId?: number }): void {
+    // Best effort: signals are never queued or retried
+    if (!this.ws || this.ws.readyState !== WebSocket.OPEN) return;
+    this.ws.send(JSON.stringify({
+      type: 'signal',
+      kind,
+      active,
+      recipient_id: target.recipientId,
+      group_id: target.groupId,
+    }));
+  }
+
+  subscribePresence(interest: PresenceInterest): void {
+    // Explicit user ids accumulate; group and global replace the previous value
+    this.presenceInterest = {
+      userIds: Array.from(new Set([...(this.presenceInterest.userIds || []), ...(interest.userIds || [])])),
+      groupId: interest.groupId !== undefined ? interest.groupId : this.presenceInterest.groupId,
+      global: interest.global !== undefined ? interest.global : this.presenceInterest.global,
+    };
+    if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+      this.sendPresenceInterest(interest);
+    }
+  }
+
+  unsubscribePresence(userIds: number[]): void {
+    this.presenceInterest.userIds = (this.presenceInterest.userIds || []).filter(id => !userIds.includes(id));
+    if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+      this.ws.send(JSON.stringify({ type: 'unsubscribe_presence', user_ids: userIds }));
+    }
+  }
+
+  private sendPresenceInterest(interest: PresenceInterest): void {
+    if (!interest.userIds?.length && interest.groupId === undefined && interest.global === undefined) {
+      return;
+    }
+    const frame: Record<string, unknown> = { type: 'subscribe_presence', user_ids: interest.userIds || [] };
+    if (interest.groupId !== undefined) frame.group_id = interest.groupId;
+    if (interest.global !== undefined) frame.global = interest.global;
+    this.ws?.send(JSON.stringify(frame));
+  }
+
   onMessage(handler: MessageHandler): () => void {
     this.messageHandlers.push(handler);
     return () => {
@@ -175,6 +308,33 @@ export class ChatWebSocket {
     };
   }
 
+  private dispatch(message: WebSocketMessage): void {
+    if (message.type === 'message' && message.id) {
+      if (this.seenMessageIds.has(message.id)) {
+        return;
+      }
+      this.seenMessageIds.add(message.id);
+      if (this.seenMessageIds.size > SEEN_MESSAGE_IDS_LIMIT) {
+        // Sets iterate in insertion order: drop the oldest id
+        this.seenMessageIds.delete(this.seenMessageIds.values().next().value as number);
+      }
+      if (this.lastMessageId === null || message.id > this.lastMessageId) {
+        this.lastMessageId = message.id;
+      }
+    }
+    this.messageHandlers.forEach(handler => handler(message));
+  }
+
+  // Advance the replay cursor past messages loaded over REST. Only while connected:
+  // a list loaded during an outage must not skip messages missed elsewhere.
+  noteLoadedMessages(messageIds: number[]): void {
+    if (!this.isConnected() || !messageIds.length) return;
+    const latest = Math.max(...messageIds);
+    if (this.lastMessageId === null || latest > this.lastMessageId) {
+      this.lastMessageId = latest;
+    }
+  }
+
   isConnected(): boolean {
     return this.ws !== null && this.ws.readyState === WebSocket.OPEN;
   }
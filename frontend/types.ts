@@ -16,6 +16,7 @@ export interface Attachment {
   mimeType: string;
   size: number;
   isImage: boolean;
+  variants?: Record<string, string>;
 }
 
 export interface Message {